@@ -0,0 +1,254 @@
+"""Stapelverarbeitung: die Exporte vieler Mandanten in einem Lauf auswerten (--stapel).
+
+Die Mandanten stammen aus einer Manifest-CSV-Datei (Spalten Mandant, Buchungen,
+Wertpapiere; relative Pfade gelten relativ zur Manifest-Datei) oder aus einem
+Verzeichnis, in dem jedes Unterverzeichnis einen Mandanten mit den Exporten unter ihren
+Standard-Namen aus PortfolioPerformance enthält.
+
+Metadaten (TFS) und VAP werden einmal eingelesen und an alle Mandanten weitergegeben;
+Wechselkurse für die aktuellen Kurse aller Wertpapier-Dateien werden vorab einmal
+abgefragt. Mit --prozesse N werden N Mandanten gleichzeitig ausgewertet. Ein Fehler in
+den Daten eines Mandanten bricht den Lauf nicht ab; er erscheint im Laufbericht.
+"""
+
+import concurrent.futures
+import copy
+import dataclasses
+import logging
+import time
+import traceback
+from collections import defaultdict
+from collections.abc import Callable
+from pathlib import Path
+
+import pandas as pd
+
+from engine import load_portfolio
+from i18n_helper import I18nHelper
+from pyfifovap import (
+    ETFMetadata,
+    ForexHelper,
+    read_tfs_metadata,
+    read_vap,
+)
+
+MANIFEST_COLUMNS = ("Mandant", "Buchungen", "Wertpapiere")
+# export file names of PortfolioPerformance in German and English
+TRANSACTIONS_FILE_NAMES = ("Alle_Buchungen.csv", "All_transactions.csv")
+SECURITIES_FILE_NAMES = ("Wertpapiere_(Standard).csv", "Securities_(Standard).csv")
+REPORT_FILE_NAME = "Laufbericht.csv"
+
+
+@dataclasses.dataclass
+class Client:
+    name: str
+    transactions_file: str
+    securities_file: str
+
+
+@dataclasses.dataclass
+class ClientRun:
+    name: str
+    seconds: float
+    num_lots: int = 0
+    files: list[str] = dataclasses.field(default_factory=list)
+    error: str = ""  # empty if the client was evaluated successfully
+
+
+def _first_existing(directory: Path, names: tuple[str, ...]) -> Path:
+    """The first of `names` in `directory`; if none exists, the first name (reported as
+    missing when the client is evaluated)."""
+    for name in names:
+        if (directory / name).is_file():
+            return directory / name
+    return directory / names[0]
+
+
+def read_clients(path: str) -> list[Client]:
+    """Read the clients of a manifest file or of the subdirectories of a directory."""
+    path = Path(path)
+    if path.is_dir():
+        return [
+            Client(
+                name=directory.name,
+                transactions_file=str(
+                    _first_existing(directory, TRANSACTIONS_FILE_NAMES)
+                ),
+                securities_file=str(_first_existing(directory, SECURITIES_FILE_NAMES)),
+            )
+            for directory in sorted(path.iterdir())
+            if directory.is_dir()
+        ]
+
+    data = pd.read_csv(path, keep_default_na=False, dtype=str)
+    missing = [column for column in MANIFEST_COLUMNS if column not in data.columns]
+    if missing:
+        raise ValueError(f"{path}: Spalte(n) {', '.join(missing)} fehlen im Manifest")
+    names = list(data["Mandant"])
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates or "" in names:
+        raise ValueError(
+            f"{path}: Mandanten-Namen müssen eindeutig und nicht leer sein "
+            f"({', '.join(sorted(duplicates)) or 'leerer Name'})"
+        )
+    return [
+        Client(
+            name=row["Mandant"],
+            transactions_file=str(path.parent / row["Buchungen"]),
+            securities_file=str(path.parent / row["Wertpapiere"]),
+        )
+        for _, row in data.iterrows()
+    ]
+
+
+def _quote_currencies(securities_file: str) -> set[str]:
+    """Currencies of the foreign-currency quotes (e.g. "USD 123,45") of a securities file."""
+    with open(securities_file, encoding="utf-8") as f:
+        is_german = "Letzter" in f.readline()
+    i18n_helper = I18nHelper(is_german=is_german)
+    quotes = pd.read_csv(
+        securities_file,
+        keep_default_na=False,
+        sep=i18n_helper.get_pp_csv_separator(),
+        usecols=[i18n_helper.get_pp_names().LATEST_QUOTE],
+        dtype=str,
+    ).iloc[:, 0]
+    return {quote.split(" ")[0] for quote in quotes if " " in quote}
+
+
+# metadata, VAP and Forex helper shared by all clients evaluated in this process
+_shared: dict[str, object] = {}
+
+
+def _init_worker(
+    tfs_metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: dict[str, dict[int, float]],
+    forex_cache: dict,
+    offline: bool,
+) -> None:
+    forex_helper = ForexHelper(offline=offline)
+    forex_helper.eur_to_forex_cache.update(forex_cache)
+    # the defaultdicts cannot be pickled with their lambda factories
+    vap: defaultdict[str, defaultdict[int, float]] = defaultdict(
+        lambda: defaultdict(float)
+    )
+    for isin, vap_by_year in vap_by_isin_and_year.items():
+        vap[isin].update(vap_by_year)
+    _shared.update(
+        tfs_metadata_by_isin=tfs_metadata_by_isin,
+        vap_by_isin_and_year=vap,
+        forex_helper=forex_helper,
+    )
+
+
+def _run_client(client: Client, args, write_outputs: Callable) -> ClientRun:
+    start = time.perf_counter()
+    client_args = copy.copy(args)
+    client_args.output = str(
+        Path(args.stapel_ausgabe) / client.name / Path(args.output).name
+    )
+    client_args.prozesse = 1
+    try:
+        portfolio, metadata_by_isin, vap_by_isin_and_year = load_portfolio(
+            client.transactions_file,
+            client.securities_file,
+            _shared["tfs_metadata_by_isin"],
+            _shared["vap_by_isin_and_year"],
+            _shared["forex_helper"],
+            isins=set(args.isin) if args.isin else None,
+            brokers=set(args.depot) if args.depot else None,
+            bought_from=args.gekauft_ab,
+        )
+        Path(client_args.output).parent.mkdir(parents=True, exist_ok=True)
+        files = write_outputs(
+            client_args, portfolio, metadata_by_isin, vap_by_isin_and_year
+        )
+    except Exception as e:  # noqa: BLE001 - reported per client in the run report
+        logging.debug(traceback.format_exc())
+        logging.error(f"Mandant {client.name}: {e}")
+        return ClientRun(
+            name=client.name,
+            seconds=time.perf_counter() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+    return ClientRun(
+        name=client.name,
+        seconds=time.perf_counter() - start,
+        num_lots=sum(
+            len(lots)
+            for lots_by_isin in portfolio.values()
+            for lots in lots_by_isin.values()
+        ),
+        files=[str(path) for path in files],
+    )
+
+
+def run_batch(args, clients: list[Client], write_outputs: Callable) -> list[ClientRun]:
+    """
+    Alle Mandanten auswerten und den Laufbericht schreiben.
+
+    `write_outputs(args, portfolio, metadata_by_isin, vap_by_isin_and_year)` schreibt die
+    Ergebnisse eines Mandanten; `args.output` zeigt dabei in dessen Ausgabe-Verzeichnis.
+    """
+    # the metadata and VAP columns are the same for German and English exports
+    i18n_helper = I18nHelper()
+    tfs_metadata_by_isin = read_tfs_metadata(args.metadaten, i18n_helper)
+    vap_by_isin_and_year = read_vap(args.vap, i18n_helper)
+    forex_helper = ForexHelper(offline=args.offline)
+    for client in clients:
+        try:
+            currencies = _quote_currencies(client.securities_file)
+        except (OSError, UnicodeDecodeError, ValueError):
+            continue  # reported when the client itself is evaluated
+        for currency in sorted(currencies):
+            forex_helper.request_factor_eur_to_forex(currency)
+    shared = (
+        tfs_metadata_by_isin,
+        {isin: dict(vap) for isin, vap in vap_by_isin_and_year.items()},
+        dict(forex_helper.eur_to_forex_cache),
+        args.offline,
+    )
+
+    start = time.perf_counter()
+    processes = min(args.prozesse, len(clients))
+    if processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=shared
+        ) as executor:
+            futures = [
+                executor.submit(_run_client, client, args, write_outputs)
+                for client in clients
+            ]
+            runs = [future.result() for future in futures]
+    else:
+        _init_worker(*shared)
+        runs = [_run_client(client, args, write_outputs) for client in clients]
+    total_seconds = time.perf_counter() - start
+
+    report_file = Path(args.stapel_ausgabe) / REPORT_FILE_NAME
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    collect_run_report(runs).to_csv(report_file, index=False)
+    failed = [run for run in runs if run.error]
+    print(
+        f"{len(runs) - len(failed)} von {len(runs)} Mandanten in {total_seconds:.1f} s "
+        f"ausgewertet, Laufbericht: {report_file}"
+    )
+    return runs
+
+
+def collect_run_report(runs: list[ClientRun]) -> pd.DataFrame:
+    """Laufbericht mit einer Zeile je Mandant: Status, Dauer, Chargen, Dateien, Fehler."""
+    return pd.DataFrame(
+        [
+            {
+                "Mandant": run.name,
+                "Status": "Fehler" if run.error else "OK",
+                "Sekunden": round(run.seconds, 3),
+                "Chargen": run.num_lots,
+                "Dateien": " ".join(run.files),
+                "Fehler": run.error,
+            }
+            for run in runs
+        ],
+        columns=["Mandant", "Status", "Sekunden", "Chargen", "Dateien", "Fehler"],
+    )
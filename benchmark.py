@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Benchmark der Verarbeitungsschritte mit synthetischen Exporten (siehe synthetic_exports.py).
+
+Misst je Größe und Export-Sprache Laufzeit und Spitzen-Speicher von read_etf_metadata,
+read_transactions_into_portfolio, read_vap und build_results_file. Die Laufzeit ist das
+Minimum über mehrere Wiederholungen; der Speicher wird in einem eigenen Durchlauf mit
+tracemalloc gemessen, damit dessen Overhead die Zeiten nicht verfälscht. Wechselkurse
+kommen aus den synthetischen Daten, es gibt keine Netzwerk-Abfragen.
+
+Die Ergebnisse werden als JSON geschrieben; mit --vergleich wird ein früheres Ergebnis
+danebengestellt.
+
+Beispiel:
+   python benchmark.py --groessen klein mittel --ausgabe benchmark.json
+   python benchmark.py --vergleich benchmark.json --ausgabe benchmark_neu.json
+"""
+
+import argparse
+import dataclasses
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from synthetic_exports import SCALES, ExportSpec, generate_exports, seed_forex_cache
+
+STAGES = (
+    "read_etf_metadata",
+    "read_transactions_into_portfolio",
+    "read_vap",
+    "build_results_file",
+)
+RESULTS_VERSION = 1
+
+
+def _pipeline(exports, out_file: Path) -> list[tuple[str, Callable[[], object]]]:
+    """The stages as callables; each one uses the results of the previous ones."""
+    from pyfifovap import (
+        ForexHelper,
+        TaxSettings,
+        build_results_file,
+        determine_language_from_transactions_file,
+        read_etf_metadata,
+        read_transactions_into_portfolio,
+        read_vap,
+    )
+
+    i18n_helper = determine_language_from_transactions_file(
+        str(exports.transactions_file)
+    )
+    forex_helper = ForexHelper(offline=True)
+    seed_forex_cache(forex_helper, exports)
+    state = {}
+
+    def metadata():
+        state["metadata_by_isin"], state["name_to_isin"] = read_etf_metadata(
+            str(exports.metadata_file),
+            i18n_helper,
+            forex_helper,
+            str(exports.securities_file),
+        )
+
+    def transactions():
+        state["portfolio"] = read_transactions_into_portfolio(
+            str(exports.transactions_file),
+            i18n_helper,
+            forex_helper,
+            state["name_to_isin"],
+        )
+
+    def vap():
+        state["vap_by_isin_and_year"] = read_vap(str(exports.vap_file), i18n_helper)
+
+    def results_file():
+        build_results_file(
+            state["portfolio"],
+            state["metadata_by_isin"],
+            state["vap_by_isin_and_year"],
+            str(out_file),
+            TaxSettings(),
+        )
+
+    return list(zip(STAGES, (metadata, transactions, vap, results_file)))
+
+
+def benchmark_exports(exports, repetitions: int, work_dir: Path) -> dict[str, dict]:
+    """Time and memory-profile each stage for one set of exports."""
+    seconds = {stage: [] for stage in STAGES}
+    for _ in range(repetitions):
+        for stage, run in _pipeline(exports, work_dir / "Ergebnisse.xlsx"):
+            start = time.perf_counter()
+            run()
+            seconds[stage].append(time.perf_counter() - start)
+
+    peak_bytes = {}
+    for stage, run in _pipeline(exports, work_dir / "Ergebnisse.xlsx"):
+        tracemalloc.start()
+        try:
+            run()
+            peak_bytes[stage] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        stage: {
+            "sekunden": [round(value, 6) for value in seconds[stage]],
+            "min_sekunden": round(min(seconds[stage]), 6),
+            "speicher_spitze_mb": round(peak_bytes[stage] / 2**20, 3),
+        }
+        for stage in STAGES
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmarks(
+    scales: dict[str, ExportSpec], languages: list[str], repetitions: int
+) -> dict:
+    """Benchmark every combination of scale and language; returns the JSON document."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale, spec in scales.items():
+            for language in languages:
+                work_dir = Path(tmp) / f"{scale}_{language}"
+                exports = generate_exports(
+                    work_dir, dataclasses.replace(spec, german=language == "de")
+                )
+                print(
+                    f"{scale}/{language}: {exports.num_transactions} Buchungen, "
+                    f"{repetitions} Wiederholung(en)..."
+                )
+                results.append(
+                    {
+                        "groesse": scale,
+                        "sprache": language,
+                        "depots": spec.accounts,
+                        "wertpapiere": spec.securities,
+                        "jahre": spec.years,
+                        "buchungen": exports.num_transactions,
+                        "stufen": benchmark_exports(exports, repetitions, work_dir),
+                    }
+                )
+    return {
+        "version": RESULTS_VERSION,
+        "zeitpunkt": datetime.datetime.now().isoformat(timespec="seconds"),
+        "umgebung": {
+            "python": platform.python_version(),
+            "plattform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": _git_commit(),
+        },
+        "ergebnisse": results,
+    }
+
+
+def compare_results(old: dict, new: dict) -> list[str]:
+    """Lines comparing the minimal times of the runs contained in both documents."""
+    old_runs = {(run["groesse"], run["sprache"]): run for run in old["ergebnisse"]}
+    lines = []
+    for run in new["ergebnisse"]:
+        old_run = old_runs.get((run["groesse"], run["sprache"]))
+        if old_run is None:
+            continue
+        for stage, figures in run["stufen"].items():
+            if stage not in old_run["stufen"]:
+                continue
+            before = old_run["stufen"][stage]["min_sekunden"]
+            after = figures["min_sekunden"]
+            lines.append(
+                f"{run['groesse']}/{run['sprache']} {stage}: {before:.3f} s -> "
+                f"{after:.3f} s ({after / before if before else float('inf'):.2f}x)"
+            )
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Laufzeit und Speicher der Verarbeitungsschritte mit synthetischen "
+        "Exporten messen"
+    )
+    parser.add_argument(
+        "--groessen",
+        nargs="+",
+        choices=list(SCALES),
+        default=["klein", "mittel"],
+        help="Größen der synthetischen Exporte (Standard: klein mittel)",
+    )
+    parser.add_argument(
+        "--sprachen",
+        nargs="+",
+        choices=["de", "en"],
+        default=["de", "en"],
+        help="Export-Sprachen (Standard: de en)",
+    )
+    parser.add_argument(
+        "--wiederholungen",
+        type=int,
+        default=3,
+        help="Zeitmessungen je Schritt, gewertet wird das Minimum (Standard: 3)",
+    )
+    parser.add_argument(
+        "--ausgabe",
+        metavar="FILE",
+        default="benchmark.json",
+        help="Ergebnisse als JSON in diese Datei schreiben (Standard: benchmark.json)",
+    )
+    parser.add_argument(
+        "--vergleich",
+        metavar="FILE",
+        help="Früheres Ergebnis (JSON), dessen Zeiten danebengestellt werden",
+    )
+    args = parser.parse_args()
+    if args.wiederholungen < 1:
+        parser.error("--wiederholungen benötigt mindestens 1")
+
+    results = run_benchmarks(
+        {scale: SCALES[scale] for scale in args.groessen},
+        args.sprachen,
+        args.wiederholungen,
+    )
+    with open(args.ausgabe, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    for run in results["ergebnisse"]:
+        for stage, figures in run["stufen"].items():
+            print(
+                f"{run['groesse']}/{run['sprache']} {stage}: "
+                f"{figures['min_sekunden']:.3f} s, {figures['speicher_spitze_mb']:.1f} MB"
+            )
+    if args.vergleich:
+        with open(args.vergleich, encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"\nVergleich mit {args.vergleich}:")
+        print("\n".join(compare_results(old, results)))
+    print(f"Ergebnisse geschrieben nach {args.ausgabe}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Spaltenorientierte Ausgabe (CSV, JSON Lines, Parquet) für die Weiterverarbeitung.
+
+Anders als in den Tabs der XLSX-Datei haben alle Chargen ein festes Schema (siehe
+lot_table_columns). Die Chargen werden während der Berechnung Zeile für Zeile geschrieben.
+"""
+
+import abc
+import csv
+import datetime
+import json
+import math
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from sortedcontainers import SortedList
+
+from profiling import counters, stage
+from pyfifovap import (
+    ETFMetadata,
+    collect_overview_summary,
+    collect_vap_summary,
+    iter_lot_records,
+    iter_summary_records,
+    lot_table_columns,
+)
+
+TEXT_COLUMNS = ("Depot", "ISIN", "Name")
+DATE_COLUMNS = ("Datum Kauf", "Datum Verkauf")
+
+
+def json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class TableWriter(abc.ABC):
+    """
+    Writes records of a fixed set of columns to a file, one at a time. Used as context
+    manager, the file is also closed if writing fails.
+    """
+
+    extension = ""
+
+    def __init__(self, path: Path, columns: list[str]):
+        self.path = path
+        self.columns = columns
+
+    @abc.abstractmethod
+    def write(self, record: dict) -> None: ...
+
+    @abc.abstractmethod
+    def close(self) -> None: ...
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvTableWriter(TableWriter):
+    extension = ".csv"
+
+    def __init__(self, path: Path, columns: list[str]):
+        super().__init__(path, columns)
+        self.file = open(path, "w", newline="", encoding="utf-8")  # noqa: SIM115 - see close()
+        try:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(columns)
+        except BaseException:
+            self.file.close()
+            raise
+
+    def write(self, record: dict) -> None:
+        self.writer.writerow(
+            [
+                "" if record[column] is None else record[column]
+                for column in self.columns
+            ]
+        )
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JsonLinesTableWriter(TableWriter):
+    extension = ".jsonl"
+
+    def __init__(self, path: Path, columns: list[str]):
+        super().__init__(path, columns)
+        self.file = open(path, "w", encoding="utf-8")  # noqa: SIM115 - see close()
+
+    def write(self, record: dict) -> None:
+        self.file.write(
+            json.dumps(
+                {column: json_value(record[column]) for column in self.columns},
+                ensure_ascii=False,
+            )
+        )
+        self.file.write("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetTableWriter(TableWriter):
+    """Parquet via pyarrow (optional dependency), written in row groups of `batch_size`."""
+
+    extension = ".parquet"
+    batch_size = 65536
+
+    def __init__(self, path: Path, columns: list[str]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path, columns)
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                (
+                    column,
+                    pa.string()
+                    if column in TEXT_COLUMNS
+                    else pa.date32()
+                    if column in DATE_COLUMNS
+                    else pa.float64(),
+                )
+                for column in columns
+            ]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch = []
+
+    def write(self, record: dict) -> None:
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.batch:
+            self.writer.write_batch(
+                self.pa.RecordBatch.from_pylist(self.batch, schema=self.schema)
+            )
+            self.batch = []
+
+    def close(self) -> None:
+        try:
+            self._flush()
+        finally:
+            self.writer.close()
+
+
+TABLE_WRITERS = {
+    "csv": CsvTableWriter,
+    "jsonl": JsonLinesTableWriter,
+    "parquet": ParquetTableWriter,
+}
+
+
+@stage("tabellen_schreiben")
+def write_columnar_results(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    out_stem: Path,
+    output_format: str,
+    args,
+    realized_gains_df: Optional[pd.DataFrame] = None,
+) -> list[Path]:
+    """
+    Write the lots, the overview and the VAP summary as `<out_stem>_chargen`,
+    `<out_stem>_uebersicht` and `<out_stem>_vap` in `output_format`, and the realized
+    gains (see collect_realized_gains_summary), if given, as `<out_stem>_realisiert`.
+    Returns the paths.
+    """
+    writer_class = TABLE_WRITERS[output_format]
+    paths = []
+
+    def table_path(table: str) -> Path:
+        path = out_stem.with_name(f"{out_stem.name}_{table}{writer_class.extension}")
+        paths.append(path)
+        return path
+
+    columns = lot_table_columns(vap_by_isin_and_year, args)
+    with writer_class(table_path("chargen"), columns) as writer:
+        for record in iter_lot_records(
+            portfolio, metadata_by_isin, vap_by_isin_and_year, columns, args
+        ):
+            writer.write(record)
+            counters["tabellenzeilen_geschrieben"] += 1
+
+    for table, df in (
+        (
+            "uebersicht",
+            collect_overview_summary(
+                portfolio, metadata_by_isin, vap_by_isin_and_year, args
+            ),
+        ),
+        ("vap", collect_vap_summary(portfolio, metadata_by_isin, vap_by_isin_and_year)),
+        *([("realisiert", realized_gains_df)] if realized_gains_df is not None else []),
+    ):
+        with writer_class(table_path(table), [str(c) for c in df.columns]) as writer:
+            for record in iter_summary_records(df):
+                writer.write(record)
+                counters["tabellenzeilen_geschrieben"] += 1
+    return paths
@@ -0,0 +1,305 @@
+"""Programmierschnittstelle: ein eingelesenes Portfolio für viele Auswertungen im selben Prozess.
+
+Unabhängig von der Kommandozeile: Steuer-Annahmen werden als `TaxSettings` übergeben und
+Fehler in den Eingabedaten als `PyFifoVapError` (bzw. Unterklassen) ausgelöst statt das
+Programm zu beenden. Die Exporte werden einmal eingelesen und per FIFO verarbeitet;
+danach lassen sich beliebig viele Steuer-Annahmen, Kurse und Szenarien darauf auswerten.
+
+    engine = PortfolioEngine.from_files("Alle_Buchungen.csv", "Wertpapiere.csv")
+    for tax_settings in (TaxSettings(), TaxSettings(kirche_9=True)):
+        print(engine.overview(tax_settings))
+
+Ergebnisse, die nur von den Eingaben und den Steuer-Annahmen abhängen, werden je
+`TaxSettings` zwischengespeichert; die zurückgegebenen DataFrames sind Kopien.
+"""
+
+import datetime
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from functools import cached_property
+from os import PathLike
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sortedcontainers import SortedList
+
+from planning import QueueView, build_queue_views
+from pyfifovap import (
+    ETFMetadata,
+    ForexHelper,
+    LotArrays,
+    PyFifoVapError,
+    SummarySheet,
+    TaxSettings,
+    build_lot_arrays,
+    build_results_file,
+    collect_overview_summary,
+    collect_vap_summary,
+    determine_language_from_transactions_file,
+    determine_tax_factor_and_header,
+    evaluate_lot_arrays,
+    filter_portfolio,
+    read_securities,
+    read_tfs_metadata,
+    read_transactions,
+    read_transactions_into_portfolio,
+    read_vap,
+    sum_per_queue,
+)
+from scenarios import ShockGrid, collect_scenario_summary
+from timeline import SNAPSHOT_INTERVAL, PortfolioTimeline
+
+# TaxSettings is frozen, so one instance can serve as default of all methods
+DEFAULT_TAX_SETTINGS = TaxSettings()
+
+
+class EmptySelectionError(PyFifoVapError):
+    """Die Auswahl nach Depot, ISIN oder Kaufdatum enthält keine Chargen."""
+
+
+def load_inputs(
+    transactions_file: str,
+    securities_file: str,
+    metadata_file: str = "etf_metadaten.csv",
+    vap_file: str = "etf_vorabpauschalen.csv",
+    offline: bool = False,
+    isins: Optional[set[str]] = None,
+    brokers: Optional[set[str]] = None,
+    bought_from: Optional[datetime.date] = None,
+) -> tuple[
+    defaultdict[str, defaultdict[str, SortedList]],
+    dict[str, ETFMetadata],
+    defaultdict[str, defaultdict[int, float]],
+]:
+    """Read and replay the exports; returns (portfolio, metadata, VAP).
+
+    Only the lots of the given ISINs and depots, bought on or after `bought_from`, are
+    kept; EmptySelectionError is raised if none remain.
+    """
+    i18n_helper = determine_language_from_transactions_file(transactions_file)
+    return load_portfolio(
+        transactions_file,
+        securities_file,
+        read_tfs_metadata(metadata_file, i18n_helper),
+        read_vap(vap_file, i18n_helper),
+        ForexHelper(offline=offline),
+        isins,
+        brokers,
+        bought_from,
+    )
+
+
+def load_portfolio(
+    transactions_file: str,
+    securities_file: str,
+    tfs_metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    forex_helper: ForexHelper,
+    isins: Optional[set[str]] = None,
+    brokers: Optional[set[str]] = None,
+    bought_from: Optional[datetime.date] = None,
+) -> tuple[
+    defaultdict[str, defaultdict[str, SortedList]],
+    dict[str, ETFMetadata],
+    defaultdict[str, defaultdict[int, float]],
+]:
+    """Like load_inputs(), with metadata, VAP and Forex cache shared by several exports."""
+    i18n_helper = determine_language_from_transactions_file(transactions_file)
+
+    # read securities/metadata first: this yields the ISIN-keyed metadata and the
+    # name -> ISIN map needed to resolve transactions that lack an ISIN.
+    metadata_by_isin, name_to_isin = read_securities(
+        securities_file, i18n_helper, forex_helper, tfs_metadata_by_isin, isins
+    )
+    portfolio = read_transactions_into_portfolio(
+        transactions_file, i18n_helper, forex_helper, name_to_isin, isins
+    )
+    if brokers or bought_from:
+        portfolio = filter_portfolio(portfolio, brokers, bought_from)
+    if (isins or brokers or bought_from) and not any(
+        lots_by_isin for lots_by_isin in portfolio.values()
+    ):
+        raise EmptySelectionError(
+            "Keine Chargen entsprechen der Auswahl (Depot/ISIN/Kaufdatum)."
+        )
+    return portfolio, metadata_by_isin, vap_by_isin_and_year
+
+
+def load_timeline(
+    transactions_file: str,
+    securities_file: str,
+    metadata_file: str = "etf_metadaten.csv",
+    vap_file: str = "etf_vorabpauschalen.csv",
+    offline: bool = False,
+    isins: Optional[set[str]] = None,
+    snapshot_interval: int = SNAPSHOT_INTERVAL,
+) -> tuple[
+    PortfolioTimeline,
+    dict[str, ETFMetadata],
+    defaultdict[str, defaultdict[int, float]],
+]:
+    """Like load_inputs(), but the lots can be restored for any date (see timeline.py)."""
+    i18n_helper = determine_language_from_transactions_file(transactions_file)
+    forex_helper = ForexHelper(offline=offline)
+    metadata_by_isin, name_to_isin = read_securities(
+        securities_file,
+        i18n_helper,
+        forex_helper,
+        read_tfs_metadata(metadata_file, i18n_helper),
+        isins,
+    )
+    timeline = PortfolioTimeline(
+        read_transactions(transactions_file, i18n_helper, name_to_isin, isins),
+        i18n_helper,
+        forex_helper,
+        name_to_isin,
+        snapshot_interval,
+    )
+    return timeline, metadata_by_isin, read_vap(vap_file, i18n_helper)
+
+
+class PortfolioEngine:
+    """Eingelesene Chargen samt Metadaten und VAP; Auswertungen je `TaxSettings`."""
+
+    def __init__(
+        self,
+        portfolio: defaultdict[str, defaultdict[str, SortedList]],
+        metadata_by_isin: dict[str, ETFMetadata],
+        vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    ):
+        self.portfolio = portfolio
+        self.metadata_by_isin = metadata_by_isin
+        self.vap_by_isin_and_year = vap_by_isin_and_year
+        self._memo: dict[tuple, pd.DataFrame] = {}
+
+    @classmethod
+    def from_files(cls, transactions_file: str, securities_file: str, **options):
+        """Read the exports once; `options` as for load_inputs()."""
+        return cls(*load_inputs(transactions_file, securities_file, **options))
+
+    @cached_property
+    def lot_arrays(self) -> LotArrays:
+        """All lots of securities with a known quote, prepared for vectorized evaluations."""
+        return build_lot_arrays(
+            self.portfolio, self.metadata_by_isin, self.vap_by_isin_and_year
+        )
+
+    @cached_property
+    def queue_views(self) -> dict[tuple[str, str], QueueView]:
+        return build_queue_views(self.lot_arrays)
+
+    def _memoized(
+        self, key: tuple, compute: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key].copy()
+
+    def overview(
+        self, tax_settings: TaxSettings = DEFAULT_TAX_SETTINGS
+    ) -> pd.DataFrame:
+        """The overview sheet: values and taxes per depot and security."""
+        return self._memoized(
+            ("overview", tax_settings),
+            lambda: collect_overview_summary(
+                self.portfolio,
+                self.metadata_by_isin,
+                self.vap_by_isin_and_year,
+                tax_settings,
+            ),
+        )
+
+    def vap_summary(self) -> pd.DataFrame:
+        """The VAP overview sheet (independent of the tax settings)."""
+        return self._memoized(
+            ("vap",),
+            lambda: collect_vap_summary(
+                self.portfolio, self.metadata_by_isin, self.vap_by_isin_and_year
+            ),
+        )
+
+    def queue_values(
+        self,
+        tax_settings: TaxSettings = DEFAULT_TAX_SETTINGS,
+        quotes: Optional[dict[str, float]] = None,
+    ) -> pd.DataFrame:
+        """
+        Brutto-Wert, KESt-pflichtiger Gewinn, Steuer und Netto-Wert je Depot und Wertpapier.
+
+        `quotes` ersetzt die aktuellen Kurse (EUR) einzelner ISINs. Wie in der Übersicht
+        fehlen Wertpapiere ohne bekannten aktuellen Kurs.
+        """
+        if quotes is None:
+            return self._memoized(
+                ("queue_values", tax_settings),
+                lambda: self._queue_values(tax_settings, {}),
+            )
+        return self._queue_values(tax_settings, quotes)
+
+    def _queue_values(
+        self, tax_settings: TaxSettings, quotes: dict[str, float]
+    ) -> pd.DataFrame:
+        lot_arrays = self.lot_arrays
+        _, kest_header = determine_tax_factor_and_header(tax_settings)
+        quote_by_queue = np.array(
+            [
+                quotes.get(isin, lot_arrays.last_quote_eur[start])
+                for (_, isin, _), start in zip(
+                    lot_arrays.queues, lot_arrays.queue_starts
+                )
+            ],
+            dtype=float,
+        )
+        per_lot = evaluate_lot_arrays(
+            lot_arrays,
+            quote_by_queue[lot_arrays.queue_index] if len(lot_arrays) else np.zeros(0),
+            tax_settings,
+        )
+        per_queue = {
+            component: sum_per_queue(lot_arrays, values)
+            for component, values in per_lot.items()
+        }
+        return pd.DataFrame(
+            {
+                "Depot": [broker for broker, _, _ in lot_arrays.queues],
+                "ISIN": [isin for _, isin, _ in lot_arrays.queues],
+                "Name": [name for _, _, name in lot_arrays.queues],
+                "Kurs": quote_by_queue,
+                "Brutto-Wert": per_queue["brutto"],
+                "KESt-pflichtiger Gewinn": per_queue["gewinn"],
+                kest_header: per_queue["steuer"],
+                "Netto-Wert": per_queue["netto"],
+            }
+        )
+
+    def scenarios(
+        self, shock_grid: ShockGrid, tax_settings: TaxSettings = DEFAULT_TAX_SETTINGS
+    ) -> pd.DataFrame:
+        """The price scenario sheet (see scenarios.py) for a shock grid."""
+        return collect_scenario_summary(
+            self.portfolio,
+            self.metadata_by_isin,
+            self.vap_by_isin_and_year,
+            shock_grid,
+            tax_settings,
+            lot_arrays=self.lot_arrays,
+        )
+
+    def write_results_file(
+        self,
+        results_file: str | PathLike,
+        tax_settings: TaxSettings = DEFAULT_TAX_SETTINGS,
+        summary_sheets: Iterable[SummarySheet] = (),
+        **options,
+    ) -> None:
+        """Write the results workbook; `options` as for build_results_file()."""
+        build_results_file(
+            self.portfolio,
+            self.metadata_by_isin,
+            self.vap_by_isin_and_year,
+            str(results_file),
+            tax_settings,
+            list(summary_sheets),
+            **options,
+        )
@@ -15,6 +15,7 @@ class PortfolioPerformanceExportNames:
     SECURITY: str
     CASH_ACCOUNT: str
     NET_TRANSACTION_VALUE: str
+    TAXES: str
     OFFSET_ACCOUNT: str
     NAME: str
     LATEST_QUOTE: str
@@ -28,6 +29,11 @@ class CustomCsvNames:
     PROZENT_TEILFREISTELLUNG: str = "Prozent Teilfreistellung"
     JAHR_DES_WERTZUWACHES: str = "Jahr des Wertzuwachses"
     VAP_VOR_TFS_PRO_ANTEIL: str = "Vorabpauschale vor TFS pro Anteil"
+    DATUM: str = "Datum"
+    KURS: str = "Kurs"
+    JAHR: str = "Jahr"
+    BASISZINS_PROZENT: str = "Basiszins in Prozent"
+    AUSSCHUETTUNG_PRO_ANTEIL: str = "Ausschüttung pro Anteil"
 
 
 # to support both German and US PortfolioPerformance exports...
@@ -52,6 +58,7 @@ class I18nHelper:
                 SECURITY="Wertpapier",
                 CASH_ACCOUNT="Konto",
                 NET_TRANSACTION_VALUE="Gesamtpreis",
+                TAXES="Steuern",
                 OFFSET_ACCOUNT="Gegenkonto",
                 NAME="Name",
                 LATEST_QUOTE="Letzter",
@@ -69,6 +76,7 @@ class I18nHelper:
                 SECURITY="Security",
                 CASH_ACCOUNT="Cash Account",
                 NET_TRANSACTION_VALUE="Net Transaction Value",
+                TAXES="Taxes",
                 OFFSET_ACCOUNT="Offset Account",
                 NAME="Name",
                 LATEST_QUOTE="Latest",
@@ -0,0 +1,263 @@
+"""Eingaben im Speicher halten und bei Dateiänderungen nur das Betroffene neu berechnen.
+
+Genutzt vom Abfrage-Server (--server) und vom Beobachtungsmodus (--watch). Je
+geänderter Datei wird nur neu geladen, was von ihr abhängt:
+
+- Wertpapiere/Metadaten: Kurse und TFS neu einlesen; die Buchungen werden nur dann neu
+  verarbeitet, wenn sich die Zuordnung von Namen zu ISINs geändert hat.
+- VAP: nur die VAP-Datei neu einlesen.
+- Buchungen: FIFO ist je ISIN unabhängig. Wertpapiere ohne geänderte Buchungen behalten
+  ihre Chargen. Kamen nur neue Buchungen hinzu, die nach allen bisherigen einsortiert
+  werden (üblich bei einem erneuten Export), werden nur diese auf die bisherigen
+  Chargen angewendet. Sonst wird das Wertpapier vollständig neu verarbeitet.
+
+`changed_isins` nennt nach jedem Neuladen die ISINs, deren Ergebnisse sich geändert
+haben können (None: alle).
+"""
+
+import copy
+import logging
+import os
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from typing import Optional
+
+import pandas as pd
+from sortedcontainers import SortedList
+
+from planning import build_queue_views
+from pyfifovap import (
+    ForexHelper,
+    PyFifoVapError,
+    build_lot_arrays,
+    determine_language_from_transactions_file,
+    filter_portfolio,
+    read_etf_metadata,
+    read_transactions,
+    read_vap,
+    replay_transactions,
+    warn_about_isin_name_collisions,
+)
+
+# args attribute of each input file
+INPUT_FILES = ("buchungen", "wertpapiere", "metadaten", "vap")
+
+
+def _changed_keys(old: dict, new: dict) -> set:
+    return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
+
+def _rows_by_isin(
+    data: pd.DataFrame, security_column: str, name_to_isin: dict[str, str]
+) -> dict[str, pd.DataFrame]:
+    isins = data[security_column].map(name_to_isin)
+    return {
+        isin: rows.reset_index(drop=True)
+        for isin, rows in data[isins.notna()].groupby(isins[isins.notna()], sort=False)
+    }
+
+
+class PortfolioState:
+    """Eingelesene Eingaben samt abgeleiteter Arrays, bei Dateiänderungen teilweise neu geladen."""
+
+    def __init__(self, args, offline: bool):
+        self.args = args
+        self.forex_helper = ForexHelper(offline=offline)
+        self.file_stamps: dict[str, tuple[int, int]] = {}
+        self.name_to_isin: Optional[dict[str, str]] = None
+        self.changed_isins: Optional[set[str]] = None
+        # responses that only depend on the loaded inputs, cleared on every reload
+        self.memo: dict[str, object] = {}
+        self.reload()
+
+    def _stamp(self, name: str) -> tuple[int, int]:
+        stat = os.stat(getattr(self.args, name))
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self) -> list[str]:
+        """Re-read the input files changed since the last call; returns their names."""
+        stamps = {name: self._stamp(name) for name in INPUT_FILES}
+        changed = [
+            name for name in INPUT_FILES if stamps[name] != self.file_stamps.get(name)
+        ]
+        if not changed:
+            return []
+        args = self.args
+        selected_isins = set(args.isin) if args.isin else None
+        first_load = not self.file_stamps
+
+        i18n_helper = (
+            determine_language_from_transactions_file(args.buchungen)
+            if first_load
+            else self.i18n_helper
+        )
+        if first_load or {"wertpapiere", "metadaten"} & set(changed):
+            metadata_by_isin, name_to_isin = read_etf_metadata(
+                args.metadaten,
+                i18n_helper,
+                self.forex_helper,
+                args.wertpapiere,
+                selected_isins,
+            )
+        else:
+            metadata_by_isin, name_to_isin = self.metadata_by_isin, self.name_to_isin
+
+        if first_load or name_to_isin != self.name_to_isin:
+            # the ISINs of the transactions are resolved via the securities file
+            transactions = read_transactions(
+                args.buchungen, i18n_helper, name_to_isin, selected_isins
+            )
+            replayed = defaultdict(lambda: defaultdict(SortedList))
+            replay_transactions(
+                replayed, transactions, i18n_helper, self.forex_helper, name_to_isin
+            )
+            warn_about_isin_name_collisions(replayed)
+            changed_isins = None
+        elif "buchungen" in changed:
+            transactions = read_transactions(
+                args.buchungen, i18n_helper, name_to_isin, selected_isins
+            )
+            replayed, changed_isins = self._replay_changes(
+                transactions, i18n_helper, name_to_isin
+            )
+        else:
+            transactions, replayed, changed_isins = (
+                self.transactions,
+                self.replayed,
+                set(),
+            )
+
+        if changed_isins is not None and not first_load:
+            changed_isins |= _changed_keys(self.metadata_by_isin, metadata_by_isin)
+
+        if "vap" in changed:
+            vap_by_isin_and_year = read_vap(args.vap, i18n_helper)
+            if changed_isins is not None and not first_load:
+                changed_isins |= _changed_keys(
+                    {
+                        isin: dict(vap)
+                        for isin, vap in self.vap_by_isin_and_year.items()
+                    },
+                    {isin: dict(vap) for isin, vap in vap_by_isin_and_year.items()},
+                )
+        else:
+            vap_by_isin_and_year = self.vap_by_isin_and_year
+
+        portfolio = replayed
+        if args.depot or args.gekauft_ab:
+            portfolio = filter_portfolio(
+                replayed, set(args.depot) if args.depot else None, args.gekauft_ab
+            )
+        lot_arrays = build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year)
+
+        self.i18n_helper = i18n_helper
+        self.metadata_by_isin, self.name_to_isin = metadata_by_isin, name_to_isin
+        self.transactions, self.replayed = transactions, replayed
+        self.portfolio = portfolio
+        self.vap_by_isin_and_year = vap_by_isin_and_year
+        self.lot_arrays = lot_arrays
+        self.queue_views = build_queue_views(lot_arrays)
+        self.changed_isins = None if first_load else changed_isins
+        self.memo = {}
+        self.file_stamps = stamps
+        logging.info(f"Eingaben neu geladen: {', '.join(changed)}")
+        return changed
+
+    def _replay_changes(
+        self,
+        transactions: pd.DataFrame,
+        i18n_helper,
+        name_to_isin: dict[str, str],
+    ) -> tuple[defaultdict[str, defaultdict[str, SortedList]], set[str]]:
+        """Replay only the securities whose transactions changed; see the module docs."""
+        security_column = i18n_helper.get_pp_names().SECURITY
+        old_rows = _rows_by_isin(self.transactions, security_column, name_to_isin)
+        new_rows = _rows_by_isin(transactions, security_column, name_to_isin)
+        content = [column for column in transactions.columns if column != "Index"]
+
+        replayed = defaultdict(lambda: defaultdict(SortedList))
+        for broker, lots_by_isin in self.replayed.items():
+            replayed[broker].update(lots_by_isin)
+
+        changed_isins = set()
+        for isin in old_rows.keys() | new_rows.keys():
+            old = old_rows.get(isin, pd.DataFrame(columns=transactions.columns))
+            new = new_rows.get(isin, pd.DataFrame(columns=transactions.columns))
+            prefix = new.iloc[: len(old)]
+            unchanged = len(old) == len(new) and old[content].equals(new[content])
+            appended = 0 < len(old) < len(new) and old[content].equals(prefix[content])
+            if unchanged or appended:
+                # the lots stay; only their row numbers move to those of the new file
+                new_index = dict(zip(old["Index"], prefix["Index"]))
+                if appended or any(a != b for a, b in new_index.items()):
+                    for lots_by_isin in replayed.values():
+                        if isin in lots_by_isin:
+                            lots = copy.deepcopy(list(lots_by_isin[isin]))
+                            for lot in lots:
+                                lot.purchased_index = new_index[lot.purchased_index]
+                            lots_by_isin[isin] = SortedList(lots)
+            if unchanged:
+                continue
+            changed_isins.add(isin)
+            if appended:
+                rows = new.iloc[len(old) :]
+                logging.info(f"{isin}: {len(rows)} neue Buchung(en) werden angewendet")
+            else:
+                for lots_by_isin in replayed.values():
+                    lots_by_isin.pop(isin, None)
+                rows = new
+                logging.info(f"{isin}: Buchungen geändert, vollständige Neuberechnung")
+            replay_transactions(
+                replayed, rows, i18n_helper, self.forex_helper, name_to_isin
+            )
+        warn_about_isin_name_collisions(replayed)
+        return replayed, changed_isins
+
+
+def drop_changed_sheets(
+    prepared_sheets: dict[tuple[str, str], object], changed_isins: Optional[set[str]]
+) -> None:
+    """Remove the cached sheets (keyed by depot and ISIN) of changed securities."""
+    if changed_isins is None:
+        prepared_sheets.clear()
+        return
+    for key in [key for key in prepared_sheets if key[1] in changed_isins]:
+        del prepared_sheets[key]
+
+
+# errors of PortfolioState.reload() caused by the input files, e.g. a file that is being
+# written right now or has missing columns
+RELOAD_ERRORS = (OSError, KeyError, ValueError, PyFifoVapError)
+
+
+def watch(args, render: Callable[["PortfolioState"], None], interval: float) -> None:
+    """Render once, then again after every change of an input file (until Strg+C)."""
+    state = PortfolioState(args, offline=args.offline)
+    render(state)
+    print(f"Beobachte die Eingabedateien alle {interval:g} s (Beenden mit Strg+C)...")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                changed = state.reload()
+            except RELOAD_ERRORS as e:
+                # e.g. a file that is being written right now; try again later
+                logging.warning(f"Neu laden fehlgeschlagen: {e}")
+                continue
+            if changed:
+                print(f"Geändert: {', '.join(changed)} - schreibe Ergebnis neu...")
+                try:
+                    render(state)
+                except OSError as e:
+                    # e.g. the results file is still open in a spreadsheet program
+                    logging.error(f"Ergebnis konnte nicht geschrieben werden: {e}")
+                except (PyFifoVapError, ValueError) as e:
+                    logging.error(f"Auswertung fehlgeschlagen: {e}")
+                except SystemExit:
+                    # exit(1) after an error that write_outputs has already logged
+                    logging.error(
+                        "Auswertung abgebrochen, warte auf die nächste Änderung"
+                    )
+    except KeyboardInterrupt:
+        pass
@@ -1,20 +1,22 @@
 #!/usr/bin/env python3
 
+# Only the standard library is imported at module level: pandas, numpy and the modules
+# of the individual features are imported where they are used, so that --help,
+# argument errors and small runs do not pay for what they do not need.
+
+import argparse
+import datetime
+import importlib.util
+import logging
 import sys
+import time
+from pathlib import Path
 from pprint import pformat
 
-from pyfifovap import (
-    ForexHelper,
-    build_results_file,
-    determine_language_from_transactions_file,
-    print_portfolio_summary,
-    read_etf_metadata,
-    read_transactions_into_portfolio,
-    read_vap,
-)
+_START = time.perf_counter()
 
-import argparse
-import logging
+# output formats of columnar.TABLE_WRITERS (not imported here to keep --help fast)
+TABLE_FORMATS = ("csv", "jsonl", "parquet")
 
 
 def setup_logging(verbosity: int):
@@ -28,6 +30,15 @@ def setup_logging(verbosity: int):
     logging.basicConfig(level=level, format="%(levelname)s: %(message)s")
 
 
+def parse_iso_date(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Ungültiges Datum '{value}' (erwartet: JJJJ-MM-TT)"
+        )
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="""
@@ -58,7 +69,6 @@ Beispiel-Nutzung:
         "-b",
         "--buchungen",
         metavar="FILE",
-        required=True,
         help="Pfad zur CSV-Datei mit allen Transaktionen aus PortfolioPerformance (z. B. All_transactions.csv)",
     )
 
@@ -66,7 +76,6 @@ Beispiel-Nutzung:
         "-w",
         "--wertpapiere",
         metavar="FILE",
-        required=True,
         help="Pfad zur CSV-Datei mit allen Wertpapieren aus PortfolioPerformance (z. B. Securities_(Standard).csv)",
     )
 
@@ -123,38 +132,1033 @@ Beispiel-Nutzung:
         help="Auch bei Fremdwährungen keine Forex-Abfrage bei Yahoo Finance machen (Kurs kann dann "
         "nicht umgewandelt werden)",
     )
-    return parser.parse_args()
 
+    parser.add_argument(
+        "--nur-uebersicht",
+        nargs="?",
+        const="tabelle",
+        choices=["tabelle", "json"],
+        help="Nur Übersicht und VAP-Übersicht berechnen und als Tabellen (Standard) oder JSON "
+        "auf der Konsole ausgeben; es wird keine Ergebnisdatei geschrieben",
+    )
 
-def main():
-    args = parse_args()
-    setup_logging(args.verbose)
+    parser.add_argument(
+        "--format",
+        choices=["xlsx", *TABLE_FORMATS],
+        action="append",
+        help="Ausgabeformat (mehrfach nutzbar, Standard: xlsx). Bei csv, jsonl und parquet "
+        "werden neben dem Pfad von --output die Dateien <Name>_chargen, <Name>_uebersicht "
+        "und <Name>_vap mit festen Spalten geschrieben (parquet benötigt pyarrow).",
+    )
+
+    parser.add_argument(
+        "--layout",
+        choices=["tabs", "tabelle"],
+        default="tabs",
+        help="Chargen in der XLSX-Datei als ein Tab je Depot und Wertpapier (tabs, Standard) "
+        "oder als eine einzige filterbare Tabelle 'Chargen' mit festen Spalten (tabelle)",
+    )
+
+    parser.add_argument(
+        "--formeln",
+        action="store_true",
+        help="Kurse, TFS und Steuerfaktor in den Tab 'Kurse' schreiben und Brutto-Wert, Gewinn, "
+        "Verlustverrechnung, Steuer und Netto-Wert sowie die Übersicht als Formeln darauf "
+        "ausgeben, damit geänderte Kurse direkt in der Tabellenkalkulation neu berechnet "
+        "werden (--prozesse wird dann ignoriert)",
+    )
+
+    parser.add_argument(
+        "--prozesse",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Tabs der einzelnen Wertpapiere mit N Prozessen vorbereiten; geschrieben wird die "
+        "XLSX-Datei weiterhin von einem Prozess in gleicher Reihenfolge (Standard: 1)",
+    )
+
+    parser.add_argument(
+        "--server",
+        metavar="PORT",
+        type=int,
+        nargs="?",
+        const=8765,
+        help="Eingaben einmal einlesen und als lokalen HTTP/JSON-Server auf 127.0.0.1 "
+        "bereitstellen (Standard-Port: 8765). Geänderte Eingabedateien werden bei der "
+        "nächsten Anfrage neu geladen; Wechselkurse werden nicht abgefragt.",
+    )
+
+    parser.add_argument(
+        "--watch",
+        metavar="SEKUNDEN",
+        type=float,
+        nargs="?",
+        const=2.0,
+        help="Nach der Auswertung die Eingabedateien beobachten (alle 2 Sekunden oder wie "
+        "angegeben) und die Ergebnisse bei jeder Änderung neu schreiben. Neu berechnet wird "
+        "nur, was von der Änderung betroffen ist.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar="DATEI",
+        nargs="?",
+        const="",
+        help="Laufzeit, CPU-Zeit und Spitzen-Speicher je Verarbeitungsschritt sowie Zähler "
+        "(Buchungen, Chargen, Forex-Abfragen, geschriebene Tabs und Zellen) messen und am Ende "
+        "ausgeben; mit DATEI zusätzlich als JSON dorthin schreiben. Die Speichermessung "
+        "verlangsamt den Lauf etwas; die CPU-Zeit umfasst nur diesen Prozess.",
+    )
+
+    parser.add_argument(
+        "--stichtag",
+        metavar="JJJJ-MM-TT",
+        type=parse_iso_date,
+        action="append",
+        help="Chargen mit dem Stand nach allen Buchungen bis einschließlich dieses Tages "
+        "auswerten (mehrfach nutzbar). Je Stichtag wird eine Ergebnisdatei <Name>_<Stichtag> "
+        "geschrieben; berücksichtigt werden die bis dahin erhobenen Vorabpauschalen, "
+        "bewertet wird mit den aktuellen Kursen oder denen aus --kurshistorie.",
+    )
+
+    parser.add_argument(
+        "--kurshistorie",
+        metavar="PFAD",
+        help="Historische Kurse (EUR) für --stichtag: CSV-Datei mit den Spalten ISIN, Datum, "
+        "Kurs, Verzeichnis mit Kurs-Exporten <ISIN>.csv aus PortfolioPerformance oder mit "
+        "price_history.py erzeugter Index. Bewertet wird mit dem letzten Kurs am oder vor "
+        "dem Stichtag; Wertpapiere ohne solchen Kurs behalten den aktuellen Kurs.",
+    )
+
+    parser.add_argument(
+        "--vap-berechnen",
+        action="store_true",
+        help="Vorabpauschalen aller Fonds aus --kurshistorie, --basiszins und "
+        "--ausschuettungen berechnen (Kurs am Jahresanfang und -ende, begrenzt auf den "
+        "Wertzuwachs). Einträge der VAP-Datei haben Vorrang, fehlende Jahre werden ergänzt.",
+    )
+    parser.add_argument(
+        "--basiszins",
+        metavar="FILE",
+        default="basiszins.csv",
+        help="Basiszins je Jahr für --vap-berechnen: CSV mit den Spalten Jahr, Basiszins in "
+        "Prozent (Standard: basiszins.csv)",
+    )
+    parser.add_argument(
+        "--ausschuettungen",
+        metavar="FILE",
+        help="Ausschüttungen für --vap-berechnen: CSV mit den Spalten ISIN, Datum, "
+        "Ausschüttung pro Anteil (EUR)",
+    )
+
+    parser.add_argument(
+        "--protokoll",
+        metavar="DATEI",
+        help="Prüfprotokoll des FIFO-Replays als JSON Lines in DATEI schreiben: je Buchung "
+        "Zeile, Aktion und die betroffenen Chargen mit ihren Anteilen vor und nach der "
+        "Buchung",
+    )
+
+    parser.add_argument(
+        "--realisiert",
+        action="store_true",
+        help="Realisierte Gewinne aller Verkäufe im selben FIFO-Replay mitschreiben: je "
+        "Verkauf und verbrauchter Charge Anteile, Kosten, bis dahin erhobene VAP, Erlös in "
+        "EUR (Kurs am Verkaufstag) und KESt-pflichtiger Gewinn nach TFS, im Tab 'Realisierte "
+        "Gewinne' bzw. in <Name>_realisiert bei --format csv/jsonl/parquet",
+    )
+
+    batch_group = parser.add_argument_group(
+        "Stapelverarbeitung",
+        "Die Exporte vieler Mandanten in einem Lauf mit denselben Optionen auswerten. "
+        "Metadaten und VAP-Datei gelten für alle Mandanten; mit --prozesse N werden N "
+        "Mandanten gleichzeitig ausgewertet.",
+    )
+    batch_group.add_argument(
+        "--stapel",
+        metavar="PFAD",
+        help="Manifest-CSV-Datei mit den Spalten Mandant, Buchungen, Wertpapiere oder "
+        "Verzeichnis mit einem Unterverzeichnis je Mandant (mit Alle_Buchungen.csv und "
+        "Wertpapiere_(Standard).csv bzw. den englischen Export-Namen)",
+    )
+    batch_group.add_argument(
+        "--stapel-ausgabe",
+        metavar="VERZEICHNIS",
+        default="Stapel-Ergebnisse",
+        help="Ergebnisse je Mandant in VERZEICHNIS/<Mandant>/ und den Laufbericht "
+        "VERZEICHNIS/Laufbericht.csv schreiben (Standard: Stapel-Ergebnisse)",
+    )
+
+    cache_group = parser.add_argument_group(
+        "Cache",
+        "Eingelesene Buchungen und fertige Ergebnisdateien werden im Cache-Verzeichnis "
+        "abgelegt. Bei unveränderten Eingabedateien und Optionen wird das Ergebnis nur "
+        "kopiert; ändern sich nur Steuer- oder Ausgabeoptionen, entfällt das Einlesen.",
+    )
+    cache_group.add_argument(
+        "--cache",
+        metavar="VERZEICHNIS",
+        help="Cache in diesem Verzeichnis verwenden (Standard: kein Cache)",
+    )
+    cache_group.add_argument(
+        "--cache-groesse",
+        metavar="MB",
+        type=float,
+        default=500.0,
+        help="Maximale Größe des Caches; die am längsten nicht genutzten Einträge werden "
+        "gelöscht (Standard: 500)",
+    )
+
+    filter_group = parser.add_argument_group(
+        "Auswahl",
+        "Nur einen Teil des Portfolios auswerten. Buchungen nicht ausgewählter Wertpapiere "
+        "werden gar nicht erst eingelesen; alle Tabs und Übersichten enthalten nur die "
+        "Auswahl.",
+    )
+    filter_group.add_argument(
+        "--depot",
+        metavar="DEPOT",
+        action="append",
+        help="Nur dieses Depot auswerten (mehrfach nutzbar, Standard: alle)",
+    )
+    filter_group.add_argument(
+        "--isin",
+        metavar="ISIN",
+        action="append",
+        help="Nur dieses Wertpapier auswerten (mehrfach nutzbar, Standard: alle)",
+    )
+    filter_group.add_argument(
+        "--gekauft-ab",
+        metavar="JJJJ-MM-TT",
+        type=parse_iso_date,
+        help="Nur Chargen auswerten, die an oder nach diesem Tag gekauft wurden. Die "
+        "Verlustverrechnung berücksichtigt dann nur diese Chargen.",
+    )
+
+    parser.add_argument(
+        "--kursszenarien",
+        metavar="VON:BIS:SCHRITT",
+        help="Kursänderungen in Prozent für alle Wertpapiere durchrechnen (z. B. -30:30:1) und "
+        "als Tab 'Szenarien' ausgeben. Einlesen und VAP-Berechnung erfolgen nur einmal.",
+    )
+
+    parser.add_argument(
+        "--kursszenario-isin",
+        metavar="ISIN=VON:BIS:SCHRITT",
+        action="append",
+        help="Eigenes Kursänderungs-Raster für ein Wertpapier (mehrfach nutzbar). Alle Raster "
+        "müssen gleich viele Schritte haben; Wertpapiere ohne Raster behalten ohne "
+        "--kursszenarien ihren aktuellen Kurs.",
+    )
+
+    parser.add_argument(
+        "--uebertrag-planen",
+        metavar="ISIN",
+        help="Teildepotüberträge zur FIFO-Optimierung für dieses Wertpapier durchrechnen und "
+        "die Übertragsgrößen mit der geringsten Steuer beim anschließenden Verkauf von "
+        "--uebertrag-betrag im Tab 'Übertragsplanung' ausgeben",
+    )
+
+    parser.add_argument(
+        "--uebertrag-betrag",
+        metavar="EUR",
+        type=float,
+        help="Brutto-Betrag in EUR, der nach dem Übertrag verkauft werden soll",
+    )
+
+    parser.add_argument(
+        "--uebertrag-ziel",
+        metavar="DEPOT",
+        action="append",
+        default=[],
+        help="Zusätzliches Ziel-Depot (auch ohne Bestand des Wertpapiers) für die "
+        "Übertragsplanung (mehrfach nutzbar)",
+    )
+
+    projection_group = parser.add_argument_group(
+        "Monte-Carlo-Projektion",
+        "Simuliert Kurspfade und Basiszinsen für die nächsten Jahre, daraus künftige "
+        "Vorabpauschalen und die Steuer beim Verkauf aller Chargen am Ende des Zeitraums. "
+        "Perzentile werden im Tab 'Projektion' ausgegeben.",
+    )
+    projection_group.add_argument(
+        "--projektion",
+        metavar="JAHRE",
+        type=int,
+        help="Anzahl der zu simulierenden Jahre (aktiviert die Projektion)",
+    )
+    projection_group.add_argument(
+        "--projektion-pfade",
+        metavar="N",
+        type=int,
+        default=10000,
+        help="Anzahl der simulierten Pfade (Standard: 10000)",
+    )
+    projection_group.add_argument(
+        "--projektion-seed",
+        metavar="SEED",
+        type=int,
+        help="Startwert des Zufallsgenerators für reproduzierbare Ergebnisse",
+    )
+    projection_group.add_argument(
+        "--projektion-rendite",
+        metavar="PROZENT",
+        type=float,
+        default=6.0,
+        help="Erwartete jährliche Rendite in Prozent (Standard: 6)",
+    )
+    projection_group.add_argument(
+        "--projektion-volatilitaet",
+        metavar="PROZENT",
+        type=float,
+        default=15.0,
+        help="Jährliche Volatilität in Prozent (Standard: 15)",
+    )
+    projection_group.add_argument(
+        "--projektion-isin",
+        metavar="ISIN=RENDITE:VOLATILITÄT",
+        action="append",
+        help="Eigene Rendite/Volatilität in Prozent für ein Wertpapier (mehrfach nutzbar)",
+    )
+    projection_group.add_argument(
+        "--projektion-basiszins",
+        metavar="PROZENT[,PROZENT...]",
+        default="2.53",
+        help="Basiszins in Prozent je Jahr, der letzte Wert gilt für alle weiteren Jahre "
+        "(Standard: 2.53). Wird auch für --verkaufsplan genutzt.",
+    )
+    projection_group.add_argument(
+        "--projektion-basiszins-schwankung",
+        metavar="PROZENTPUNKTE",
+        type=float,
+        default=0.0,
+        help="Standardabweichung des Basiszinses je Jahr in Prozentpunkten (Standard: 0)",
+    )
+
+    sell_schedule_group = parser.add_argument_group(
+        "Verkaufsplan über mehrere Jahre",
+        "Simuliert den schrittweisen Verkauf ausgehend von den aktuellen Chargen, inkl. "
+        "künftiger VAP, und gibt realisierte Gewinne und Steuern je Jahr im Tab "
+        "'Verkaufsplan' aus.",
+    )
+    sell_schedule_group.add_argument(
+        "--verkaufsplan",
+        metavar="JAHRE",
+        type=int,
+        help="Anzahl der zu simulierenden Jahre (aktiviert den Verkaufsplan)",
+    )
+    sell_rule = sell_schedule_group.add_mutually_exclusive_group()
+    sell_rule.add_argument(
+        "--verkaufsplan-max-gewinn",
+        metavar="EUR",
+        type=float,
+        help="Je Jahr höchstens so viel KESt-pflichtigen Gewinn (inkl. VAP) realisieren "
+        "(Standard: der Pauschbetrag)",
+    )
+    sell_rule.add_argument(
+        "--verkaufsplan-prozent",
+        metavar="PROZENT",
+        type=float,
+        help="Je Jahr diesen Anteil jeder Position verkaufen",
+    )
+    sell_schedule_group.add_argument(
+        "--verkaufsplan-pauschbetrag",
+        metavar="EUR",
+        type=float,
+        default=1000.0,
+        help="Sparer-Pauschbetrag je Jahr (Standard: 1000)",
+    )
+    sell_schedule_group.add_argument(
+        "--verkaufsplan-rendite",
+        metavar="PROZENT",
+        type=float,
+        default=0.0,
+        help="Angenommene jährliche Kursänderung in Prozent (Standard: 0)",
+    )
+    sell_schedule_group.add_argument(
+        "--verkaufsplan-isin",
+        metavar="ISIN",
+        action="append",
+        default=[],
+        help="Nur dieses Wertpapier verkaufen (mehrfach nutzbar, Standard: alle)",
+    )
+
+    rebalancing_group = parser.add_argument_group(
+        "Umschichtung",
+        "Schichtet auf Zielgewichte um und wählt dabei je Wertpapier die Verkäufe aus den "
+        "Depots, die am wenigsten KESt auslösen. Ergebnis im Tab 'Umschichtung'.",
+    )
+    rebalancing_group.add_argument(
+        "--umschichtung",
+        metavar="ISIN=PROZENT",
+        action="append",
+        help="Zielgewicht eines Wertpapiers in Prozent (mehrfach nutzbar). Die Gewichte "
+        "beziehen sich auf den Gesamtwert der genannten Wertpapiere über alle Depots.",
+    )
+    rebalancing_group.add_argument(
+        "--umschichtung-toleranz",
+        metavar="PROZENTPUNKTE",
+        type=float,
+        default=0.0,
+        help="Übergewichte bis zu dieser Abweichung vom Zielgewicht werden nicht verkauft "
+        "(Standard: 0)",
+    )
+
+    args = parser.parse_args()
+    if args.stapel is not None:
+        if args.buchungen or args.wertpapiere:
+            parser.error(
+                "--stapel liest Buchungen und Wertpapiere je Mandant, "
+                "--buchungen/--wertpapiere sind dann nicht möglich"
+            )
+        if (
+            args.server is not None
+            or args.watch is not None
+            or args.cache
+            or args.nur_uebersicht
+        ):
+            parser.error(
+                "--stapel kann nicht mit --server, --watch, --cache oder "
+                "--nur-uebersicht kombiniert werden"
+            )
+    elif not (args.buchungen and args.wertpapiere):
+        parser.error("--buchungen und --wertpapiere sind nötig (oder --stapel)")
+    if args.prozesse < 1:
+        parser.error("--prozesse benötigt mindestens 1 Prozess")
+    if args.watch is not None and args.watch <= 0:
+        parser.error("--watch benötigt ein positives Intervall")
+    if args.watch is not None and (args.server is not None or args.cache):
+        parser.error("--watch ist nicht mit --server oder --cache kombinierbar")
+    if args.profile is not None and (
+        args.server is not None or args.watch is not None or args.stapel is not None
+    ):
+        parser.error(
+            "--profile ist nicht mit --server, --watch oder --stapel kombinierbar"
+        )
+    if args.stichtag and (
+        args.server is not None
+        or args.watch is not None
+        or args.stapel is not None
+        or args.cache
+        or args.protokoll
+    ):
+        parser.error(
+            "--stichtag ist nicht mit --server, --watch, --stapel, --cache oder "
+            "--protokoll kombinierbar"
+        )
+    if args.stichtag and len(set(args.stichtag)) > 1 and args.nur_uebersicht == "json":
+        parser.error("--nur-uebersicht json gibt nur einen --stichtag aus")
+    if args.kurshistorie and not (args.stichtag or args.vap_berechnen):
+        parser.error(
+            "--kurshistorie wird nur mit --stichtag oder --vap-berechnen verwendet"
+        )
+    if args.vap_berechnen and not args.kurshistorie:
+        parser.error("--vap-berechnen benötigt --kurshistorie")
+    if args.vap_berechnen and (
+        args.server is not None
+        or args.watch is not None
+        or args.stapel is not None
+        or args.cache
+    ):
+        parser.error(
+            "--vap-berechnen ist nicht mit --server, --watch, --stapel oder --cache "
+            "kombinierbar"
+        )
+    if args.protokoll and (
+        args.server is not None
+        or args.watch is not None
+        or args.stapel is not None
+        or args.cache
+    ):
+        parser.error(
+            "--protokoll ist nicht mit --server, --watch, --stapel oder --cache kombinierbar"
+        )
+    if args.realisiert and (
+        args.server is not None
+        or args.watch is not None
+        or args.stapel is not None
+        or args.cache
+        or args.stichtag
+        or args.nur_uebersicht
+    ):
+        parser.error(
+            "--realisiert ist nicht mit --server, --watch, --stapel, --cache, --stichtag "
+            "oder --nur-uebersicht kombinierbar"
+        )
+    if args.cache_groesse <= 0:
+        parser.error("--cache-groesse muss positiv sein")
+    args.format = args.format or ["xlsx"]
+    if "parquet" in args.format and importlib.util.find_spec("pyarrow") is None:
+        parser.error(
+            "--format parquet benötigt das Paket pyarrow (pip install pyarrow)"
+        )
+    args.target_weights = {}
+    if args.umschichtung:
+        from planning import parse_target_weights
+
+        try:
+            args.target_weights = parse_target_weights(args.umschichtung)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.umschichtung_toleranz < 0:
+        parser.error("--umschichtung-toleranz darf nicht negativ sein")
+    if args.verkaufsplan is not None and args.verkaufsplan < 1:
+        parser.error("--verkaufsplan benötigt mindestens 1 Jahr")
+    if args.projektion is not None and args.projektion < 1:
+        parser.error("--projektion benötigt mindestens 1 Jahr")
+    if args.projektion_pfade < 1:
+        parser.error("--projektion-pfade benötigt mindestens 1 Pfad")
+    if args.projektion_volatilitaet < 0:
+        parser.error("--projektion-volatilitaet darf nicht negativ sein")
+    if args.projektion:
+        from projection import ProjectionSettings, parse_projection_isin_params
+
+        try:
+            args.projection_settings = ProjectionSettings(
+                years=args.projektion,
+                num_paths=args.projektion_pfade,
+                seed=args.projektion_seed,
+                expected_return=args.projektion_rendite / 100,
+                volatility=args.projektion_volatilitaet / 100,
+                params_by_isin=parse_projection_isin_params(args.projektion_isin),
+                basiszins=[
+                    float(value) / 100 for value in args.projektion_basiszins.split(",")
+                ],
+                basiszins_volatility=args.projektion_basiszins_schwankung / 100,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        args.projection_settings = None
+    if args.uebertrag_planen and not args.uebertrag_betrag:
+        parser.error("--uebertrag-planen benötigt --uebertrag-betrag")
+    if args.uebertrag_betrag is not None and args.uebertrag_betrag <= 0:
+        parser.error("--uebertrag-betrag muss größer als 0 sein")
+    if args.kursszenarien or args.kursszenario_isin:
+        from scenarios import build_shock_grid
+
+        try:
+            args.shock_grid = build_shock_grid(
+                args.kursszenarien, args.kursszenario_isin
+            )
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        args.shock_grid = None
+    return args
+
+
+# options that do not influence the written results
+_NOT_REPORT_RELEVANT = {
+    "verbose",
+    "profile",
+    "prozesse",
+    "cache",
+    "cache_groesse",
+    "buchungen",
+    "wertpapiere",
+    "metadaten",
+    "vap",
+}
+
+
+def report_options(args) -> dict:
+    """The options that determine the written results, as part of the report cache key."""
+    options = {
+        name: value
+        for name, value in vars(args).items()
+        if name not in _NOT_REPORT_RELEVANT
+    }
+    # the sell schedule and the projection start in the current year
+    if args.verkaufsplan or args.projection_settings is not None:
+        options["auswertungsjahr"] = datetime.date.today().year
+    return options
 
-    i18n_helper = determine_language_from_transactions_file(args.buchungen)
-    forex_helper = ForexHelper(offline=args.offline)
 
-    # read securities/metadata first: this yields the ISIN-keyed metadata and the
-    # name -> ISIN map needed to resolve transactions that lack an ISIN.
+def read_inputs(args):
+    """Read and replay the exports; returns (portfolio, metadata, VAP)."""
+    from engine import load_inputs
+
+    logging.info(f"Lese Buchungen aus {args.buchungen}...")
     logging.info(f"Lese Metadaten aus {args.metadaten}...")
     logging.info(f"Lese Wertpapiere aus {args.wertpapiere}...")
-    metadata_by_isin, name_to_isin = read_etf_metadata(
-        args.metadaten, i18n_helper, forex_helper, args.wertpapiere
+    logging.info(f"Lese VAP-Daten aus {args.vap}...")
+    portfolio, metadata_by_isin, vap_by_isin_and_year = load_inputs(
+        args.buchungen,
+        args.wertpapiere,
+        args.metadaten,
+        args.vap,
+        offline=args.offline,
+        isins=set(args.isin) if args.isin else None,
+        brokers=set(args.depot) if args.depot else None,
+        bought_from=args.gekauft_ab,
     )
+    if args.vap_berechnen:
+        vap_by_isin_and_year = add_computed_vap(
+            args,
+            read_price_history_option(args),
+            metadata_by_isin,
+            vap_by_isin_and_year,
+        )
     logging.info(pformat(metadata_by_isin, width=120))
+    logging.info(pformat(vap_by_isin_and_year))
+    return portfolio, metadata_by_isin, vap_by_isin_and_year
+
+
+def read_price_history_option(args):
+    """The price history of --kurshistorie; exits on unreadable files."""
+    from price_history import read_price_history
+
+    try:
+        return read_price_history(args.kurshistorie)
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Kurshistorie {args.kurshistorie}: {e}")
+        exit(1)
+
+
+def add_computed_vap(args, price_history, metadata_by_isin, vap_by_isin_and_year):
+    """The VAP of the file, completed by the VAP computed for all funds (--vap-berechnen)."""
+    from projection import is_fund
+    from vap_calculation import (
+        compute_vap,
+        merge_vap,
+        read_basiszins,
+        read_distributions,
+    )
+
+    try:
+        basiszins_by_year = read_basiszins(args.basiszins)
+        distributions = (
+            read_distributions(args.ausschuettungen) if args.ausschuettungen else None
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Basiszins/Ausschüttungen: {e}")
+        exit(1)
+    funds = [
+        isin
+        for isin in metadata_by_isin
+        if is_fund(isin, metadata_by_isin, vap_by_isin_and_year)
+    ]
+    computed = compute_vap(price_history, basiszins_by_year, distributions, funds)
+    logging.info(f"VAP berechnet für {len(computed)} Fonds")
+    return merge_vap(computed, vap_by_isin_and_year)
+
+
+def write_outputs(
+    args,
+    portfolio,
+    metadata_by_isin,
+    vap_by_isin_and_year,
+    prepared_sheets=None,
+) -> list[Path]:
+    """Print or write all requested results; returns the paths of the written files."""
+    from pyfifovap import (
+        SummarySheet,
+        build_lot_arrays,
+        build_results_file,
+        print_overview_summaries,
+    )
+
+    if args.nur_uebersicht:
+        print_overview_summaries(
+            portfolio, metadata_by_isin, vap_by_isin_and_year, args, args.nur_uebersicht
+        )
+        return []
+
+    summary_sheets = []
+    if args.shock_grid is not None:
+        from scenarios import collect_scenario_summary
+
+        scenario_df = collect_scenario_summary(
+            portfolio, metadata_by_isin, vap_by_isin_and_year, args.shock_grid, args
+        )
+        # Szenario, ISIN, Name, Depot | Kursänderung | Kurs ... Netto-Wert | Steueranteil
+        n_cols = len(scenario_df.columns)
+        summary_sheets.append(
+            SummarySheet(
+                "Szenarien", scenario_df, set(range(5, n_cols - 1)), {4, n_cols - 1}
+            )
+        )
 
-    portfolio = read_transactions_into_portfolio(
-        args.buchungen, i18n_helper, forex_helper, name_to_isin
+    if args.uebertrag_planen:
+        from planning import (
+            build_queue_views,
+            collect_transfer_plan_summary,
+            plan_depot_transfers,
+        )
+
+        queue_views = build_queue_views(
+            build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year)
+        )
+        try:
+            candidates = plan_depot_transfers(
+                queue_views,
+                args.uebertrag_planen,
+                args.uebertrag_betrag,
+                args,
+                target_brokers=tuple(args.uebertrag_ziel),
+            )
+        except ValueError as e:
+            logging.error(str(e))
+            exit(1)
+        best = candidates[0]
+        print(
+            f"Übertragsplanung {best.isin}: {best.transferred_shares:.4f} Anteile von "
+            f"'{best.source_broker}' nach '{best.target_broker}' übertragen, dann aus "
+            f"'{best.sell_broker}' verkaufen -> Steuer {best.taxes:.2f} EUR"
+            if best.source_broker
+            else f"Übertragsplanung {best.isin}: kein Übertrag nötig, Verkauf aus "
+            f"'{best.sell_broker}' -> Steuer {best.taxes:.2f} EUR"
+        )
+        transfer_df = collect_transfer_plan_summary(candidates, args)
+        summary_sheets.append(
+            SummarySheet("Übertragsplanung", transfer_df, {6, 7}, set())
+        )
+
+    if args.projection_settings is not None:
+        from projection import collect_projection_summary, project_lots
+
+        print(
+            f"Simuliere {args.projection_settings.num_paths} Pfade über "
+            f"{args.projection_settings.years} Jahre..."
+        )
+        projection_result = project_lots(
+            build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year),
+            metadata_by_isin,
+            vap_by_isin_and_year,
+            args.projection_settings,
+            args,
+        )
+        projection_df = collect_projection_summary(projection_result, args)
+        summary_sheets.append(
+            SummarySheet(
+                "Projektion",
+                projection_df,
+                set(range(4, len(projection_df.columns))),
+                set(),
+            )
+        )
+
+    if args.verkaufsplan:
+        from planning import (
+            SellScheduleSettings,
+            build_queue_views,
+            collect_sell_schedule_summary,
+            simulate_sell_schedule,
+        )
+
+        queue_views = build_queue_views(
+            build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year)
+        )
+        settings = SellScheduleSettings(
+            years=args.verkaufsplan,
+            max_gain_per_year=(
+                None
+                if args.verkaufsplan_prozent is not None
+                else (
+                    args.verkaufsplan_max_gewinn
+                    if args.verkaufsplan_max_gewinn is not None
+                    else args.verkaufsplan_pauschbetrag
+                )
+            ),
+            sell_percent_per_year=(
+                args.verkaufsplan_prozent / 100
+                if args.verkaufsplan_prozent is not None
+                else None
+            ),
+            pauschbetrag=args.verkaufsplan_pauschbetrag,
+            expected_return=args.verkaufsplan_rendite / 100,
+            basiszins=[
+                float(value) / 100 for value in args.projektion_basiszins.split(",")
+            ],
+            isins=tuple(args.verkaufsplan_isin),
+        )
+        schedule = simulate_sell_schedule(
+            queue_views, metadata_by_isin, vap_by_isin_and_year, settings, args
+        )
+        schedule_df = collect_sell_schedule_summary(schedule, queue_views)
+        summary_sheets.append(
+            SummarySheet("Verkaufsplan", schedule_df, set(range(6, 12)) | {4}, set())
+        )
+
+    if args.target_weights:
+        from planning import (
+            build_queue_views,
+            collect_rebalancing_summary,
+            plan_rebalancing,
+        )
+
+        queue_views = build_queue_views(
+            build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year)
+        )
+        try:
+            plan = plan_rebalancing(
+                queue_views,
+                args.target_weights,
+                args,
+                tolerance=args.umschichtung_toleranz / 100,
+            )
+        except ValueError as e:
+            logging.error(str(e))
+            exit(1)
+        print(
+            f"Umschichtung: {sum(trade.proceeds for trade in plan.trades):.2f} EUR "
+            f"verkaufen -> Steuer {sum(trade.taxes for trade in plan.trades):.2f} EUR"
+        )
+        rebalancing_df = collect_rebalancing_summary(plan, args)
+        # ISIN, Depot | Wert | Gewicht, Zielgewicht | Anzahl | Erlös ... Kauf | Gewicht
+        summary_sheets.append(
+            SummarySheet("Umschichtung", rebalancing_df, {2, 6, 7, 8, 9}, {3, 4, 10})
+        )
+
+    realized_gains_df = None
+    if args.realisiert:
+        import realized_gains
+        from pyfifovap import collect_realized_gains_summary
+
+        realized_gains_df = collect_realized_gains_summary(
+            realized_gains.current(),
+            metadata_by_isin,
+            vap_by_isin_and_year,
+            set(args.depot) if args.depot else None,
+            args.gekauft_ab,
+        )
+        # Depot, ISIN, Name, Verkauf, Kauf, Anzahl | Erlös ... Gewinn vor TFS | TFS | Gewinn
+        summary_sheets.append(
+            SummarySheet(
+                "Realisierte Gewinne", realized_gains_df, {6, 7, 8, 9, 11}, {10}
+            )
+        )
+
+    written = []
+    for output_format in dict.fromkeys(args.format):
+        if output_format != "xlsx":
+            from columnar import write_columnar_results
+
+            print(f"Generiere {output_format}-Dateien neben {args.output}...")
+            written += write_columnar_results(
+                portfolio,
+                metadata_by_isin,
+                vap_by_isin_and_year,
+                Path(args.output).with_suffix(""),
+                output_format,
+                args,
+                realized_gains_df,
+            )
+            continue
+        print(f"Generiere Ergebnis-XLSX-Datei {args.output}...")
+        build_results_file(
+            portfolio,
+            metadata_by_isin,
+            vap_by_isin_and_year,
+            args.output,
+            args,
+            summary_sheets,
+            processes=args.prozesse,
+            layout=args.layout,
+            formulas=args.formeln,
+            prepared_sheets=prepared_sheets,
+        )
+        written.append(Path(args.output))
+    return written
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.verbose)
+    from pyfifovap import PyFifoVapError
+
+    logging.info(
+        f"Argumente und Module geladen nach {(time.perf_counter() - _START) * 1000:.0f} ms"
     )
+    if args.profile is not None:
+        import profiling
+
+        profiling.start()
+    if args.protokoll:
+        import replay_trace
+
+        replay_trace.start(args.protokoll)
+    if args.realisiert:
+        import realized_gains
+
+        realized_gains.start()
+    try:
+        run(args)
+    except PyFifoVapError as e:
+        if getattr(e, "row", None) is not None:
+            logging.error(pformat(e.row))
+        logging.error(str(e))
+        exit(1)
+    finally:
+        if args.protokoll:
+            trace = replay_trace.stop()
+            print(
+                f"Protokoll mit {trace.records} Buchungen geschrieben nach {args.protokoll}",
+                file=sys.stderr,
+            )
+        if args.realisiert:
+            realized_gains.stop()
+        if args.profile is not None:
+            write_profile(profiling.stop(), args.profile)
+
+
+def write_profile(profile, json_file: str) -> None:
+    """Print the profile to stderr (stdout may carry results) and optionally write JSON."""
+    import json
+
+    print(f"\nProfil:\n{profile.format_report()}", file=sys.stderr)
+    if json_file:
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump(profile.report(), f, ensure_ascii=False, indent=2)
+        print(f"Profil geschrieben nach {json_file}", file=sys.stderr)
+
+
+def run(args):
+    if args.stapel is not None:
+        from batch import read_clients, run_batch
+
+        try:
+            clients = read_clients(args.stapel)
+        except (OSError, ValueError) as e:
+            logging.error(str(e))
+            exit(1)
+        runs = run_batch(args, clients, write_outputs)
+        if any(run.error for run in runs):
+            exit(1)
+        return
+
+    if args.stichtag:
+        run_as_of_dates(args)
+        return
+
+    if args.server is not None:
+        from server import serve
+
+        serve(args, args.server)
+        return
+
+    if args.watch is not None:
+        from incremental import drop_changed_sheets, watch
+
+        # per-security tabs of unchanged securities are reused across rewrites
+        prepared_sheets = {}
+
+        def render(state):
+            drop_changed_sheets(prepared_sheets, state.changed_isins)
+            write_outputs(
+                args,
+                state.portfolio,
+                state.metadata_by_isin,
+                state.vap_by_isin_and_year,
+                prepared_sheets,
+            )
+
+        watch(args, render, args.watch)
+        return
+
+    cache = report_key = None
+    cached_inputs = None
+    if args.cache:
+        from report_cache import ReportCache, cache_digest
+
+        cache = ReportCache(Path(args.cache), args.cache_groesse * 1024 * 1024)
+        input_options = {
+            "isin": args.isin,
+            "depot": args.depot,
+            "gekauft_ab": args.gekauft_ab,
+            "offline": args.offline,
+            # current Forex factors are requested online, so reuse them for one day only
+            "forex_tag": None if args.offline else datetime.date.today(),
+        }
+        inputs_key = cache_digest(
+            [args.buchungen, args.wertpapiere, args.metadaten, args.vap],
+            input_options,
+        )
+        # a projection without seed is random and is therefore never reused
+        if not args.nur_uebersicht and (
+            args.projection_settings is None
+            or args.projection_settings.seed is not None
+        ):
+            report_key = cache_digest(
+                [],
+                {"eingaben": inputs_key, **report_options(args)},
+            )
+            restored = cache.restore_report(report_key)
+            if restored:
+                print(
+                    "Eingaben und Optionen unverändert, Ergebnis aus dem Cache "
+                    "übernommen: " + ", ".join(str(path) for path in restored)
+                )
+                return
+        cached_inputs = cache.load_inputs(inputs_key)
+
+    if cached_inputs is not None:
+        logging.info("Verwende eingelesene Buchungen aus dem Cache.")
+        portfolio, metadata_by_isin, vap_by_isin_and_year = cached_inputs
+    else:
+        portfolio, metadata_by_isin, vap_by_isin_and_year = read_inputs(args)
+        if cache is not None:
+            cache.store_inputs(
+                inputs_key, portfolio, metadata_by_isin, vap_by_isin_and_year
+            )
+    from pyfifovap import print_portfolio_summary
+
     print_portfolio_summary(portfolio)
 
-    logging.info(f"Lese VAP-Daten aus {args.vap}...")
-    vap_by_isin_and_year = read_vap(args.vap, i18n_helper)
-    logging.info(pformat(vap_by_isin_and_year))
+    written = write_outputs(args, portfolio, metadata_by_isin, vap_by_isin_and_year)
+    if report_key is not None:
+        cache.store_report(report_key, written)
+
+
+def run_as_of_dates(args) -> None:
+    """Print or write the results for each --stichtag from one replay with snapshots."""
+    import copy
+
+    from engine import load_timeline
+    from pyfifovap import filter_portfolio, print_portfolio_summary
+    from timeline import vap_as_of
+
+    price_history = None
+    if args.kurshistorie:
+        from price_history import metadata_as_of
 
-    print(f"Generiere Ergebnis-XLSX-Datei {args.output}...")
-    build_results_file(
-        portfolio, metadata_by_isin, vap_by_isin_and_year, args.output, args
+        price_history = read_price_history_option(args)
+    timeline, metadata_by_isin, vap_by_isin_and_year = load_timeline(
+        args.buchungen,
+        args.wertpapiere,
+        args.metadaten,
+        args.vap,
+        offline=args.offline,
+        isins=set(args.isin) if args.isin else None,
     )
+    if args.vap_berechnen:
+        vap_by_isin_and_year = add_computed_vap(
+            args, price_history, metadata_by_isin, vap_by_isin_and_year
+        )
+    output = Path(args.output)
+    for date in sorted(set(args.stichtag)):
+        portfolio = timeline.state_at(date)
+        if args.depot or args.gekauft_ab:
+            portfolio = filter_portfolio(
+                portfolio, set(args.depot) if args.depot else None, args.gekauft_ab
+            )
+        if args.nur_uebersicht != "json":
+            print(f"Stichtag {date.isoformat()}:")
+        print_portfolio_summary(portfolio)
+        date_metadata = metadata_by_isin
+        if price_history is not None:
+            date_metadata = metadata_as_of(metadata_by_isin, price_history, date)
+        date_args = copy.copy(args)
+        date_args.output = str(
+            output.with_name(f"{output.stem}_{date.isoformat()}{output.suffix}")
+        )
+        write_outputs(
+            date_args,
+            portfolio,
+            date_metadata,
+            vap_as_of(vap_by_isin_and_year, date),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,835 @@
+"""Planungswerkzeuge, die verschiedene Varianten gegen einmal eingelesene FIFO-Reihen rechnen.
+
+Statt das Portfolio je Variante zu kopieren und neu zu verarbeiten, arbeiten die Planer
+auf unveränderlichen Sichten (QueueView) der FIFO-Reihen: ein Verkauf oder Übertrag vom
+Anfang der Reihe ist nur ein Versatz in den kumulierten Anteilen.
+"""
+
+import dataclasses
+import datetime
+import logging
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from projection import is_fund, vap_per_share_before_tfs
+from pyfifovap import ETFMetadata, LotArrays, determine_tax_factor_and_header
+
+_EPSILON_SHARES = 1e-7
+_EPSILON_EUR = 1e-7
+
+
+@dataclasses.dataclass
+class QueueView:
+    """
+    Read-only view of one FIFO queue (oldest lot first) at a given quote.
+
+    All what-if operations are expressed through cumulative arrays, so evaluating a
+    sale or transfer from the head of the queue does not modify or copy any lots.
+    """
+
+    broker: str
+    isin: str
+    name: str
+    last_quote_eur: float
+    tfs_factor: float  # (100 - TFS) / 100
+    purchased_dates: list[datetime.datetime]
+    purchased_index: np.ndarray
+    shares: np.ndarray
+    acquisition_price_per_share: np.ndarray  # Kosten pro Anteil + Summe VAP vor TFS
+
+    def __post_init__(self):
+        # KESt-pflichtiger Gewinn pro Anteil nach VAP und TFS
+        self.gain_per_share = (
+            self.last_quote_eur - self.acquisition_price_per_share
+        ) * self.tfs_factor
+        self.cumulative_shares = np.concatenate(([0.0], np.cumsum(self.shares)))
+        self.cumulative_gains = np.concatenate(
+            ([0.0], np.cumsum(self.shares * self.gain_per_share))
+        )
+
+    @property
+    def total_shares(self) -> float:
+        return float(self.cumulative_shares[-1])
+
+    def revalued(
+        self, quote_eur: float, additional_vap_per_share: np.ndarray = 0.0
+    ) -> "QueueView":
+        """The same lots at another quote and with additional VAP per share."""
+        return dataclasses.replace(
+            self,
+            last_quote_eur=quote_eur,
+            acquisition_price_per_share=self.acquisition_price_per_share
+            + additional_vap_per_share,
+        )
+
+    def remaining_shares(self, already_removed: float) -> np.ndarray:
+        """Shares per lot that are left after `already_removed` shares left the head."""
+        return np.clip(self.cumulative_shares[1:] - already_removed, 0.0, self.shares)
+
+    def taxable_gain_up_to(self, num_shares: np.ndarray) -> np.ndarray:
+        """Taxable gain of the first `num_shares` shares of the queue (vectorized)."""
+        num_shares = np.clip(num_shares, 0.0, self.total_shares)
+        return np.interp(num_shares, self.cumulative_shares, self.cumulative_gains)
+
+    def taxable_gain_of_sale(
+        self, num_shares: np.ndarray, already_removed: np.ndarray = 0.0
+    ) -> np.ndarray:
+        """
+        Taxable gain of selling `num_shares` after `already_removed` shares have left the
+        head of the queue. NaN where the queue does not hold enough shares.
+        """
+        num_shares = np.asarray(num_shares, dtype=float)
+        end = np.asarray(already_removed, dtype=float) + num_shares
+        gains = self.taxable_gain_up_to(end) - self.taxable_gain_up_to(already_removed)
+        return np.where(end <= self.total_shares + _EPSILON_SHARES, gains, np.nan)
+
+    def max_shares_within_gain(
+        self, gain_limit: float, already_removed: float = 0.0
+    ) -> float:
+        """
+        Largest sale (in shares) after `already_removed` whose taxable gain does not
+        exceed `gain_limit`. Loss lots may be included as they reduce the gain.
+        """
+        later = self.cumulative_shares[self.cumulative_shares > already_removed]
+        points = np.concatenate(([already_removed], later))
+        gains = self.taxable_gain_up_to(points) - self.taxable_gain_up_to(
+            already_removed
+        )
+        within = gains <= gain_limit + _EPSILON_EUR
+        best = points[within].max() if within.any() else already_removed
+
+        # sales ending inside a lot where the limit is crossed on the way up
+        crossing = within[:-1] & ~within[1:]
+        if crossing.any():
+            slopes = np.diff(gains) / np.diff(points)
+            partial = points[:-1] + (gain_limit - gains[:-1]) / np.where(
+                crossing, slopes, 1.0
+            )
+            best = max(best, partial[crossing].max())
+        return float(best - already_removed)
+
+    def head_gain_ratio(self, already_removed: float = 0.0) -> float:
+        """
+        Taxable gain per EUR of proceeds of the next share after `already_removed`;
+        inf if the queue is sold out.
+        """
+        head = np.searchsorted(
+            self.cumulative_shares[1:], already_removed + _EPSILON_SHARES
+        )
+        if head >= len(self.shares):
+            return np.inf
+        return self.gain_per_share[head] / self.last_quote_eur
+
+
+def build_queue_views(lot_arrays: LotArrays) -> dict[tuple[str, str], QueueView]:
+    """Split the flat lot arrays into one QueueView per (broker, ISIN)."""
+    bounds = np.append(lot_arrays.queue_starts, len(lot_arrays))
+
+    views = {}
+    for queue, (broker, isin, name) in enumerate(lot_arrays.queues):
+        start, end = bounds[queue], bounds[queue + 1]
+        views[(broker, isin)] = QueueView(
+            broker=broker,
+            isin=isin,
+            name=name,
+            last_quote_eur=float(lot_arrays.last_quote_eur[start]),
+            tfs_factor=float(lot_arrays.tfs_factor[start]),
+            purchased_dates=lot_arrays.purchased_dates[start:end],
+            purchased_index=lot_arrays.purchased_index[start:end],
+            shares=lot_arrays.unsold_shares[start:end],
+            acquisition_price_per_share=lot_arrays.acquisition_price_per_share[
+                start:end
+            ],
+        )
+    return views
+
+
+def taxes_of_gains(taxable_gains: np.ndarray, args) -> np.ndarray:
+    """
+    Steuer auf den Gewinn eines einzelnen Verkaufs über mehrere Chargen.
+
+    Innerhalb eines Verkaufs werden Gewinne und Verluste der Chargen verrechnet (siehe
+    fifo_taxable_gains_to_consider); ein Gesamtverlust führt nur mit --gewinne-vorhanden
+    zu einer Erstattung.
+    """
+    final_tax_factor, _ = determine_tax_factor_and_header(args)
+    if args.gewinne_vorhanden:
+        return taxable_gains * final_tax_factor
+    return np.maximum(taxable_gains, 0.0) * final_tax_factor
+
+
+def taxable_gain_of_sale_after_transfer(
+    target: QueueView,
+    source: QueueView,
+    transferred: np.ndarray,
+    num_shares: float,
+) -> np.ndarray:
+    """
+    Taxable gain of selling `num_shares` from `target` after `transferred[i]` shares from
+    the head of `source` were moved there (one result per candidate, NaN if not enough).
+
+    Transferred lots keep their purchase date, so they are merged into the target queue by
+    date. Both queues are merged once; per candidate only the number of shares available
+    from each source lot changes (clip of the transferred amount), which is evaluated for
+    all candidates at once.
+    """
+    transferred = np.asarray(transferred, dtype=float)
+    keys = [
+        (date, int(index), 0)
+        for date, index in zip(target.purchased_dates, target.purchased_index)
+    ] + [
+        (date, int(index), 1)
+        for date, index in zip(source.purchased_dates, source.purchased_index)
+    ]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    num_target = len(target.shares)
+    is_source = np.array([i >= num_target for i in order])
+    source_position = np.array(
+        [i - num_target if i >= num_target else 0 for i in order]
+    )
+    gain_per_share = np.concatenate((target.gain_per_share, source.gain_per_share))[
+        order
+    ]
+
+    # (candidates, merged lots): shares of every merged lot for each candidate
+    source_available = np.clip(
+        transferred[:, None] - source.cumulative_shares[source_position][None, :],
+        0.0,
+        source.shares[source_position][None, :],
+    )
+    target_shares = np.concatenate((target.shares, source.shares))[order]
+    shares = np.where(is_source[None, :], source_available, target_shares[None, :])
+
+    cumulative_shares = np.cumsum(shares, axis=1)
+    cumulative_gains = np.cumsum(shares * gain_per_share[None, :], axis=1)
+    # index of the merged lot in which the sale ends
+    end_lot = np.minimum(
+        (cumulative_shares < num_shares - _EPSILON_SHARES).sum(axis=1), len(order) - 1
+    )
+    rows = np.arange(len(transferred))
+    shares_before = cumulative_shares[rows, end_lot] - shares[rows, end_lot]
+    gains_before = cumulative_gains[rows, end_lot] - (
+        shares[rows, end_lot] * gain_per_share[end_lot]
+    )
+    gains = gains_before + (num_shares - shares_before) * gain_per_share[end_lot]
+    enough = cumulative_shares[:, -1] >= num_shares - _EPSILON_SHARES
+    return np.where(enough, gains, np.nan)
+
+
+@dataclasses.dataclass
+class TransferCandidate:
+    isin: str
+    source_broker: str
+    target_broker: str
+    transferred_shares: float
+    sell_broker: str  # depot from which the target amount is sold after the transfer
+    sold_shares: float
+    taxes: float  # np.inf if the target amount cannot be raised from a single depot
+
+
+def plan_depot_transfers(
+    queue_views: dict[tuple[str, str], QueueView],
+    isin: str,
+    amount_eur: float,
+    args,
+    num_candidates: int = 1000,
+    target_brokers: tuple[str, ...] = (),
+) -> list[TransferCandidate]:
+    """
+    Teildepotüberträge zur FIFO-Optimierung für ein Wertpapier durchrechnen.
+
+    Für jedes Depotpaar (Quelle -> Ziel) werden Übertragsgrößen von 0 bis zum gesamten
+    Bestand der Quelle bewertet (gleichmäßiges Raster plus alle Chargengrenzen). Bewertet
+    wird die Steuer eines anschließenden Verkaufs von `amount_eur` (brutto) aus dem dafür
+    günstigsten Depot. `target_brokers` erlaubt zusätzlich Ziel-Depots ohne Bestand.
+
+    Rückgabe: alle Kandidaten, nach Steuer aufsteigend sortiert. Der Eintrag ohne
+    Quell-Depot (source_broker == "") ist die Ausgangslage ohne Übertrag.
+    """
+    holding = {
+        broker: view
+        for (broker, view_isin), view in queue_views.items()
+        if view_isin == isin
+    }
+    if not holding:
+        raise ValueError(f"Kein Bestand mit bekanntem Kurs für {isin}")
+    quote = next(iter(holding.values())).last_quote_eur
+    num_shares = amount_eur / quote
+
+    views = dict(holding)
+    for broker in target_brokers:
+        if broker not in views:
+            views[broker] = dataclasses.replace(
+                next(iter(holding.values())),
+                broker=broker,
+                purchased_dates=[],
+                purchased_index=np.zeros(0, dtype=np.intp),
+                shares=np.zeros(0),
+                acquisition_price_per_share=np.zeros(0),
+            )
+
+    def best_of(taxes_by_broker: dict[str, np.ndarray]) -> tuple[np.ndarray, list[str]]:
+        brokers = list(taxes_by_broker)
+        stacked = np.stack([taxes_by_broker[broker] for broker in brokers])
+        stacked = np.where(np.isnan(stacked), np.inf, stacked)
+        best = stacked.argmin(axis=0)
+        return stacked.min(axis=0), [brokers[i] for i in best]
+
+    candidates = []
+    baseline_taxes, baseline_brokers = best_of(
+        {
+            broker: taxes_of_gains(
+                view.taxable_gain_of_sale(np.array([num_shares])), args
+            )
+            for broker, view in holding.items()
+        }
+    )
+    candidates.append(
+        TransferCandidate(
+            isin=isin,
+            source_broker="",
+            target_broker="",
+            transferred_shares=0.0,
+            sell_broker=baseline_brokers[0],
+            sold_shares=num_shares,
+            taxes=float(baseline_taxes[0]),
+        )
+    )
+
+    for source_broker, source in holding.items():
+        transferred = np.union1d(
+            np.linspace(0.0, source.total_shares, num_candidates + 1)[1:],
+            source.cumulative_shares[1:],
+        )
+        for target_broker, target in views.items():
+            if target_broker == source_broker:
+                continue
+            taxes_by_broker = {
+                source_broker: taxes_of_gains(
+                    source.taxable_gain_of_sale(num_shares, transferred), args
+                ),
+                target_broker: taxes_of_gains(
+                    taxable_gain_of_sale_after_transfer(
+                        target, source, transferred, num_shares
+                    ),
+                    args,
+                ),
+            }
+            # depots not involved in the transfer are unchanged
+            for broker, view in holding.items():
+                if broker not in taxes_by_broker:
+                    taxes_by_broker[broker] = np.broadcast_to(
+                        taxes_of_gains(view.taxable_gain_of_sale(num_shares), args),
+                        transferred.shape,
+                    )
+            taxes, sell_brokers = best_of(taxes_by_broker)
+            candidates.extend(
+                TransferCandidate(
+                    isin=isin,
+                    source_broker=source_broker,
+                    target_broker=target_broker,
+                    transferred_shares=float(shares),
+                    sell_broker=sell_broker,
+                    sold_shares=num_shares,
+                    taxes=float(tax),
+                )
+                for shares, sell_broker, tax in zip(transferred, sell_brokers, taxes)
+            )
+
+    logging.info(
+        f"Übertragsplanung {isin}: {len(candidates)} Kandidaten für {amount_eur:.2f} EUR bewertet"
+    )
+    # stable sort keeps smaller transfers first among equal taxes
+    candidates.sort(key=lambda candidate: candidate.taxes)
+    return candidates
+
+
+def collect_transfer_plan_summary(
+    candidates: list[TransferCandidate], args, max_rows_per_pair: int = 10
+) -> pd.DataFrame:
+    """
+    Beste Übertragsgrößen je Depotpaar als DataFrame, beginnend mit der Ausgangslage
+    ohne Übertrag. Die Ersparnis bezieht sich auf die Steuer ohne Übertrag.
+    """
+    if not candidates:
+        return pd.DataFrame()
+    _, kest_header = determine_tax_factor_and_header(args)
+    baseline = next(c for c in candidates if c.source_broker == "")
+
+    rows = []
+    rows_per_pair = {}
+    for candidate in [baseline] + [c for c in candidates if c is not baseline]:
+        pair = (candidate.source_broker, candidate.target_broker)
+        if rows_per_pair.get(pair, 0) >= max_rows_per_pair:
+            continue
+        rows_per_pair[pair] = rows_per_pair.get(pair, 0) + 1
+        feasible = np.isfinite(candidate.taxes)
+        rows.append(
+            {
+                "ISIN": candidate.isin,
+                "Übertrag von": candidate.source_broker or "(kein Übertrag)",
+                "Übertrag nach": candidate.target_broker,
+                "Anzahl Übertrag": candidate.transferred_shares,
+                "Verkauf aus Depot": candidate.sell_broker if feasible else "",
+                "Anzahl Verkauf": candidate.sold_shares,
+                kest_header + " beim Verkauf": candidate.taxes if feasible else "",
+                "Ersparnis ggü. ohne Übertrag": (
+                    baseline.taxes - candidate.taxes
+                    if feasible and np.isfinite(baseline.taxes)
+                    else ""
+                ),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+@dataclasses.dataclass
+class SellScheduleSettings:
+    years: int
+    # exactly one of the two yearly sell rules is used
+    max_gain_per_year: Optional[float] = None  # realize up to this taxable gain (EUR)
+    sell_percent_per_year: Optional[float] = None  # sell this fraction of each position
+    pauschbetrag: float = 1000.0
+    expected_return: float = 0.0  # yearly price change, as fraction
+    basiszins: list[float] = dataclasses.field(default_factory=lambda: [0.0253])
+    isins: tuple[str, ...] = ()  # restrict the schedule to these ISINs (all if empty)
+    start_year: int = dataclasses.field(
+        default_factory=lambda: datetime.date.today().year
+    )
+
+    def basiszins_per_year(self) -> np.ndarray:
+        """Basiszins for each simulated year; the last given value is carried forward."""
+        values = self.basiszins[: self.years]
+        return np.array(values + [values[-1]] * (self.years - len(values)))
+
+
+@dataclasses.dataclass
+class SellScheduleYear:
+    year: int
+    # per (broker, ISIN): sold shares, proceeds and taxable gain of the sale
+    sold_shares: dict[tuple[str, str], float]
+    proceeds: dict[tuple[str, str], float]
+    realized_gains: dict[tuple[str, str], float]
+    quotes: dict[tuple[str, str], float]
+    vap_income: float  # VAP nach TFS, die in diesem Jahr als zugeflossen gilt
+    taxable_after_pauschbetrag: float
+    taxes: float
+    remaining_value: float  # Brutto-Wert der verbliebenen Anteile zum Jahreskurs
+
+
+def simulate_sell_schedule(
+    queue_views: dict[tuple[str, str], QueueView],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    settings: SellScheduleSettings,
+    args,
+) -> list[SellScheduleYear]:
+    """
+    Verkaufsplan über mehrere Jahre, ausgehend von den aktuellen FIFO-Reihen.
+
+    Je Jahr wird zuerst die VAP des Vorjahres gutgeschrieben (erhöht den Anschaffungspreis
+    der verbliebenen Anteile und zählt als Kapitalertrag dieses Jahres), danach wird nach
+    der Verkaufsregel vom Anfang der Reihen verkauft. Die Kurse entwickeln sich mit
+    `expected_return`. Der FIFO-Zustand ist je Reihe nur ein Versatz der bereits
+    verkauften Anteile - das Portfolio wird nicht kopiert oder neu eingelesen.
+
+    Bei `max_gain_per_year` werden die Reihen mit dem geringsten Gewinn pro Anteil am
+    Reihenanfang zuerst genutzt, bis das Budget (abzüglich VAP) ausgeschöpft ist.
+    Gewinne und Verluste eines Jahres werden verrechnet, danach der Pauschbetrag.
+    """
+    final_tax_factor, _ = determine_tax_factor_and_header(args)
+    views = {
+        key: view
+        for key, view in queue_views.items()
+        if not settings.isins or view.isin in settings.isins
+    }
+    removed = {key: 0.0 for key in views}
+    future_vap = {key: np.zeros(len(view.shares)) for key, view in views.items()}
+    basiszins = settings.basiszins_per_year()
+
+    schedule = []
+    for year_offset in range(settings.years):
+        year = settings.start_year + year_offset
+        growth = (1 + settings.expected_return) ** year_offset
+
+        vap_income = 0.0
+        if year_offset > 0:
+            vap_year = year - 1
+            previous_growth = growth / (1 + settings.expected_return)
+            for key, view in views.items():
+                if not is_fund(
+                    view.isin, metadata_by_isin, vap_by_isin_and_year
+                ) or vap_year in vap_by_isin_and_year.get(view.isin, {}):
+                    continue
+                vap_per_share = vap_per_share_before_tfs(
+                    view.last_quote_eur * np.array([previous_growth, growth]),
+                    basiszins[year_offset - 1],
+                )[0]
+                proportion = np.array(
+                    [
+                        (13 - date.month) / 12.0 if date.year == vap_year else 1.0
+                        for date in view.purchased_dates
+                    ]
+                )
+                lot_vap = vap_per_share * proportion
+                future_vap[key] = future_vap[key] + lot_vap
+                vap_income += float(
+                    (lot_vap * view.remaining_shares(removed[key])).sum()
+                    * view.tfs_factor
+                )
+
+        current = {
+            key: view.revalued(view.last_quote_eur * growth, future_vap[key])
+            for key, view in views.items()
+        }
+
+        sold_shares = {}
+        if settings.sell_percent_per_year is not None:
+            for key, view in current.items():
+                remaining = view.total_shares - removed[key]
+                sold_shares[key] = max(remaining, 0.0) * settings.sell_percent_per_year
+        else:
+            budget = settings.max_gain_per_year - vap_income
+            ratios = {
+                key: view.head_gain_ratio(removed[key]) for key, view in current.items()
+            }
+            for key in sorted(current, key=ratios.__getitem__):
+                shares = current[key].max_shares_within_gain(budget, removed[key])
+                sold_shares[key] = shares
+                budget -= float(current[key].taxable_gain_of_sale(shares, removed[key]))
+
+        realized_gains = {}
+        proceeds = {}
+        for key, shares in sold_shares.items():
+            realized_gains[key] = (
+                float(current[key].taxable_gain_of_sale(shares, removed[key]))
+                if shares > 0
+                else 0.0
+            )
+            proceeds[key] = shares * current[key].last_quote_eur
+            removed[key] += shares
+
+        taxable = max(
+            sum(realized_gains.values()) + vap_income - settings.pauschbetrag, 0.0
+        )
+        schedule.append(
+            SellScheduleYear(
+                year=year,
+                sold_shares=sold_shares,
+                proceeds=proceeds,
+                realized_gains=realized_gains,
+                quotes={key: view.last_quote_eur for key, view in current.items()},
+                vap_income=vap_income,
+                taxable_after_pauschbetrag=taxable,
+                taxes=taxable * final_tax_factor,
+                remaining_value=sum(
+                    (view.total_shares - removed[key]) * view.last_quote_eur
+                    for key, view in current.items()
+                ),
+            )
+        )
+    return schedule
+
+
+def collect_sell_schedule_summary(
+    schedule: list[SellScheduleYear], queue_views: dict[tuple[str, str], QueueView]
+) -> pd.DataFrame:
+    """
+    Verkaufsplan als DataFrame: je Jahr eine Zeile pro verkaufter Reihe, danach eine
+    "Summe"-Zeile mit VAP, steuerpflichtigem Betrag nach Pauschbetrag und Steuer.
+    """
+    rows = []
+    blank = {
+        "Jahr": "",
+        "ISIN": "",
+        "Name": "",
+        "Depot": "",
+        "Kurs": "",
+        "Anzahl Verkauf": "",
+        "Erlös": "",
+        "Realisierter Gewinn": "",
+        "VAP nach TFS": "",
+        "Steuerpflichtig nach Pauschbetrag": "",
+        "Steuer": "",
+        "Restwert": "",
+    }
+    for entry in schedule:
+        for key in sorted(entry.sold_shares):
+            if entry.sold_shares[key] <= _EPSILON_SHARES:
+                continue
+            broker, isin = key
+            rows.append(
+                blank
+                | {
+                    "Jahr": entry.year,
+                    "ISIN": isin,
+                    "Name": queue_views[key].name,
+                    "Depot": broker,
+                    "Kurs": entry.quotes[key],
+                    "Anzahl Verkauf": entry.sold_shares[key],
+                    "Erlös": entry.proceeds[key],
+                    "Realisierter Gewinn": entry.realized_gains[key],
+                }
+            )
+        rows.append(
+            blank
+            | {
+                "Jahr": entry.year,
+                "ISIN": "Summe",
+                "Erlös": sum(entry.proceeds.values()),
+                "Realisierter Gewinn": sum(entry.realized_gains.values()),
+                "VAP nach TFS": entry.vap_income,
+                "Steuerpflichtig nach Pauschbetrag": entry.taxable_after_pauschbetrag,
+                "Steuer": entry.taxes,
+                "Restwert": entry.remaining_value,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def allocate_sale_across_depots(
+    views: list[QueueView], amount_eur: float, args, resolution: int = 200
+) -> np.ndarray:
+    """
+    Split a sale of `amount_eur` across several depots with minimal total tax.
+
+    The amount is discretized into `resolution` steps; a dynamic program over the depots
+    then finds the cheapest combination of FIFO sales from the head of each queue. Cost
+    is O(depots * resolution^2) and independent of the number of lots, so FIFO curves
+    where a costly head lot hides behind a cheap average are handled exactly on the grid.
+    Returns the EUR amount to sell per depot.
+    """
+    steps = amount_eur / resolution * np.arange(resolution + 1)
+    costs = []
+    for view in views:
+        value = view.total_shares * view.last_quote_eur
+        shares = np.minimum(steps / view.last_quote_eur, view.total_shares)
+        taxes = taxes_of_gains(view.taxable_gain_up_to(shares), args)
+        costs.append(
+            np.where(steps <= value * (1 + 1e-9) + _EPSILON_EUR, taxes, np.inf)
+        )
+
+    # best[k]: minimal taxes when k steps are sold from the depots seen so far
+    best = costs[0]
+    choices = []
+    taken = np.subtract.outer(np.arange(resolution + 1), np.arange(resolution + 1))
+    for cost in costs[1:]:
+        # combined[k, j]: j steps from this depot, k - j from the previous ones
+        combined = np.where(
+            taken >= 0, best[np.maximum(taken, 0)] + cost[None, :], np.inf
+        )
+        choice = np.argmin(combined, axis=1)
+        choices.append(choice)
+        best = combined[np.arange(resolution + 1), choice]
+
+    allocation = np.zeros(len(views))
+    remaining = resolution
+    for depot in range(len(views) - 1, 0, -1):
+        steps_from_depot = choices[depot - 1][remaining]
+        allocation[depot] = steps[steps_from_depot]
+        remaining -= steps_from_depot
+    allocation[0] = steps[remaining]
+    return allocation
+
+
+def parse_target_weights(specs: Optional[list[str]]) -> dict[str, float]:
+    """Parse "ISIN=PROZENT" entries into target weights (as fractions)."""
+    target_weights = {}
+    for spec in specs or []:
+        isin, sep, value = spec.partition("=")
+        try:
+            weight = float(value) / 100
+        except ValueError:
+            weight = -1.0
+        if not sep or not isin or weight < 0:
+            raise ValueError(
+                f"Ungültiges Zielgewicht '{spec}' (erwartet: ISIN=PROZENT)"
+            )
+        target_weights[isin] = weight
+    return target_weights
+
+
+@dataclasses.dataclass
+class RebalanceTrade:
+    isin: str
+    broker: str
+    sold_shares: float
+    proceeds: float
+    taxable_gain: float
+    taxes: float
+
+
+@dataclasses.dataclass
+class RebalancePlan:
+    current_values: dict[str, float]  # per ISIN, summed over all depots
+    target_weights: dict[str, float]
+    trades: list[RebalanceTrade]
+    purchases: dict[str, float]  # reinvestment of the proceeds per ISIN (EUR)
+
+    @property
+    def total_value(self) -> float:
+        return sum(self.current_values.values())
+
+    def values_after(self) -> dict[str, float]:
+        values = dict(self.current_values)
+        for trade in self.trades:
+            values[trade.isin] -= trade.proceeds
+        for isin, amount in self.purchases.items():
+            values[isin] += amount
+        return values
+
+
+def plan_rebalancing(
+    queue_views: dict[tuple[str, str], QueueView],
+    target_weights: dict[str, float],
+    args,
+    tolerance: float = 0.0,
+    resolution: int = 200,
+) -> RebalancePlan:
+    """
+    Umschichtung auf Zielgewichte mit möglichst geringer KESt.
+
+    Die Gewichte beziehen sich auf den Gesamtwert der genannten Wertpapiere über alle
+    Depots; andere Bestände bleiben unberührt. Übergewichtete Wertpapiere werden nur bis
+    an die obere Toleranzgrenze verkauft, die Erlöse anteilig in untergewichtete
+    Wertpapiere investiert (Käufe lösen keine Steuer aus).
+
+    Je Wertpapier wird der Verkaufsbetrag mit allocate_sale_across_depots so auf die
+    Depots verteilt, dass die Steuer der FIFO-Verkäufe minimal wird.
+    """
+    weight_sum = sum(target_weights.values())
+    if weight_sum <= 0:
+        raise ValueError("Die Zielgewichte müssen in Summe größer als 0 sein")
+    if abs(weight_sum - 1.0) > 1e-6:
+        logging.warning(
+            f"Zielgewichte ergeben in Summe {weight_sum * 100:.2f}% statt 100% - sie werden "
+            f"auf 100% skaliert."
+        )
+    target_weights = {
+        isin: weight / weight_sum for isin, weight in target_weights.items()
+    }
+
+    views_by_isin = defaultdict(list)
+    for view in queue_views.values():
+        if view.isin in target_weights and view.total_shares > _EPSILON_SHARES:
+            views_by_isin[view.isin].append(view)
+    current_values = {
+        isin: sum(
+            view.total_shares * view.last_quote_eur for view in views_by_isin[isin]
+        )
+        for isin in target_weights
+    }
+    total_value = sum(current_values.values())
+
+    trades = []
+    for isin, weight in target_weights.items():
+        amount = current_values[isin] - (weight + tolerance) * total_value
+        if amount <= _EPSILON_EUR:
+            continue
+
+        views = sorted(views_by_isin[isin], key=lambda view: view.broker)
+        for view, value in zip(
+            views, allocate_sale_across_depots(views, amount, args, resolution)
+        ):
+            if value <= _EPSILON_EUR:
+                continue
+            shares = min(value / view.last_quote_eur, view.total_shares)
+            gain = float(view.taxable_gain_of_sale(shares))
+            trades.append(
+                RebalanceTrade(
+                    isin=isin,
+                    broker=view.broker,
+                    sold_shares=shares,
+                    proceeds=value,
+                    taxable_gain=gain,
+                    taxes=float(taxes_of_gains(np.array(gain), args)),
+                )
+            )
+
+    proceeds = sum(trade.proceeds for trade in trades)
+    deficits = {
+        isin: max(weight * total_value - current_values[isin], 0.0)
+        for isin, weight in target_weights.items()
+    }
+    deficit_sum = sum(deficits.values())
+    purchases = {
+        isin: proceeds * deficit / deficit_sum if deficit_sum > 0 else 0.0
+        for isin, deficit in deficits.items()
+    }
+    return RebalancePlan(
+        current_values=current_values,
+        target_weights=target_weights,
+        trades=trades,
+        purchases=purchases,
+    )
+
+
+def collect_rebalancing_summary(plan: RebalancePlan, args) -> pd.DataFrame:
+    """
+    Umschichtungsplan als DataFrame: je Wertpapier eine Zeile mit aktuellem Gewicht,
+    Zielgewicht und Gewicht danach, gefolgt von den Verkäufen je Depot. Abschließend
+    eine "GESAMTSUMME"-Zeile.
+    """
+    if not plan.current_values or plan.total_value <= 0:
+        return pd.DataFrame()
+    _, kest_header = determine_tax_factor_and_header(args)
+    total_value = plan.total_value
+    values_after = plan.values_after()
+    blank = {
+        "ISIN": "",
+        "Depot": "",
+        "Wert aktuell": "",
+        "Gewicht aktuell": "",
+        "Zielgewicht": "",
+        "Anzahl Verkauf": "",
+        "Erlös": "",
+        "KESt-pflichtiger Gewinn": "",
+        kest_header: "",
+        "Kauf": "",
+        "Gewicht danach": "",
+    }
+
+    rows = []
+    for isin in sorted(plan.target_weights):
+        rows.append(
+            blank
+            | {
+                "ISIN": isin,
+                "Wert aktuell": plan.current_values[isin],
+                "Gewicht aktuell": plan.current_values[isin] / total_value,
+                "Zielgewicht": plan.target_weights[isin],
+                "Kauf": plan.purchases[isin],
+                "Gewicht danach": values_after[isin] / total_value,
+            }
+        )
+        for trade in sorted(
+            (trade for trade in plan.trades if trade.isin == isin),
+            key=lambda trade: trade.broker,
+        ):
+            rows.append(
+                blank
+                | {
+                    "ISIN": isin,
+                    "Depot": trade.broker,
+                    "Anzahl Verkauf": trade.sold_shares,
+                    "Erlös": trade.proceeds,
+                    "KESt-pflichtiger Gewinn": trade.taxable_gain,
+                    kest_header: trade.taxes,
+                }
+            )
+
+    rows.append(
+        blank
+        | {
+            "ISIN": "GESAMTSUMME",
+            "Wert aktuell": total_value,
+            "Erlös": sum(trade.proceeds for trade in plan.trades),
+            "KESt-pflichtiger Gewinn": sum(trade.taxable_gain for trade in plan.trades),
+            kest_header: sum(trade.taxes for trade in plan.trades),
+            "Kauf": sum(plan.purchases.values()),
+        }
+    )
+    return pd.DataFrame(rows)
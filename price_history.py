@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Historische Kurse je ISIN für Bewertungen zu beliebigen Tagen (--kurshistorie).
+
+Quellen:
+- eine CSV-Datei mit den Spalten ISIN, Datum (JJJJ-MM-TT) und Kurs (EUR, Punkt als
+  Dezimaltrennzeichen) wie die übrigen eigenen CSV-Dateien,
+- ein Verzeichnis mit je einer Datei <ISIN>.csv im Format des Kurs-Exports von
+  PortfolioPerformance (Spalten Datum;Kurs bzw. Date,Quote),
+- ein mit diesem Skript erzeugter Index (Verzeichnis mit kurshistorie_index.json), dessen
+  Arrays nur in den Speicher eingeblendet (memory-mapped) statt eingelesen werden.
+
+Gespeichert werden alle Kurse in zwei Arrays (Tag als int32 seit 1970-01-01, Kurs als
+float64), je ISIN ein zusammenhängender, nach Datum sortierter Bereich. Der Kurs zu einem
+Tag ist der letzte Kurs an oder vor diesem Tag (binäre Suche).
+
+Beispiel (Index aus vielen Kurs-Exporten erzeugen):
+   python price_history.py Kurse/ Kursindex/
+"""
+
+import argparse
+import dataclasses
+import datetime
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from i18n_helper import I18nHelper
+from pyfifovap import ETFMetadata
+
+INDEX_FILE = "kurshistorie_index.json"
+DAYS_FILE = "kurshistorie_tage.npy"
+PRICES_FILE = "kurshistorie_kurse.npy"
+EPOCH = datetime.date(1970, 1, 1)
+
+# date and quote columns of the quote export of PortfolioPerformance
+QUOTE_EXPORT_DATE_COLUMNS = ("Datum", "Date")
+QUOTE_EXPORT_PRICE_COLUMNS = ("Kurs", "Schlusskurs", "Quote", "Close")
+
+
+def _day(date: datetime.date) -> int:
+    return (date - EPOCH).days
+
+
+class PriceHistory:
+    """Sorted date/price arrays of all ISINs with as-of lookups."""
+
+    def __init__(
+        self,
+        days: np.ndarray,
+        prices: np.ndarray,
+        ranges: dict[str, tuple[int, int]],
+    ):
+        # days[start:end] and prices[start:end] of ranges[isin], sorted by day
+        self.days = days
+        self.prices = prices
+        self.ranges = ranges
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "PriceHistory":
+        """From a DataFrame with the columns ISIN, Datum (date) and Kurs; the last price of a day wins."""
+        custom_names = I18nHelper().get_custom_csv_names()
+        df = (
+            pd.DataFrame(
+                {
+                    "isin": df[custom_names.ISIN].astype(str),
+                    "day": pd.to_datetime(df[custom_names.DATUM])
+                    .to_numpy()
+                    .astype("datetime64[D]")
+                    .astype(np.int64),
+                    "price": df[custom_names.KURS].astype(float),
+                }
+            )
+            .drop_duplicates(subset=["isin", "day"], keep="last")
+            .sort_values(["isin", "day"], kind="stable")
+        )
+        isins = df["isin"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, isins[1:] != isins[:-1]]) if len(df) else []
+        ends = [*starts[1:], len(df)]
+        return cls(
+            df["day"].to_numpy(dtype=np.int32),
+            df["price"].to_numpy(dtype=np.float64),
+            {
+                str(isins[start]): (int(start), int(end))
+                for start, end in zip(starts, ends)
+            },
+        )
+
+    def __contains__(self, isin: str) -> bool:
+        return isin in self.ranges
+
+    @property
+    def isins(self) -> list[str]:
+        return list(self.ranges)
+
+    def price_at(self, isin: str, date: datetime.date) -> Optional[float]:
+        """The last price of `isin` on or before `date`, or None."""
+        if isin not in self.ranges:
+            return None
+        start, end = self.ranges[isin]
+        position = np.searchsorted(self.days[start:end], _day(date), side="right")
+        return float(self.prices[start + position - 1]) if position else None
+
+    def prices_at(self, isin: str, dates: list[datetime.date]) -> np.ndarray:
+        """The prices of `isin` at many dates at once; NaN before the first price."""
+        result = np.full(len(dates), np.nan)
+        if isin not in self.ranges:
+            return result
+        start, end = self.ranges[isin]
+        positions = np.searchsorted(
+            self.days[start:end],
+            np.array([_day(date) for date in dates], dtype=np.int32),
+            side="right",
+        )
+        known = positions > 0
+        result[known] = self.prices[start + positions[known] - 1]
+        return result
+
+    def quotes_at(self, date: datetime.date) -> dict[str, float]:
+        """The price of every ISIN with a price on or before `date`."""
+        quotes = {}
+        for isin in self.ranges:
+            price = self.price_at(isin, date)
+            if price is not None:
+                quotes[isin] = price
+        return quotes
+
+    def save(self, directory: str | Path) -> None:
+        """Write the arrays as .npy files (see load) and the ISIN ranges as JSON."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / DAYS_FILE, np.asarray(self.days, dtype=np.int32))
+        np.save(directory / PRICES_FILE, np.asarray(self.prices, dtype=np.float64))
+        (directory / INDEX_FILE).write_text(json.dumps(self.ranges), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory: str | Path, mmap: bool = True) -> "PriceHistory":
+        """Load a saved index; with `mmap` the arrays are paged in on access only."""
+        directory = Path(directory)
+        mmap_mode = "r" if mmap else None
+        ranges = json.loads((directory / INDEX_FILE).read_text(encoding="utf-8"))
+        return cls(
+            np.load(directory / DAYS_FILE, mmap_mode=mmap_mode),
+            np.load(directory / PRICES_FILE, mmap_mode=mmap_mode),
+            {isin: tuple(bounds) for isin, bounds in ranges.items()},
+        )
+
+
+def read_quote_export(path: str | Path) -> pd.DataFrame:
+    """Read a quote export of PortfolioPerformance; returns the columns Datum and Kurs."""
+    with open(path, encoding="utf-8-sig") as f:
+        header = f.readline()
+    i18n_helper = I18nHelper(is_german=";" in header)
+    data = pd.read_csv(
+        path,
+        sep=i18n_helper.get_pp_csv_separator(),
+        keep_default_na=False,
+        dtype=str,
+        encoding="utf-8-sig",
+    )
+    date_column = next((c for c in QUOTE_EXPORT_DATE_COLUMNS if c in data), None)
+    price_column = next((c for c in QUOTE_EXPORT_PRICE_COLUMNS if c in data), None)
+    if date_column is None or price_column is None:
+        raise ValueError(
+            f"{path}: Spalten für Datum ({'/'.join(QUOTE_EXPORT_DATE_COLUMNS)}) und Kurs "
+            f"({'/'.join(QUOTE_EXPORT_PRICE_COLUMNS)}) nicht gefunden"
+        )
+    data = data[data[price_column] != ""]
+    custom_names = i18n_helper.get_custom_csv_names()
+    return pd.DataFrame(
+        {
+            custom_names.DATUM: data[date_column].str[:10],
+            custom_names.KURS: [i18n_helper.parse_float(v) for v in data[price_column]],
+        }
+    )
+
+
+def read_price_history(path: str | Path) -> PriceHistory:
+    """Read a price history from one of the sources described in the module docs."""
+    path = Path(path)
+    custom_names = I18nHelper().get_custom_csv_names()
+    if path.is_dir() and (path / INDEX_FILE).exists():
+        return PriceHistory.load(path)
+    if path.is_dir():
+        frames = [
+            read_quote_export(file).assign(**{custom_names.ISIN: file.stem})
+            for file in sorted(path.glob("*.csv"))
+        ]
+        if not frames:
+            raise ValueError(f"{path}: keine Kurs-Dateien <ISIN>.csv gefunden")
+        return PriceHistory.from_frame(pd.concat(frames, ignore_index=True))
+    return PriceHistory.from_frame(pd.read_csv(path, dtype={custom_names.ISIN: str}))
+
+
+def metadata_as_of(
+    metadata_by_isin: dict[str, ETFMetadata],
+    price_history: PriceHistory,
+    date: datetime.date,
+) -> dict[str, ETFMetadata]:
+    """The metadata with the historical price at `date` as quote, where one is known."""
+    metadata_at_date = dict(metadata_by_isin)
+    for isin, metadata in metadata_by_isin.items():
+        price = price_history.price_at(isin, date)
+        if price is not None:
+            metadata_at_date[isin] = dataclasses.replace(metadata, last_quote_eur=price)
+    return metadata_at_date
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Kurshistorie (CSV-Datei oder Verzeichnis mit Kurs-Exporten) in einen "
+        "kompakten Index umwandeln, der bei --kurshistorie nur eingeblendet wird"
+    )
+    parser.add_argument("quelle", help="CSV-Datei (ISIN, Datum, Kurs) oder Verzeichnis")
+    parser.add_argument("ziel", help="Verzeichnis für den Index")
+    args = parser.parse_args()
+
+    price_history = read_price_history(args.quelle)
+    price_history.save(args.ziel)
+    print(
+        f"{len(price_history.days)} Kurse von {len(price_history.ranges)} Wertpapieren "
+        f"nach {args.ziel} geschrieben"
+    )
+
+
+if __name__ == "__main__":
+    main()
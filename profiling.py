@@ -0,0 +1,181 @@
+"""Laufzeit, CPU-Zeit und Speicher je Verarbeitungsschritt sowie Ereigniszähler (--profile).
+
+Die Schritte werden im Code mit `stage(name)` markiert (als Kontextmanager oder
+Dekorator); ohne aktives Profil kostet das nur eine Abfrage. Schritte dürfen verschachtelt
+sein (z. B. "xlsx_schreiben/uebersicht_berechnen") und mehrfach durchlaufen werden, ihre
+Werte werden dann aufsummiert. Der Speicher ist die Spitze der von Python verwalteten
+Allokationen (tracemalloc, inklusive NumPy und pandas) während des Schritts; tracemalloc
+läuft nur bei aktivem Profil.
+
+Die Zähler in `counters` werden immer mitgeführt (eine Addition je Ereignis) und mit
+start() zurückgesetzt.
+"""
+
+import contextlib
+import dataclasses
+import datetime
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+# event counters, e.g. counters["chargen_angelegt"] += 1
+counters: Counter[str] = Counter()
+
+_active: Optional["Profile"] = None
+_started_tracing = False
+
+
+@dataclasses.dataclass
+class StageStats:
+    calls: int = 0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_bytes: int = 0
+
+
+@dataclasses.dataclass
+class _OpenStage:
+    name: str
+    path: str  # names of the enclosing stages and this one, joined by "/"
+    start: float
+    start_cpu: float
+    peak_bytes: int
+
+
+class Profile:
+    """Stage statistics between start() and stop(), keyed by stage path."""
+
+    def __init__(self):
+        self.stages: dict[str, StageStats] = {}
+        self._open: list[_OpenStage] = []
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.seconds = self.cpu_seconds = 0.0
+        self.peak_bytes = 0
+        self.counters: dict[str, int] = {}
+
+    def _propagate_peak(self) -> None:
+        # the tracemalloc peak is shared by all open stages, so it is folded into each
+        # of them before it is reset for a nested stage
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak_bytes = max(self.peak_bytes, peak)
+        for open_stage in self._open:
+            open_stage.peak_bytes = max(open_stage.peak_bytes, peak)
+
+    def enter(self, name: str) -> None:
+        self._propagate_peak()
+        tracemalloc.reset_peak()
+        path = f"{self._open[-1].path}/{name}" if self._open else name
+        self.stages.setdefault(path, StageStats())
+        self._open.append(
+            _OpenStage(
+                name,
+                path,
+                time.perf_counter(),
+                time.process_time(),
+                tracemalloc.get_traced_memory()[0],
+            )
+        )
+
+    def exit(self, name: str) -> None:
+        if not self._open or self._open[-1].name != name:
+            # entered before the profile was started
+            return
+        self._propagate_peak()
+        open_stage = self._open.pop()
+        stats = self.stages[open_stage.path]
+        stats.calls += 1
+        stats.seconds += time.perf_counter() - open_stage.start
+        stats.cpu_seconds += time.process_time() - open_stage.start_cpu
+        stats.peak_bytes = max(stats.peak_bytes, open_stage.peak_bytes)
+
+    def finish(self) -> None:
+        self._propagate_peak()
+        self.seconds = time.perf_counter() - self.start
+        self.cpu_seconds = time.process_time() - self.start_cpu
+        self.counters = dict(sorted(counters.items()))
+
+    def report(self) -> dict:
+        """The profile as JSON-compatible dict."""
+        return {
+            "zeitpunkt": datetime.datetime.now().isoformat(timespec="seconds"),
+            "gesamt": {
+                "sekunden": round(self.seconds, 6),
+                "cpu_sekunden": round(self.cpu_seconds, 6),
+                "speicher_spitze_mb": round(self.peak_bytes / 2**20, 3),
+            },
+            "schritte": {
+                path: {
+                    "aufrufe": stats.calls,
+                    "sekunden": round(stats.seconds, 6),
+                    "cpu_sekunden": round(stats.cpu_seconds, 6),
+                    "speicher_spitze_mb": round(stats.peak_bytes / 2**20, 3),
+                }
+                for path, stats in self.stages.items()
+            },
+            "zaehler": self.counters,
+        }
+
+    def format_report(self) -> str:
+        """The profile as text table, nested stages indented below their parent."""
+        lines = [
+            f"{'Schritt':<34}{'Aufrufe':>8}{'Sekunden':>10}{'CPU-s':>9}{'Spitze MB':>11}"
+        ]
+        for path, stats in self.stages.items():
+            *parents, name = path.split("/")
+            label = "  " * len(parents) + name
+            lines.append(
+                f"{label:<34}{stats.calls:>8}{stats.seconds:>10.3f}"
+                f"{stats.cpu_seconds:>9.3f}{stats.peak_bytes / 2**20:>11.1f}"
+            )
+        lines.append(
+            f"{'gesamt':<34}{'':>8}{self.seconds:>10.3f}{self.cpu_seconds:>9.3f}"
+            f"{self.peak_bytes / 2**20:>11.1f}"
+        )
+        if self.counters:
+            lines.append("")
+            lines.append("Zähler:")
+            lines.extend(f"  {name}: {value}" for name, value in self.counters.items())
+        return "\n".join(lines)
+
+
+class _Stage(contextlib.ContextDecorator):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if _active is not None:
+            _active.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if _active is not None:
+            _active.exit(self.name)
+        return False
+
+
+def stage(name: str) -> _Stage:
+    """Mark a stage: `with stage("fifo_replay"): ...` or `@stage("vap_einlesen")`."""
+    return _Stage(name)
+
+
+def start() -> Profile:
+    """Start profiling this process; resets the counters."""
+    global _active, _started_tracing
+    counters.clear()
+    _started_tracing = not tracemalloc.is_tracing()
+    if _started_tracing:
+        tracemalloc.start()
+    _active = Profile()
+    return _active
+
+
+def stop() -> Profile:
+    """Stop profiling and return the finished profile."""
+    global _active
+    profile, _active = _active, None
+    profile.finish()
+    if _started_tracing:
+        tracemalloc.stop()
+    return profile
@@ -0,0 +1,283 @@
+"""Monte-Carlo-Projektion künftiger Vorabpauschalen und der Steuer beim Ausstieg.
+
+Für jedes Wertpapier werden Kurspfade (geometrische Brownsche Bewegung, jährliche
+Schritte) und optional schwankende Basiszinsen simuliert. Aus jedem Pfad ergeben sich
+die künftigen Vorabpauschalen pro Anteil und damit der Anschaffungspreis beim Verkauf
+aller Chargen am Ende des Zeitraums. Alle Pfade werden gemeinsam vektorisiert berechnet.
+"""
+
+import dataclasses
+import datetime
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pyfifovap import (
+    ETFMetadata,
+    LotArrays,
+    determine_tax_factor_and_header,
+    evaluate_lot_arrays,
+    sum_per_queue,
+)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Basisertrag = Kurs am Jahresanfang * Basiszins * 70 % (§ 18 InvStG)
+BASISERTRAG_FACTOR = 0.7
+
+
+@dataclasses.dataclass
+class ProjectionSettings:
+    years: int
+    num_paths: int = 10000
+    seed: Optional[int] = None
+    expected_return: float = 0.06  # yearly, as fraction
+    volatility: float = 0.15  # yearly, as fraction
+    # ISIN -> (expected_return, volatility), overrides the defaults above
+    params_by_isin: dict[str, tuple[float, float]] = dataclasses.field(
+        default_factory=dict
+    )
+    basiszins: list[float] = dataclasses.field(default_factory=lambda: [0.0253])
+    basiszins_volatility: float = 0.0  # std. deviation per year, as fraction
+    start_year: int = dataclasses.field(
+        default_factory=lambda: datetime.date.today().year
+    )
+
+    def basiszins_per_year(self) -> np.ndarray:
+        """Basiszins for each projected year; the last given value is carried forward."""
+        values = self.basiszins[: self.years]
+        return np.array(values + [values[-1]] * (self.years - len(values)))
+
+
+def parse_projection_isin_params(specs: Optional[list[str]]) -> dict:
+    """Parse "ISIN=RENDITE:VOLATILITÄT" entries (in percent) into fractions."""
+    params_by_isin = {}
+    for spec in specs or []:
+        isin, sep, values = spec.partition("=")
+        parts = values.split(":")
+        if not sep or not isin or len(parts) != 2:
+            raise ValueError(
+                f"Ungültige Projektions-Annahme '{spec}' (erwartet: ISIN=RENDITE:VOLATILITÄT)"
+            )
+        params_by_isin[isin] = (float(parts[0]) / 100, float(parts[1]) / 100)
+    return params_by_isin
+
+
+def simulate_price_paths(
+    settings: ProjectionSettings, isins: list[str], rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Relative price paths of shape (ISINs, paths, years + 1), starting at 1.0.
+
+    Yearly log returns are normally distributed with drift `mu - sigma^2 / 2`, so the
+    expected yearly growth factor is `exp(mu)` regardless of the volatility.
+    """
+    params = np.array(
+        [
+            settings.params_by_isin.get(
+                isin, (settings.expected_return, settings.volatility)
+            )
+            for isin in isins
+        ],
+        dtype=float,
+    ).reshape(len(isins), 2)
+    mu, sigma = params[:, 0, None, None], params[:, 1, None, None]
+    shocks = rng.standard_normal((len(isins), settings.num_paths, settings.years))
+    log_returns = (mu - sigma**2 / 2) + sigma * shocks
+    paths = np.exp(np.cumsum(log_returns, axis=2))
+    return np.concatenate((np.ones(paths.shape[:2] + (1,)), paths), axis=2)
+
+
+def simulate_basiszins(
+    settings: ProjectionSettings, rng: np.random.Generator
+) -> np.ndarray:
+    """Basiszins per path and year, shape (paths, years); never negative."""
+    basiszins = np.broadcast_to(
+        settings.basiszins_per_year(), (settings.num_paths, settings.years)
+    )
+    if settings.basiszins_volatility > 0:
+        basiszins = basiszins + settings.basiszins_volatility * rng.standard_normal(
+            basiszins.shape
+        )
+    return np.maximum(basiszins, 0.0)
+
+
+def vap_per_share_before_tfs(
+    prices: np.ndarray, basiszins: np.ndarray, distributions=0.0
+) -> np.ndarray:
+    """
+    Vorabpauschale vor TFS pro Anteil je Jahr für Kurspfade der Form (..., Jahre + 1).
+
+    Basisertrag, begrenzt auf den Wertzuwachs des Jahres zuzüglich der Ausschüttungen,
+    abzüglich der Ausschüttungen und nie negativ. `distributions` (Ausschüttungen pro
+    Anteil je Jahr, Form (..., Jahre)) ist für die Projektion 0 (thesaurierende Fonds).
+    """
+    year_start, year_end = prices[..., :-1], prices[..., 1:]
+    basisertrag = year_start * basiszins * BASISERTRAG_FACTOR
+    capped = np.minimum(basisertrag, year_end - year_start + distributions)
+    return np.maximum(capped - distributions, 0.0)
+
+
+def is_fund(
+    isin: str,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+) -> bool:
+    """Whether future VAP is projected for an ISIN: VAP entries exist or a TFS is set."""
+    metadata = metadata_by_isin.get(isin)
+    return isin in vap_by_isin_and_year or (
+        metadata is not None and metadata.tfs_percentage > 0
+    )
+
+
+@dataclasses.dataclass
+class ProjectionResult:
+    lot_arrays: LotArrays
+    # each (queues, paths)
+    per_queue: dict[str, np.ndarray]
+
+
+def project_lots(
+    lot_arrays: LotArrays,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    settings: ProjectionSettings,
+    args,
+) -> ProjectionResult:
+    """
+    Simulate all paths and evaluate a sale of every lot at the end of the projection.
+
+    VAP is projected for funds only, i.e. ISINs with VAP entries or a Teilfreistellung.
+    Years already present in the VAP file are not simulated again. A lot bought in the
+    first projected year receives the usual monthly proration for that year.
+    """
+    final_tax_factor, _ = determine_tax_factor_and_header(args)
+    rng = np.random.default_rng(settings.seed)
+
+    isins = sorted({isin for _, isin, _ in lot_arrays.queues})
+    isin_position = {isin: i for i, isin in enumerate(isins)}
+    queue_isin = np.array(
+        [isin_position[isin] for _, isin, _ in lot_arrays.queues], dtype=np.intp
+    )
+    lot_isin = queue_isin[lot_arrays.queue_index]
+
+    relative_prices = simulate_price_paths(settings, isins, rng)
+    basiszins = simulate_basiszins(settings, rng)
+
+    # (ISINs, paths, years) VAP per share, relative to the current quote
+    relative_vap = vap_per_share_before_tfs(relative_prices, basiszins[None, :, :])
+    projected_years = settings.start_year + np.arange(settings.years)
+    for isin, position in isin_position.items():
+        if not is_fund(isin, metadata_by_isin, vap_by_isin_and_year):
+            relative_vap[position] = 0.0
+            continue
+        for year_offset, year in enumerate(projected_years):
+            if year in vap_by_isin_and_year.get(isin, {}):
+                relative_vap[position, :, year_offset] = 0.0
+
+    quotes = lot_arrays.last_quote_eur[:, None]
+    # only lots bought in the first projected year get a partial VAP for it
+    first_year_proportion = np.array(
+        [
+            (13 - date.month) / 12.0 if date.year == settings.start_year else 1.0
+            for date in lot_arrays.purchased_dates
+        ]
+    )
+    future_vap = quotes * (
+        relative_vap.sum(axis=2)[lot_isin]
+        - (1 - first_year_proportion)[:, None] * relative_vap[lot_isin, :, 0]
+    )
+    exit_prices = quotes * relative_prices[lot_isin, :, -1]
+
+    exit_figures = evaluate_lot_arrays(
+        lot_arrays, exit_prices, args, additional_vap_per_share=future_vap
+    )
+    shares = lot_arrays.unsold_shares[:, None]
+    vap_after_tfs = future_vap * shares * lot_arrays.tfs_factor[:, None]
+    vap_taxes = vap_after_tfs * final_tax_factor
+
+    per_lot = {
+        "brutto": exit_figures["brutto"],
+        "vap": vap_after_tfs,
+        "vap_steuer": vap_taxes,
+        "steuer": exit_figures["steuer"],
+        "netto": exit_figures["netto"] - vap_taxes,
+    }
+    return ProjectionResult(
+        lot_arrays=lot_arrays,
+        per_queue={
+            component: sum_per_queue(lot_arrays, values)
+            for component, values in per_lot.items()
+        },
+    )
+
+
+def collect_projection_summary(result: ProjectionResult, args) -> pd.DataFrame:
+    """
+    Perzentile der Projektion je Depot und Wertpapier (Langformat, eine Zeile je Kennzahl).
+
+    Die "GESAMTSUMME"-Zeilen beruhen auf der Summe je Pfad, nicht auf der Summe der
+    Perzentile.
+    """
+    lot_arrays = result.lot_arrays
+    if not lot_arrays.queues:
+        return pd.DataFrame()
+    _, kest_header = determine_tax_factor_and_header(args)
+    labels = {
+        "brutto": "Brutto-Wert bei Ausstieg",
+        "vap": "Künftige VAP nach TFS",
+        "vap_steuer": "Steuer auf künftige VAP",
+        "steuer": f"{kest_header} bei Ausstieg",
+        "netto": "Netto-Wert nach allen Steuern",
+    }
+
+    def make_rows(isin, name, broker, values_by_component):
+        rows = []
+        for component, label in labels.items():
+            values = values_by_component[component]
+            row = {
+                "ISIN": isin,
+                "Name": name,
+                "Depot": broker,
+                "Kennzahl": label,
+                "Mittelwert": float(values.mean()),
+            }
+            for percentile, value in zip(
+                PERCENTILES, np.percentile(values, PERCENTILES)
+            ):
+                row[f"P{percentile}"] = float(value)
+            rows.append(row)
+        return rows
+
+    rows = []
+    order = sorted(
+        range(len(lot_arrays.queues)),
+        key=lambda i: (lot_arrays.queues[i][0], lot_arrays.queues[i][1]),
+    )
+    for queue in order:
+        broker, isin, name = lot_arrays.queues[queue]
+        rows.extend(
+            make_rows(
+                isin,
+                name,
+                broker,
+                {
+                    component: values[queue]
+                    for component, values in result.per_queue.items()
+                },
+            )
+        )
+    rows.extend(
+        make_rows(
+            "GESAMTSUMME",
+            "",
+            "",
+            {
+                component: values.sum(axis=0)
+                for component, values in result.per_queue.items()
+            },
+        )
+    )
+    return pd.DataFrame(rows)
@@ -1,22 +1,55 @@
+import concurrent.futures
+import contextlib
 import dataclasses
 import datetime
 import itertools
-from collections import defaultdict
+import json
+import logging
+import re
+from collections import defaultdict, deque
+from collections.abc import Iterable, Iterator
 from pprint import pformat
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
+import numpy as np
+import pandas as pd
 from sortedcontainers import SortedList
 
+import realized_gains
+import replay_trace
 from i18n_helper import I18nHelper
+from profiling import counters, stage
 
-import pandas as pd
-import yfinance
-
-import logging
+if TYPE_CHECKING:
+    import xlsxwriter
 
 _warned_messages = set()  # hack to make it possible to log warnings only once
 
 
+class PyFifoVapError(Exception):
+    """Eingabedaten, mit denen keine Auswertung möglich ist; die Nachricht nennt den Grund."""
+
+
+class UnsupportedFileFormatError(PyFifoVapError):
+    """Die Buchungs-Datei ist weder ein deutscher noch ein englischer Export."""
+
+
+class AmbiguousSecurityError(PyFifoVapError):
+    """Ein Wertpapier-Name gehört in der Wertpapier-Datei zu mehreren ISINs."""
+
+
+class IsinConflictError(PyFifoVapError):
+    """Buchungs- und Wertpapier-Datei nennen für ein Wertpapier verschiedene ISINs."""
+
+
+class InsufficientSharesError(PyFifoVapError):
+    """Verkauf, Auslieferung oder Übertrag von mehr Anteilen als im Depot vorhanden."""
+
+    def __init__(self, message: str, row=None):
+        super().__init__(message)
+        self.row = row  # the transaction that could not be applied
+
+
 # a lot of a certain security that can be part of a brokerage account
 @dataclasses.dataclass
 class SecurityLot:
@@ -54,7 +87,9 @@ class ForexHelper:
 
         cache_key = (currency, date)
         if cache_key in self.eur_to_forex_cache:
+            counters["forex_cache_treffer"] += 1
             return self.eur_to_forex_cache[cache_key]
+        counters["forex_cache_fehltreffer"] += 1
 
         if self.offline:
             # could implement offline forex input later
@@ -75,17 +110,23 @@ class ForexHelper:
             f"(Datum: {date_str})"
         )
         try:
-            if date is None:
-                history = yfinance.Ticker(ticker).history(period="1d")
-            else:
-                # fetch a window ending at the requested date so we can fall back to the most
-                # recent trading day on or before it (markets are closed on weekends/holidays).
-                # yfinance treats `end` as exclusive, so add a day to include `date` itself.
-                start = date - datetime.timedelta(days=7)
-                end = date + datetime.timedelta(days=1)
-                history = yfinance.Ticker(ticker).history(
-                    start=start.isoformat(), end=end.isoformat()
-                )
+            # loaded on first use only: importing yfinance takes longer than most runs
+            import yfinance
+
+            counters["netzwerk_abfragen"] += 1
+            with stage("forex_abfragen"):
+                if date is None:
+                    history = yfinance.Ticker(ticker).history(period="1d")
+                else:
+                    # fetch a window ending at the requested date so we can fall back to the
+                    # most recent trading day on or before it (markets are closed on
+                    # weekends/holidays). yfinance treats `end` as exclusive, so add a day
+                    # to include `date` itself.
+                    start = date - datetime.timedelta(days=7)
+                    end = date + datetime.timedelta(days=1)
+                    history = yfinance.Ticker(ticker).history(
+                        start=start.isoformat(), end=end.isoformat()
+                    )
             if history.empty:
                 logging.warning(
                     f"Keine Forex-Daten für Ticker {ticker} (Datum: {date_str}) gefunden"
@@ -147,18 +188,17 @@ def resolve_isin_for_transaction(
     `row_isin` is the ISIN from the transaction row (empty when the export has no
     ISIN column or the cell is blank). It is not used as a source, only as a
     consistency check: if it is present and disagrees with the securities-file
-    ISIN, the input data is inconsistent and we abort.
+    ISIN, the input data is inconsistent and IsinConflictError is raised.
     """
     securities_isin = name_to_isin.get(security_name)
     if securities_isin is None:
         return None
     if row_isin and row_isin != securities_isin:
-        logging.error(
+        raise IsinConflictError(
             f"ISIN-Konflikt für das Wertpapier '{security_name}': In der Buchungs-Datei "
             f"'{row_isin}', in der Wertpapier-Datei '{securities_isin}'. Bitte die "
             f"widersprüchlichen Daten korrigieren."
         )
-        exit(1)
     return securities_isin
 
 
@@ -194,6 +234,7 @@ def handle_portfolio_purchase(
     )
 
     account.add(lot)
+    counters["chargen_angelegt"] += 1
 
 
 def handle_portfolio_transfer_outbound(
@@ -213,7 +254,6 @@ def handle_portfolio_transfer_outbound(
             f"Transfer von Nicht-Wertpapieren (Cash) von {account_from_name} zu "
             f"{account_to_name} - überspringe Eintrag"
         )
-        logging.debug(pformat(row))
         return
     maybe_warn_about_long_account_names(account_to_name)
     account_from = portfolio[account_from_name][security_isin]
@@ -221,20 +261,20 @@ def handle_portfolio_transfer_outbound(
     needed_shares = i18n_helper.parse_float(row[pp_names.SHARES])
     while needed_shares > 1e-5:
         if not account_from:
-            logging.error(pformat(row))
-            logging.error(
+            raise InsufficientSharesError(
                 f"Übertrag des Wertpapiers {security_name} von {account_from_name} zu "
                 f"{account_to_name}: Nicht genügend an der Quelle vorhanden - Daten inkonsistent "
                 f"oder Logikfehler im Programm. Empfehlung: Meldung des Problems an Entwickler "
                 f"und Transaktionen des Wertpapiers manuell aus der Input-Transaktionsliste "
-                f"entfernen."
+                f"entfernen.",
+                row,
             )
-            exit(1)
 
         available_shares = account_from[0].unsold_shares
         if needed_shares >= available_shares:
             # move whole lot
             account_to.add(account_from.pop(0))
+            counters["chargen_uebertragen"] += 1
             if not account_from:
                 # remove entry for this security
                 portfolio[account_from_name].pop(security_isin)
@@ -246,6 +286,7 @@ def handle_portfolio_transfer_outbound(
             lot_copy.unsold_shares = needed_shares
             lot.unsold_shares -= needed_shares
             account_to.add(lot_copy)
+            counters["chargen_geteilt"] += 1
             needed_shares = 0
 
     if needed_shares > 1e-7:
@@ -264,6 +305,7 @@ def remove_shares_fifo(
     num_shares: float,
     row,
     operation_label: str,
+    consumed: Optional[list[tuple[SecurityLot, float]]] = None,
 ) -> None:
     """Remove shares of a security from an account, oldest lots first (FIFO).
 
@@ -271,31 +313,37 @@ def remove_shares_fifo(
     simply leave the account (there is no destination). The account is keyed by
     ISIN; `security_name` is only used in the log messages. `operation_label` is
     the German operation noun for those messages (e.g. "Verkauf", "Auslieferung").
+    If `consumed` is given, each (lot, removed shares) is appended to it.
     """
     account = portfolio[account_name][security_isin]
     while num_shares > 1e-5:
         if not account:
-            logging.error(pformat(row))
-            logging.error(
+            raise InsufficientSharesError(
                 f"{operation_label} des Wertpapiers {security_name} von {account_name}: "
                 f"Nicht genügend an der Quelle vorhanden - Daten inkonsistent "
                 f"oder Logikfehler im Programm. Empfehlung: Meldung des Problems an Entwickler "
                 f"und Transaktionen des Wertpapiers manuell aus der Input-Transaktionsliste "
-                f"entfernen."
+                f"entfernen.",
+                row,
             )
-            exit(1)
 
         available_shares = account[0].unsold_shares
         if num_shares >= available_shares:
             # remove whole lot
-            account.pop(0)
+            lot = account.pop(0)
+            if consumed is not None:
+                consumed.append((lot, available_shares))
+            counters["chargen_aufgebraucht"] += 1
             if not account:
                 # remove entry for this security
                 portfolio[account_name].pop(security_isin)
             num_shares -= available_shares
         else:
             # remove part of the lot
+            if consumed is not None:
+                consumed.append((account[0], num_shares))
             account[0].unsold_shares -= num_shares
+            counters["chargen_geteilt"] += 1
             num_shares = 0
 
     if num_shares > 1e-7:
@@ -311,11 +359,15 @@ def handle_portfolio_sale(
     row,
     security_isin: str,
     i18n_helper: I18nHelper,
+    forex_helper: Optional["ForexHelper"] = None,
+    ledger: Optional[realized_gains.RealizedGainsLedger] = None,
 ) -> None:
+    """Remove the sold shares; with a `ledger`, record the consumed lots and proceeds."""
     pp_names = i18n_helper.get_pp_names()
     assert row[pp_names.TYPE] == pp_names.TYPE_SELL
 
     num_shares = i18n_helper.parse_float(row[pp_names.SHARES])
+    consumed = [] if ledger is not None else None
     remove_shares_fifo(
         portfolio,
         row[pp_names.CASH_ACCOUNT],
@@ -324,7 +376,26 @@ def handle_portfolio_sale(
         num_shares,
         row,
         "Verkauf",
+        consumed,
     )
+    if ledger is not None:
+        sale_date = datetime.datetime.fromisoformat(row[pp_names.DATE])
+        # the Gesamtpreis of a sale is net of fees and of the taxes withheld by the
+        # broker; the proceeds for the gain are net of fees only
+        proceeds = parse_money_to_eur(
+            row[pp_names.NET_TRANSACTION_VALUE], i18n_helper, forex_helper, sale_date
+        )
+        taxes = row.get(pp_names.TAXES, "")
+        if taxes:
+            proceeds += parse_money_to_eur(taxes, i18n_helper, forex_helper, sale_date)
+        ledger.record_sale(
+            row[pp_names.CASH_ACCOUNT],
+            security_isin,
+            sale_date,
+            row["Index"],
+            consumed,
+            proceeds,
+        )
 
 
 def handle_portfolio_delivery_outbound(
@@ -382,35 +453,64 @@ def warn_about_isin_name_collisions(
                 )
 
 
-def read_transactions_into_portfolio(
+@stage("buchungen_einlesen")
+def read_transactions(
     transactions_file: str,
     i18n_helper: I18nHelper,
-    forex_helper: ForexHelper,
     name_to_isin: dict[str, str],
-) -> defaultdict[str, defaultdict[str, SortedList]]:
+    isins: Optional[set[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the transactions in replay order (by date, then by row in the file; the row is
+    kept in the column "Index"). If `isins` is given, only transactions of these
+    securities are kept: FIFO is independent per ISIN, so the others need no replay.
+    """
+    # all cells as text: numbers are parsed by I18nHelper.parse_float, which pandas
+    # would otherwise preempt for columns without thousands separators
     data = pd.read_csv(
-        transactions_file, keep_default_na=False, sep=i18n_helper.get_pp_csv_separator()
+        transactions_file,
+        keep_default_na=False,
+        sep=i18n_helper.get_pp_csv_separator(),
+        dtype=str,
     )
 
     pp_names = i18n_helper.get_pp_names()
     data["Index"] = data.index
-    data.sort_values(by=[pp_names.DATE, "Index"], inplace=True)
+    counters["buchungszeilen"] += len(data)
+    if isins is not None:
+        data = data[data[pp_names.SECURITY].map(name_to_isin).isin(isins)]
+    return data.sort_values(by=[pp_names.DATE, "Index"])
 
-    has_isin_column = pp_names.ISIN in data.columns
 
-    # mapping: broker name -> security ISIN -> SortedList[SecurityLot]
-    portfolio: defaultdict[str, defaultdict[str, SortedList]] = defaultdict(
-        lambda: defaultdict(SortedList)
-    )
+@stage("fifo_replay")
+def replay_transactions(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    data: pd.DataFrame,
+    i18n_helper: I18nHelper,
+    forex_helper: ForexHelper,
+    name_to_isin: dict[str, str],
+) -> None:
+    """
+    Apply the transactions of `data` (see read_transactions) to `portfolio` in order.
+    Each transaction is written to the active replay trace, if any (see replay_trace),
+    and each sale to the active realized-gains ledger, if any (see realized_gains).
+    """
+    pp_names = i18n_helper.get_pp_names()
+    has_isin_column = pp_names.ISIN in data.columns
 
-    transaction_types = (
-        pp_names.TYPE_BUY,
-        pp_names.TYPE_DELIVERY_INBOUND,
-        pp_names.TYPE_TRANSFER_OUTBOUND,
-        pp_names.TYPE_SELL,
-        pp_names.TYPE_DELIVERY_OUTBOUND,
-    )
+    # transaction types -> action in the replay trace
+    transaction_types = {
+        pp_names.TYPE_BUY: replay_trace.ACTION_BUY,
+        pp_names.TYPE_DELIVERY_INBOUND: replay_trace.ACTION_DELIVERY_INBOUND,
+        pp_names.TYPE_TRANSFER_OUTBOUND: replay_trace.ACTION_TRANSFER_OUTBOUND,
+        pp_names.TYPE_SELL: replay_trace.ACTION_SELL,
+        pp_names.TYPE_DELIVERY_OUTBOUND: replay_trace.ACTION_DELIVERY_OUTBOUND,
+    }
     dropped_securities: set[str] = set()
+    # looked up once: per row, a disabled trace, ledger or debug log costs one check
+    trace = replay_trace.current()
+    ledger = realized_gains.current()
+    log_rows = logging.getLogger().isEnabledFor(logging.DEBUG)
 
     for index, row in data.iterrows():
         if row[pp_names.TYPE] not in transaction_types:
@@ -424,14 +524,20 @@ def read_transactions_into_portfolio(
             )
             if security_isin is None:
                 dropped_securities.add(security_name)
+                if trace is not None:
+                    trace.record(row, pp_names, "", replay_trace.ACTION_IGNORED, {}, {})
                 continue
         else:
             # Cash transactions (e.g. cash transfers) carry no security; the handlers
             # skip them, so leave the ISIN empty and do not attempt to resolve it.
             security_isin = ""
 
-        logging.debug("Verarbeite Zeile:")
-        logging.debug(pformat(row))
+        counters["buchungen_verarbeitet"] += 1
+        if log_rows:
+            logging.debug(f"Verarbeite Zeile:\n{pformat(row)}")
+        if trace is not None:
+            depots = (row[pp_names.CASH_ACCOUNT], row[pp_names.OFFSET_ACCOUNT])
+            lots_before = trace.snapshot(portfolio, depots, security_isin)
         if row[pp_names.TYPE] in (pp_names.TYPE_BUY, pp_names.TYPE_DELIVERY_INBOUND):
             handle_portfolio_purchase(
                 portfolio, row, security_isin, i18n_helper, forex_helper
@@ -441,24 +547,89 @@ def read_transactions_into_portfolio(
                 portfolio, row, security_isin, i18n_helper
             )
         elif row[pp_names.TYPE] == pp_names.TYPE_SELL:
-            handle_portfolio_sale(portfolio, row, security_isin, i18n_helper)
+            handle_portfolio_sale(
+                portfolio, row, security_isin, i18n_helper, forex_helper, ledger
+            )
         elif row[pp_names.TYPE] == pp_names.TYPE_DELIVERY_OUTBOUND:
             handle_portfolio_delivery_outbound(
                 portfolio, row, security_isin, i18n_helper
             )
+        if trace is not None:
+            trace.record(
+                row,
+                pp_names,
+                security_isin,
+                transaction_types[row[pp_names.TYPE]],
+                lots_before,
+                trace.snapshot(portfolio, depots, security_isin),
+            )
 
     if dropped_securities:
-        logging.warning(
+        # replays in parts (see timeline.py) would repeat it otherwise
+        warn_msg = (
             "Für folgende Wertpapiere wurde keine ISIN in der Wertpapier-Datei gefunden, "
             "ihre Buchungen wurden ignoriert (häufig bereits vollständig verkaufte "
             "Wertpapiere, die nicht mehr in der Wertpapier-Datei stehen): "
             + ", ".join(sorted(dropped_securities))
         )
+        if warn_msg not in _warned_messages:
+            logging.warning(warn_msg)
+            _warned_messages.add(warn_msg)
+
+
+def read_transactions_into_portfolio(
+    transactions_file: str,
+    i18n_helper: I18nHelper,
+    forex_helper: ForexHelper,
+    name_to_isin: dict[str, str],
+    isins: Optional[set[str]] = None,
+) -> defaultdict[str, defaultdict[str, SortedList]]:
+    """
+    Replay all transactions in FIFO order. If `isins` is given, only transactions of
+    these securities are replayed: FIFO is independent per ISIN, so the others are
+    dropped before the replay.
+    """
+    data = read_transactions(transactions_file, i18n_helper, name_to_isin, isins)
+
+    # mapping: broker name -> security ISIN -> SortedList[SecurityLot]
+    portfolio: defaultdict[str, defaultdict[str, SortedList]] = defaultdict(
+        lambda: defaultdict(SortedList)
+    )
+    replay_transactions(portfolio, data, i18n_helper, forex_helper, name_to_isin)
 
     warn_about_isin_name_collisions(portfolio)
     return portfolio
 
 
+def filter_portfolio(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    brokers: Optional[set[str]] = None,
+    bought_from: Optional[datetime.date] = None,
+) -> defaultdict[str, defaultdict[str, SortedList]]:
+    """
+    Keep only the depots in `brokers` and the lots bought on or after `bought_from`.
+
+    Unlike the ISIN filter this is applied after the replay: transfers move lots between
+    depots and sales consume older lots first. With `bought_from`, queues without lots
+    bought since then are dropped.
+    """
+    filtered: defaultdict[str, defaultdict[str, SortedList]] = defaultdict(
+        lambda: defaultdict(SortedList)
+    )
+    for broker, lots_by_isin in portfolio.items():
+        if brokers is not None and broker not in brokers:
+            continue
+        for isin, lots in lots_by_isin.items():
+            selected = [
+                lot
+                for lot in lots
+                if bought_from is None or lot.purchased_date.date() >= bought_from
+            ]
+            if selected or bought_from is None:
+                filtered[broker][isin] = SortedList(selected)
+    return filtered
+
+
 @dataclasses.dataclass
 class ETFMetadata:
     name: str
@@ -472,6 +643,7 @@ def read_etf_metadata(
     i18n_helper: I18nHelper,
     forex_helper: ForexHelper,
     securities_file: str,
+    isins: Optional[set[str]] = None,
 ) -> tuple[dict[str, ETFMetadata], dict[str, str]]:
     """Read ETF metadata, keyed by ISIN.
 
@@ -479,13 +651,28 @@ def read_etf_metadata(
     solely from the (required) securities file and is used to resolve missing
     ISINs in the transactions file via name matching; a name mapping to several
     ISINs is ambiguous and is left out.
+
+    If ``isins`` is given, quotes (and thus Forex requests) are only read for
+    these securities.
     """
-    pp_names = i18n_helper.get_pp_names()
+    return read_securities(
+        securities_file,
+        i18n_helper,
+        forex_helper,
+        read_tfs_metadata(metadata_file, i18n_helper),
+        isins,
+    )
+
+
+@stage("metadaten_einlesen")
+def read_tfs_metadata(
+    metadata_file: str, i18n_helper: I18nHelper
+) -> dict[str, ETFMetadata]:
+    """Read the TFS of the metadata file (without quotes), keyed by ISIN."""
     custom_names = i18n_helper.get_custom_csv_names()
     data = pd.read_csv(metadata_file, keep_default_na=False)
 
     metadata_by_isin: dict[str, ETFMetadata] = dict()
-    name_to_isin: dict[str, str] = dict()
 
     for index, row in data.iterrows():
         security_name = row[custom_names.NAME]
@@ -499,11 +686,30 @@ def read_etf_metadata(
         metadata_by_isin[security_isin] = ETFMetadata(
             name=security_name, isin=security_isin, tfs_percentage=security_tfs
         )
+    return metadata_by_isin
+
+
+@stage("wertpapiere_einlesen")
+def read_securities(
+    securities_file: str,
+    i18n_helper: I18nHelper,
+    forex_helper: ForexHelper,
+    tfs_metadata_by_isin: dict[str, ETFMetadata],
+    isins: Optional[set[str]] = None,
+) -> tuple[dict[str, ETFMetadata], dict[str, str]]:
+    """Add the quotes of the securities file to the TFS metadata; see read_etf_metadata().
+
+    `tfs_metadata_by_isin` is not modified, so it can be shared by several securities files.
+    """
+    pp_names = i18n_helper.get_pp_names()
+    metadata_by_isin = dict(tfs_metadata_by_isin)
+    name_to_isin: dict[str, str] = dict()
 
     data = pd.read_csv(
         securities_file,
         keep_default_na=False,
         sep=i18n_helper.get_pp_csv_separator(),
+        dtype=str,
     )
 
     # build the name -> ISIN map; a name with more than one ISIN is ambiguous
@@ -513,15 +719,14 @@ def read_etf_metadata(
         isin = row[pp_names.ISIN]
         if name and isin:
             names_to_isins[name].add(isin)
-    for name, isins in names_to_isins.items():
-        if len(isins) == 1:
-            name_to_isin[name] = next(iter(isins))
+    for name, name_isins in names_to_isins.items():
+        if len(name_isins) == 1:
+            name_to_isin[name] = next(iter(name_isins))
         else:
-            logging.error(
+            raise AmbiguousSecurityError(
                 f"Wertpapier-Name '{name}' ist in der Wertpapier-Datei nicht eindeutig "
                 f"(mehrere ISINs) - keine Namens-Zuordnung möglich."
             )
-            exit(1)
 
     # read quotes
     for _, row in data.iterrows():
@@ -531,6 +736,8 @@ def read_etf_metadata(
             # securities without an ISIN (e.g. crypto) are skipped; if one is actually
             # held, read_transactions_into_portfolio reports it in its summary.
             continue
+        if isins is not None and security_isin not in isins:
+            continue
         # currently not relevant
         # security_latest_quote_date = row["Latest (Date)"]
         security_latest_quote = row[pp_names.LATEST_QUOTE]
@@ -577,6 +784,7 @@ def read_etf_metadata(
     return metadata_by_isin, name_to_isin
 
 
+@stage("vap_einlesen")
 def read_vap(
     vap_file: str, i18n_helper: I18nHelper
 ) -> defaultdict[str, defaultdict[int, float]]:
@@ -643,44 +851,209 @@ def determine_vap_list(
     return vap_list_per_share_before_tfs
 
 
-# various adjustment to styles in the sheet to make it more readable
-def adjust_styling_in_sheet(
-    excel_writer: pd.ExcelWriter,
+@dataclasses.dataclass
+class ReportFormats:
+    """Cell formats shared by all sheets of a results file, created once per workbook."""
+
+    money: "xlsxwriter.format.Format"
+    percent: "xlsxwriter.format.Format"
+    date: "xlsxwriter.format.Format"
+    datetime: "xlsxwriter.format.Format"
+    header: "xlsxwriter.format.Format"
+
+
+def create_report_formats(workbook: "xlsxwriter.Workbook") -> ReportFormats:
+    return ReportFormats(
+        money=workbook.add_format(
+            {"text_wrap": True, "num_format": "#,##0.00 [$EUR];-#,##0.00 [$EUR]"}
+        ),
+        percent=workbook.add_format({"text_wrap": True, "num_format": "0.00%"}),
+        date=workbook.add_format({"num_format": "YYYY-MM-DD"}),
+        datetime=workbook.add_format({"num_format": "YYYY-MM-DD HH:MM:SS"}),
+        header=workbook.add_format({"bold": True, "text_wrap": True, "valign": "top"}),
+    )
+
+
+_FORMULA_PLACEHOLDER = re.compile(r"\{([^{}@]+)(?:@(-?\d+))?\}")
+
+
+@dataclasses.dataclass
+class Formula:
+    """
+    Excel-Formel einer Zelle mit zwischengespeichertem Ergebnis.
+
+    Platzhalter "{Spalte}" stehen für die Zelle dieser Spalte in derselben Zeile,
+    "{Spalte@-1}" für die Zeile darüber; sie werden erst beim Schreiben aufgelöst, wenn
+    das Spaltenschema des Tabs feststeht.
+    """
+
+    formula: str
+    value: float
+
+    def resolve(self, column_index: dict[str, int], row: int) -> str:
+        from xlsxwriter.utility import xl_rowcol_to_cell
+
+        def cell(match: re.Match) -> str:
+            offset = int(match.group(2) or 0)
+            return xl_rowcol_to_cell(row + offset, column_index[match.group(1)])
+
+        return _FORMULA_PLACEHOLDER.sub(cell, self.formula)
+
+
+class SheetWriter:
+    """
+    Schreibt die Zeilen eines Tabs direkt in eine xlsxwriter-Arbeitsmappe.
+
+    Die Arbeitsmappe wird mit constant_memory geöffnet, d. h. jede Zeile wird genau einmal
+    und in Reihenfolge geschrieben und danach nicht mehr im Speicher gehalten. Die Breite
+    von Spalten ohne festes Format wird beim Schreiben mitgeführt und beim Schließen
+    gesetzt.
+    """
+
+    def __init__(
+        self,
+        workbook: "xlsxwriter.Workbook",
+        formats: ReportFormats,
+        sheet_name: str,
+        columns: list[str],
+        column_indices_money: set[int],
+        column_indices_percent: set[int],
+        column_indices_narrow: set[int] = frozenset(),
+        widths: Optional[dict[int, int]] = None,
+    ):
+        self.worksheet = workbook.add_worksheet(sheet_name)
+        self.formats = formats
+        self.column_index = {column: i for i, column in enumerate(columns)}
+        # cells pick up the column format when written, so fixed columns are set up
+        # front; widths of the other columns are tracked while writing
+        self.widths = {}
+        for i, column in enumerate(columns):
+            if i in column_indices_percent:
+                self.worksheet.set_column(i, i, 15, cell_format=formats.percent)
+            elif i in column_indices_money:
+                self.worksheet.set_column(i, i, 15, cell_format=formats.money)
+            elif i in column_indices_narrow:
+                self.worksheet.set_column(i, i, 12)
+            else:
+                self.widths[i] = len(column)
+        # widths computed elsewhere (see PreparedSheet) are used as they are
+        self.track_widths = widths is None
+        if widths is not None:
+            self.widths = dict(widths)
+
+        self.worksheet.set_row(0, 50)
+        for i, column in enumerate(columns):
+            self.worksheet.write_string(0, i, column, formats.header)
+        self.row = 1
+        counters["tabs_geschrieben"] += 1
+        counters["zellen_geschrieben"] += len(columns)
+
+    def write_row(self, values: Iterable) -> None:
+        """Write one row given as values in column order."""
+        for column, value in enumerate(values):
+            self._write_cell(column, value)
+        self.row += 1
+
+    def write_dict(self, values: dict) -> None:
+        """Write one row given as column name -> value; missing columns stay empty."""
+        for key, value in values.items():
+            self._write_cell(self.column_index[key], value)
+        self.row += 1
+
+    def _write_cell(self, column: int, value) -> None:
+        if value is None or isinstance(value, str) and not value:
+            return
+        if isinstance(value, Formula):
+            self.worksheet.write_formula(
+                self.row,
+                column,
+                value.resolve(self.column_index, self.row),
+                None,
+                value.value,
+            )
+            counters["zellen_geschrieben"] += 1
+            return
+        if isinstance(value, str):
+            self.worksheet.write_string(self.row, column, value)
+        elif isinstance(value, datetime.datetime):
+            self.worksheet.write_datetime(
+                self.row, column, value, self.formats.datetime
+            )
+        elif isinstance(value, datetime.date):
+            self.worksheet.write_datetime(self.row, column, value, self.formats.date)
+        elif isinstance(value, (bool, np.bool_)):
+            self.worksheet.write_boolean(self.row, column, bool(value))
+        else:
+            value = float(value)
+            if np.isnan(value):
+                return
+            if np.isinf(value):
+                # Excel has no infinity
+                self.worksheet.write_string(self.row, column, str(value))
+            else:
+                self.worksheet.write_number(self.row, column, value)
+        counters["zellen_geschrieben"] += 1
+        if self.track_widths and column in self.widths:
+            self.widths[column] = max(self.widths[column], len(str(value)))
+
+    def close(self, autofilter: bool = False) -> None:
+        """
+        Set the tracked column widths (allowed after the rows in constant_memory) and
+        optionally an autofilter over all written rows with a frozen header row.
+        """
+        for i, width in self.widths.items():
+            self.worksheet.set_column(i, i, width + 1.5)
+        if autofilter and self.column_index:
+            self.worksheet.autofilter(0, 0, self.row - 1, len(self.column_index) - 1)
+            self.worksheet.freeze_panes(1, 0)
+
+
+def write_dataframe_sheet(
+    workbook: "xlsxwriter.Workbook",
+    formats: ReportFormats,
     sheet_name: str,
     df: pd.DataFrame,
     column_indices_money: set[int],
     column_indices_percent: set[int],
-    column_indices_narrow: set[int],
 ) -> None:
-    workbook = excel_writer.book
-    worksheet = excel_writer.sheets[sheet_name]
-
-    money_format = workbook.add_format(
-        {"text_wrap": True, "num_format": "#,##0.00 [$EUR];-#,##0.00 [$EUR]"}
+    """Write a (small) summary DataFrame as a sheet via SheetWriter."""
+    sheet_writer = SheetWriter(
+        workbook,
+        formats,
+        sheet_name,
+        [str(column) for column in df.columns],
+        column_indices_money,
+        column_indices_percent,
     )
-    percent_format = workbook.add_format({"text_wrap": True, "num_format": "0.00%"})
-    # adjust the column widths based on the content
-    for i, col in enumerate(df.columns):
-        width = max(df[col].apply(lambda x: len(str(x))).max(), len(col))
-        if i in column_indices_percent:
-            worksheet.set_column(i, i, 15, cell_format=percent_format)
-        elif i in column_indices_money:
-            worksheet.set_column(i, i, 15, cell_format=money_format)
-        elif i in column_indices_narrow:
-            worksheet.set_column(i, i, 12)
-        else:
-            # default format
-            worksheet.set_column(i, i, width + 1.5)
+    for values in df.itertuples(index=False, name=None):
+        sheet_writer.write_row(values)
+    sheet_writer.close()
 
-    # adjust column headers
-    bold_and_wrap = workbook.add_format(
-        {"bold": True, "text_wrap": True, "valign": "top"}
-    )
 
-    for col_num, value in enumerate(df.columns.values):
-        worksheet.write(0, col_num, value, bold_and_wrap)
+@dataclasses.dataclass(frozen=True)
+class TaxSettings:
+    """
+    Steuerliche Annahmen einer Auswertung.
+
+    Die Steuerfunktionen erhalten diese Einstellungen als `args`; die Kommandozeilen-
+    Argumente haben dieselben Attribute und können ebenso übergeben werden.
+    """
 
-    worksheet.set_row(0, 50)
+    kirche_8: bool = False  # 8% Kirchensteuer
+    kirche_9: bool = False  # 9% Kirchensteuer
+    gewinne_vorhanden: bool = False  # Verluste stets mit anderen Gewinnen verrechenbar
+
+    def __post_init__(self):
+        if self.kirche_8 and self.kirche_9:
+            raise ValueError("Kirchensteuer kann nur 8% oder 9% betragen, nicht beides")
+
+    @classmethod
+    def from_args(cls, args) -> "TaxSettings":
+        return cls(
+            kirche_8=args.kirche_8,
+            kirche_9=args.kirche_9,
+            gewinne_vorhanden=args.gewinne_vorhanden,
+        )
 
 
 def determine_taxable_gains_to_consider(
@@ -744,6 +1117,168 @@ def determine_tax_factor_and_header(args) -> tuple[float, str]:
     return final_tax_factor, kest_header
 
 
+def fifo_taxable_gains_to_consider(
+    taxable_gains: np.ndarray,
+    gewinne_vorhanden: bool,
+    queue_starts: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Vektorisierte Variante von determine_taxable_gains_to_consider für ganze FIFO-Reihen.
+
+    `taxable_gains` enthält die Chargen entlang der ersten Achse (älteste zuerst); weitere
+    Achsen (z. B. Kursszenarien) werden mitgeführt. Mehrere Reihen können hintereinander
+    liegen, `queue_starts` gibt dann den Index der jeweils ersten Charge an.
+
+    Die Verlustverrechnung nach FIFO entspricht max(kumulierter Gewinn, 0): der je Charge zu
+    berücksichtigende Betrag ist die Differenz dieses Werts zur vorherigen Charge.
+    """
+    if gewinne_vorhanden:
+        return taxable_gains.copy()
+
+    cumulative = np.cumsum(taxable_gains, axis=0)
+    if queue_starts is not None and len(queue_starts) > 1:
+        lengths = np.diff(np.append(queue_starts, len(taxable_gains)))
+        queue_offsets = (cumulative - taxable_gains)[queue_starts]
+        cumulative = cumulative - np.repeat(queue_offsets, lengths, axis=0)
+
+    return np.maximum(cumulative, 0) - np.maximum(cumulative - taxable_gains, 0)
+
+
+@dataclasses.dataclass
+class LotArrays:
+    """
+    Alle Chargen mehrerer FIFO-Reihen (Depot + ISIN) als flache Arrays.
+
+    Die Chargen einer Reihe liegen zusammenhängend und in FIFO-Reihenfolge hintereinander;
+    `queue_starts[i]` ist der Index der ersten Charge der Reihe `queues[i]`.
+    """
+
+    queues: list[tuple[str, str, str]]  # (broker, isin, name) per queue
+    queue_starts: np.ndarray
+    queue_index: np.ndarray  # queue number per lot
+    purchased_dates: list[datetime.datetime]
+    purchased_index: np.ndarray
+    unsold_shares: np.ndarray
+    acquisition_price_per_share: np.ndarray  # Kosten pro Anteil + Summe VAP vor TFS
+    tfs_factor: np.ndarray  # (100 - TFS) / 100 per lot
+    last_quote_eur: np.ndarray  # NaN if no quote is known
+
+    def __len__(self) -> int:
+        return len(self.unsold_shares)
+
+
+@stage("chargen_vektorisieren")
+def build_lot_arrays(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    only_quoted: bool = True,
+) -> LotArrays:
+    """
+    Einmalige Aufbereitung der Chargen (inkl. VAP) für vektorisierte Auswertungen.
+
+    Mit `only_quoted` werden - wie in der Übersicht - nur Wertpapiere mit bekanntem
+    aktuellem Kurs berücksichtigt. Leere Reihen werden übersprungen.
+    """
+    queues = []
+    queue_starts = []
+    queue_index = []
+    purchased_dates = []
+    purchased_index = []
+    unsold_shares = []
+    acquisition_prices = []
+    tfs_factors = []
+    quotes = []
+
+    for broker in portfolio:
+        for isin, lots in portfolio[broker].items():
+            if not lots:
+                continue
+            metadata = metadata_by_isin.get(isin)
+            quote = metadata.last_quote_eur if metadata else None
+            if only_quoted and not quote:
+                continue
+            name = metadata.name if metadata else lots[0].security_name
+            tfs_percentage = metadata.tfs_percentage if metadata else 0
+
+            queue_starts.append(len(unsold_shares))
+            for lot in lots:
+                vap_list = determine_vap_list(isin, vap_by_isin_and_year, lot)
+                total_vap_per_share = sum(vap for _, vap in vap_list)
+                queue_index.append(len(queues))
+                purchased_dates.append(lot.purchased_date)
+                purchased_index.append(lot.purchased_index)
+                unsold_shares.append(lot.unsold_shares)
+                acquisition_prices.append(
+                    total_vap_per_share + lot.purchased_value / lot.purchased_shares
+                )
+                tfs_factors.append((100 - tfs_percentage) / 100)
+                quotes.append(quote if quote else np.nan)
+            queues.append((broker, isin, name))
+
+    return LotArrays(
+        queues=queues,
+        queue_starts=np.array(queue_starts, dtype=np.intp),
+        queue_index=np.array(queue_index, dtype=np.intp),
+        purchased_dates=purchased_dates,
+        purchased_index=np.array(purchased_index, dtype=np.intp),
+        unsold_shares=np.array(unsold_shares, dtype=float),
+        acquisition_price_per_share=np.array(acquisition_prices, dtype=float),
+        tfs_factor=np.array(tfs_factors, dtype=float),
+        last_quote_eur=np.array(quotes, dtype=float),
+    )
+
+
+@stage("chargen_bewerten")
+def evaluate_lot_arrays(
+    lot_arrays: LotArrays,
+    prices: np.ndarray,
+    args,
+    additional_vap_per_share: Optional[np.ndarray] = None,
+) -> dict[str, np.ndarray]:
+    """
+    Brutto-Wert, KESt-pflichtiger Gewinn, Steuer und Netto-Wert je Charge für gegebene Kurse.
+
+    `prices` hat die Form (Chargen,) oder (Chargen, Szenarien); alle Szenarien werden in
+    einer Broadcast-Berechnung ausgewertet. Die Ergebnisse haben dieselbe Form.
+    `additional_vap_per_share` (gleiche Form) erhöht den Anschaffungspreis um weitere,
+    z. B. künftige, Vorabpauschalen vor TFS.
+    """
+    final_tax_factor, _ = determine_tax_factor_and_header(args)
+    shares = lot_arrays.unsold_shares
+    acquisition_prices = lot_arrays.acquisition_price_per_share
+    tfs_factor = lot_arrays.tfs_factor
+    if prices.ndim == 2:
+        shares = shares[:, None]
+        acquisition_prices = acquisition_prices[:, None]
+        tfs_factor = tfs_factor[:, None]
+    if additional_vap_per_share is not None:
+        acquisition_prices = acquisition_prices + additional_vap_per_share
+
+    brutto = prices * shares
+    gewinn = (prices - acquisition_prices) * shares * tfs_factor
+    steuer = (
+        fifo_taxable_gains_to_consider(
+            gewinn, args.gewinne_vorhanden, lot_arrays.queue_starts
+        )
+        * final_tax_factor
+    )
+    return {
+        "brutto": brutto,
+        "gewinn": gewinn,
+        "steuer": steuer,
+        "netto": brutto - steuer,
+    }
+
+
+def sum_per_queue(lot_arrays: LotArrays, values: np.ndarray) -> np.ndarray:
+    """Summe der Werte je Charge über alle Chargen einer Reihe (erste Achse)."""
+    if len(lot_arrays) == 0:
+        return np.zeros((0,) + values.shape[1:])
+    return np.add.reduceat(values, lot_arrays.queue_starts, axis=0)
+
+
+@stage("vap_uebersicht_berechnen")
 def collect_vap_summary(
     portfolio: defaultdict[str, defaultdict[str, SortedList]],
     metadata_by_isin: dict[str, ETFMetadata],
@@ -758,6 +1293,7 @@ def collect_vap_summary(
     """
     # Structure: vap_summary[(isin, name, broker, tfs_percentage)][year] = vap_amount_before_tfs
     vap_summary = defaultdict(lambda: defaultdict(float))
+    log_lots = logging.getLogger().isEnabledFor(logging.DEBUG)
 
     for broker in portfolio:
         for isin in portfolio[broker]:
@@ -774,13 +1310,13 @@ def collect_vap_summary(
             for lot in lots:
                 vap_list = determine_vap_list(isin, vap_by_isin_and_year, lot)
                 for year, vap_per_share_before_tfs in vap_list:
-                    logging.debug(
-                        f"ISIN: {isin}, Depot: {broker}, Jahr: {year}, VAP pro Anteil (vor TFS): {vap_per_share_before_tfs} lot.unsold_shares: {lot.unsold_shares}"
-                    )
                     total_vap = vap_per_share_before_tfs * lot.unsold_shares
-                    logging.debug(
-                        f"ISIN: {isin}, Depot: {broker}, Jahr: {year}, VAP gesamt (vor TFS): {total_vap}"
-                    )
+                    if log_lots:
+                        logging.debug(
+                            f"ISIN: {isin}, Depot: {broker}, Jahr: {year}, VAP pro Anteil "
+                            f"(vor TFS): {vap_per_share_before_tfs} lot.unsold_shares: "
+                            f"{lot.unsold_shares}, VAP gesamt (vor TFS): {total_vap}"
+                        )
                     vap_summary[key][year] += total_vap
 
     if not vap_summary:
@@ -831,6 +1367,76 @@ def collect_vap_summary(
     return pd.DataFrame(rows)
 
 
+@stage("realisiert_berechnen")
+def collect_realized_gains_summary(
+    ledger: realized_gains.RealizedGainsLedger,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    brokers: Optional[set[str]] = None,
+    bought_from: Optional[datetime.date] = None,
+) -> pd.DataFrame:
+    """
+    Realisierte Gewinne je Verkauf und verbrauchter Charge als DataFrame.
+
+    Spalten: Depot, ISIN, Name, Datum Verkauf, Datum Kauf, Anzahl verkauft, Erlös, Kosten,
+    VAP vor TFS (bis zum Verkauf erhoben, d. h. Jahre vor dem Verkaufsjahr), Gewinn vor TFS,
+    Teilfreistellung und KESt-pflichtiger Gewinn. `brokers` und `bought_from` wählen wie
+    bei filter_portfolio aus.
+    """
+    columns = [
+        "Depot",
+        "ISIN",
+        "Name",
+        "Datum Verkauf",
+        "Datum Kauf",
+        "Anzahl verkauft",
+        "Erlös",
+        "Kosten",
+        "VAP vor TFS",
+        "Gewinn vor TFS",
+        "Teilfreistellung",
+        "KESt-pflichtiger Gewinn",
+    ]
+    rows = []
+    for entry in ledger.entries:
+        lot = entry.lot
+        if brokers is not None and entry.broker not in brokers:
+            continue
+        if bought_from is not None and lot.purchased_date.date() < bought_from:
+            continue
+        metadata = metadata_by_isin.get(entry.isin)
+        tfs_percentage = metadata.tfs_percentage if metadata else 0
+        # VAP of a year is levied early in the next year, i.e. before a sale in that year
+        levied = {
+            year: vap
+            for year, vap in vap_by_isin_and_year.get(entry.isin, {}).items()
+            if year < entry.sale_date.year
+        }
+        vap = entry.shares * sum(
+            vap for _, vap in determine_vap_list(entry.isin, {entry.isin: levied}, lot)
+        )
+        cost = lot.purchased_value * entry.shares / lot.purchased_shares
+        gain = entry.proceeds_eur - cost - vap
+        rows.append(
+            [
+                entry.broker,
+                entry.isin,
+                metadata.name if metadata else lot.security_name,
+                entry.sale_date.date(),
+                lot.purchased_date.date(),
+                entry.shares,
+                entry.proceeds_eur,
+                cost,
+                vap,
+                gain,
+                tfs_percentage / 100,
+                gain * (100 - tfs_percentage) / 100,
+            ]
+        )
+    return pd.DataFrame(rows, columns=columns)
+
+
+@stage("uebersicht_berechnen")
 def collect_overview_summary(
     portfolio: defaultdict[str, defaultdict[str, SortedList]],
     metadata_by_isin: dict[str, ETFMetadata],
@@ -939,181 +1545,874 @@ def collect_overview_summary(
     return pd.DataFrame(rows, columns=columns)
 
 
+@dataclasses.dataclass
+class SummarySheet:
+    """An additional summary tab (e.g. Kursszenarien), written after "Übersicht" and "VAP"."""
+
+    sheet_name: str
+    df: pd.DataFrame
+    column_indices_money: set[int]
+    column_indices_percent: set[int]
+
+
+# styling of the per-security sheets by column name; all other columns are money
+_LOT_COLUMNS_NARROW = ("Anzahl (noch unverkauft)", "Anzahl (gekauft)")
+_LOT_COLUMNS_PERCENT = ("Steueranteil an Brutto-Auszahlung",)
+_LOT_COLUMNS_TEXT = ("Depot", "ISIN", "Name", "Datum Kauf")
+
+
+def iter_lot_rows(
+    isin: str,
+    name: str,
+    lots: SortedList,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    args,
+) -> Iterator[dict]:
+    """
+    Zeilen des Tabs eines Wertpapiers in einem Depot: je Charge ein dict Spaltenname -> Wert.
+
+    Jüngere Chargen haben ggf. nicht alle Spalten (z. B. VAP-Jahre vor dem Kauf).
+    """
+    final_tax_factor, kest_header = determine_tax_factor_and_header(args)
+    previous_taxable_gains = (
+        0.0  # kann ggf. zur Verrechnung mit späteren Verlusten genutzt werden
+    )
+    lot: SecurityLot
+    for lot in lots:
+        # VAP calculation
+        vap_list_per_share_before_tfs = determine_vap_list(
+            isin, vap_by_isin_and_year, lot
+        )
+
+        lot_dict = {
+            "ISIN": isin,
+            "Name": name,
+            "Datum Kauf": lot.purchased_date.date(),
+            "Anzahl (noch unverkauft)": lot.unsold_shares,
+            "Anzahl (gekauft)": lot.purchased_shares,
+            "Gesamtkosten": lot.purchased_value,
+            "Kosten pro Anteil": lot.purchased_value / lot.purchased_shares,
+        }
+        total_vap_per_share_before_tfs = 0.0
+        for year, vap_per_share_before_tfs in vap_list_per_share_before_tfs:
+            lot_dict[f"VAP {year} vor TFS pro Anteil"] = vap_per_share_before_tfs
+            total_vap_per_share_before_tfs += vap_per_share_before_tfs
+        if total_vap_per_share_before_tfs > 0:
+            lot_dict["Summe VAP vor TFS pro Anteil"] = total_vap_per_share_before_tfs
+            acquisition_price_per_share = (
+                total_vap_per_share_before_tfs
+                + lot.purchased_value / lot.purchased_shares
+            )
+            lot_dict["Anschaffungspreis inkl. VAP pro Anteil"] = (
+                acquisition_price_per_share
+            )
+        else:
+            acquisition_price_per_share = lot.purchased_value / lot.purchased_shares
+        if isin in metadata_by_isin and metadata_by_isin[isin].last_quote_eur:
+            metadata = metadata_by_isin[isin]
+            # can determine taxable gain as there is a current price known
+            lot_dict["Brutto-Wert"] = metadata.last_quote_eur * lot.unsold_shares
+            taxable_gain_header = "KESt-pflichtiger Gewinn"
+            taxable_gain = (
+                metadata.last_quote_eur - acquisition_price_per_share
+            ) * lot.unsold_shares
+            if total_vap_per_share_before_tfs > 0:
+                taxable_gain_header += " nach VAP"
+            if metadata.tfs_percentage > 0:
+                taxable_gain_header += " nach TFS"
+                taxable_gain = taxable_gain * (100 - metadata.tfs_percentage) / 100
+
+            lot_dict[taxable_gain_header] = taxable_gain
+
+            taxable_gains_to_consider = determine_taxable_gains_to_consider(
+                previous_taxable_gains, taxable_gain, args
+            )
+            previous_taxable_gains += taxable_gain
+
+            taxes = taxable_gains_to_consider * final_tax_factor
+            lot_dict[kest_header] = taxes
+            lot_dict["Netto-Wert"] = metadata.last_quote_eur * lot.unsold_shares - taxes
+            lot_dict["Steueranteil an Brutto-Auszahlung"] = taxes / (
+                metadata.last_quote_eur * lot.unsold_shares
+            )
+        yield lot_dict
+
+
+def lot_sheet_columns(rows: Iterable[dict]) -> list[str]:
+    """All column names of the rows, in order of first appearance."""
+    columns = {}
+    for row in rows:
+        for column in row:
+            columns.setdefault(column)
+    return list(columns)
+
+
+def lot_sheet_schema(
+    isin: str,
+    lots: SortedList,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    args,
+    formulas: bool = False,
+) -> list[str]:
+    """
+    lot_sheet_columns of the rows of iter_lot_rows (with `formulas`: of add_lot_formulas),
+    derived without evaluating the lots.
+
+    The oldest lot has all VAP years of the queue, so only the first and the last lot
+    decide which "nach VAP" variants of the gain header appear.
+    """
+    if not lots:
+        return []
+    years = [
+        year for year, _ in determine_vap_list(isin, vap_by_isin_and_year, lots[0])
+    ]
+    columns = [
+        "ISIN",
+        "Name",
+        "Datum Kauf",
+        "Anzahl (noch unverkauft)",
+        "Anzahl (gekauft)",
+        "Gesamtkosten",
+        "Kosten pro Anteil",
+        *(f"VAP {year} vor TFS pro Anteil" for year in years),
+    ]
+    if years:
+        columns += [
+            "Summe VAP vor TFS pro Anteil",
+            "Anschaffungspreis inkl. VAP pro Anteil",
+        ]
+    if isin in metadata_by_isin and metadata_by_isin[isin].last_quote_eur:
+        _, kest_header = determine_tax_factor_and_header(args)
+        tfs_suffix = " nach TFS" if metadata_by_isin[isin].tfs_percentage > 0 else ""
+        gain_headers = [
+            TAXABLE_GAIN_COLUMN + (" nach VAP" if years else "") + tfs_suffix
+        ]
+        if years and not determine_vap_list(isin, vap_by_isin_and_year, lots[-1]):
+            gain_headers.append(TAXABLE_GAIN_COLUMN + tfs_suffix)
+        columns += [
+            "Brutto-Wert",
+            gain_headers[0],
+            *([CUMULATIVE_GAIN_COLUMN] if formulas else []),
+            kest_header,
+            "Netto-Wert",
+            "Steueranteil an Brutto-Auszahlung",
+            *gain_headers[1:],
+        ]
+    return columns
+
+
+def lot_sheet_name(broker: str, isin: str, name: str) -> str:
+    sheet_name = f"{broker} " + (isin if isin != "" else name)
+    return sheet_name[:31]  # sheet names have a max length
+
+
+def lot_sheet_column_kinds(columns: list[str]) -> tuple[set[int], set[int], set[int]]:
+    """Indices of the money, percent and narrow columns of a per-security sheet."""
+    column_indices_money = set()
+    column_indices_percent = set()
+    column_indices_narrow = set()
+    for i, column in enumerate(columns):
+        if column in _LOT_COLUMNS_PERCENT:
+            column_indices_percent.add(i)
+        elif column in _LOT_COLUMNS_NARROW:
+            column_indices_narrow.add(i)
+        elif column not in _LOT_COLUMNS_TEXT:
+            column_indices_money.add(i)
+    return column_indices_money, column_indices_percent, column_indices_narrow
+
+
+def lot_sheet_security_name(
+    isin: str, lots: SortedList, metadata_by_isin: dict[str, ETFMetadata]
+) -> str:
+    if isin in metadata_by_isin:
+        return metadata_by_isin[isin].name
+    return lots[0].security_name if lots else ""
+
+
+@dataclasses.dataclass
+class PreparedSheet:
+    """Fertig berechneter Inhalt eines Wertpapier-Tabs, der nur noch geschrieben wird."""
+
+    sheet_name: str
+    columns: list[str]
+    rows: list[list]  # values in column order, None for missing cells
+    column_indices_money: set[int]
+    column_indices_percent: set[int]
+    column_indices_narrow: set[int]
+    widths: dict[int, int]  # of the columns without fixed width
+
+
+def prepare_lot_sheet(
+    broker: str,
+    isin: str,
+    name: str,
+    lots: SortedList,
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: dict[str, dict[int, float]],
+    args,
+) -> PreparedSheet:
+    """
+    Compute rows, column kinds and widths of a per-security sheet (e.g. in a worker
+    process). Only the metadata and VAP entries of `isin` are needed.
+    """
+    lot_dicts = list(
+        iter_lot_rows(isin, name, lots, metadata_by_isin, vap_by_isin_and_year, args)
+    )
+    columns = lot_sheet_columns(lot_dicts)
+    column_indices_money, column_indices_percent, column_indices_narrow = (
+        lot_sheet_column_kinds(columns)
+    )
+    rows = [[lot_dict.get(column) for column in columns] for lot_dict in lot_dicts]
+    widths = {
+        i: max(
+            [len(column)]
+            + [len(str(row[i])) for row in rows if row[i] is not None and row[i] != ""]
+        )
+        for i, column in enumerate(columns)
+        if i not in column_indices_money | column_indices_percent
+        and i not in column_indices_narrow
+    }
+    return PreparedSheet(
+        sheet_name=lot_sheet_name(broker, isin, name),
+        columns=columns,
+        rows=rows,
+        column_indices_money=column_indices_money,
+        column_indices_percent=column_indices_percent,
+        column_indices_narrow=column_indices_narrow,
+        widths=widths,
+    )
+
+
+def iter_prepared_lot_sheets(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    args,
+    processes: int,
+    cache: Optional[dict[tuple[str, str], PreparedSheet]] = None,
+) -> Iterator[PreparedSheet]:
+    """
+    Prepare all per-security sheets in a process pool and yield them in portfolio order.
+
+    At most two sheets per process are in flight, so finished sheets do not pile up
+    while the writer is busy. With `processes` == 1 the sheets are prepared in this
+    process. Sheets found in `cache` (keyed by depot and ISIN) are reused, newly
+    prepared ones are added to it; removing outdated entries is up to the caller.
+    """
+    with (
+        concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+        if processes > 1
+        else contextlib.nullcontext()
+    ) as executor:
+        pending = deque()
+        for broker in portfolio:
+            for isin in portfolio[broker]:
+                if cache is not None and (broker, isin) in cache:
+                    future = concurrent.futures.Future()
+                    future.set_result(cache[(broker, isin)])
+                    pending.append(((broker, isin), future))
+                    continue
+                lots = portfolio[broker][isin]
+                job = (
+                    prepare_lot_sheet,
+                    broker,
+                    isin,
+                    lot_sheet_security_name(isin, lots, metadata_by_isin),
+                    lots,
+                    {isin: metadata_by_isin[isin]} if isin in metadata_by_isin else {},
+                    {isin: vap_by_isin_and_year[isin]}
+                    if isin in vap_by_isin_and_year
+                    else {},
+                    args,
+                )
+                if executor is None:
+                    future = concurrent.futures.Future()
+                    future.set_result(job[0](*job[1:]))
+                else:
+                    future = executor.submit(*job)
+                pending.append(((broker, isin), future))
+                if len(pending) >= 2 * processes:
+                    key, future = pending.popleft()
+                    yield _cached_result(cache, key, future)
+        while pending:
+            key, future = pending.popleft()
+            yield _cached_result(cache, key, future)
+
+
+def _cached_result(
+    cache: Optional[dict[tuple[str, str], PreparedSheet]],
+    key: tuple[str, str],
+    future: concurrent.futures.Future,
+) -> PreparedSheet:
+    prepared = future.result()
+    if cache is not None:
+        cache[key] = prepared
+    return prepared
+
+
+TAXABLE_GAIN_COLUMN = "KESt-pflichtiger Gewinn"
+
+
+def lot_table_columns(
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]], args
+) -> list[str]:
+    """
+    Festes Spaltenschema für alle Chargen in einer Tabelle: je Jahr aus der VAP-Datei eine
+    Spalte, der KESt-pflichtige Gewinn immer unter demselben Namen und das Depot als
+    eigene Spalte (statt im auf 31 Zeichen gekürzten Tab-Namen).
+    """
+    _, kest_header = determine_tax_factor_and_header(args)
+    years = sorted({year for vap in vap_by_isin_and_year.values() for year in vap})
+    return [
+        "Depot",
+        "ISIN",
+        "Name",
+        "Datum Kauf",
+        "Anzahl (noch unverkauft)",
+        "Anzahl (gekauft)",
+        "Gesamtkosten",
+        "Kosten pro Anteil",
+        *(f"VAP {year} vor TFS pro Anteil" for year in years),
+        "Summe VAP vor TFS pro Anteil",
+        "Anschaffungspreis inkl. VAP pro Anteil",
+        "Brutto-Wert",
+        TAXABLE_GAIN_COLUMN,
+        kest_header,
+        "Netto-Wert",
+        "Steueranteil an Brutto-Auszahlung",
+    ]
+
+
+def iter_lot_records(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    columns: list[str],
+    args,
+) -> Iterator[dict]:
+    """
+    One record per lot with all `columns`, derived from the rows of the per-security tabs.
+
+    Missing VAP years count as 0 and the acquisition price defaults to the cost per share.
+    Values that need a quote stay None for securities without a known quote.
+    """
+    vap_columns = [column for column in columns if column.startswith("VAP ")]
+    for broker in portfolio:
+        for isin in portfolio[broker]:
+            lots = portfolio[broker][isin]
+            name = lot_sheet_security_name(isin, lots, metadata_by_isin)
+            for row in iter_lot_rows(
+                isin, name, lots, metadata_by_isin, vap_by_isin_and_year, args
+            ):
+                record = dict.fromkeys(columns)
+                record["Depot"] = broker
+                record.update(dict.fromkeys(vap_columns, 0.0))
+                record["Summe VAP vor TFS pro Anteil"] = 0.0
+                record["Anschaffungspreis inkl. VAP pro Anteil"] = row[
+                    "Kosten pro Anteil"
+                ]
+                for key, value in row.items():
+                    if key.startswith(TAXABLE_GAIN_COLUMN):
+                        # "nach VAP"/"nach TFS" are only part of the header in the tabs
+                        key = TAXABLE_GAIN_COLUMN
+                    record[key] = value
+                yield record
+
+
+CUMULATIVE_GAIN_COLUMN = "Kumulierter KESt-pflichtiger Gewinn"
+QUOTES_SHEET = "Kurse"
+
+
+@dataclasses.dataclass
+class QuoteCells:
+    """Absolute addresses of the editable cells in the "Kurse" sheet."""
+
+    quote_by_isin: dict[str, str]
+    tfs_by_isin: dict[str, str]
+    tax_factor: str
+
+
+def quote_cells_for(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+) -> QuoteCells:
+    """One row per held ISIN with a known quote (sorted), the tax factor in row 2."""
+    from xlsxwriter.utility import quote_sheetname, xl_rowcol_to_cell
+
+    isins = sorted(
+        {
+            isin
+            for broker in portfolio
+            for isin in portfolio[broker]
+            if isin in metadata_by_isin and metadata_by_isin[isin].last_quote_eur
+        }
+    )
+    sheet = quote_sheetname(QUOTES_SHEET)
+    return QuoteCells(
+        quote_by_isin={
+            isin: f"{sheet}!{xl_rowcol_to_cell(i + 1, 2, True, True)}"
+            for i, isin in enumerate(isins)
+        },
+        tfs_by_isin={
+            isin: f"{sheet}!{xl_rowcol_to_cell(i + 1, 3, True, True)}"
+            for i, isin in enumerate(isins)
+        },
+        tax_factor=f"{sheet}!{xl_rowcol_to_cell(1, 4, True, True)}",
+    )
+
+
+def write_quotes_sheet(
+    workbook: "xlsxwriter.Workbook",
+    formats: ReportFormats,
+    quote_cells: QuoteCells,
+    metadata_by_isin: dict[str, ETFMetadata],
+    args,
+) -> None:
+    final_tax_factor, kest_header = determine_tax_factor_and_header(args)
+    sheet_writer = SheetWriter(
+        workbook,
+        formats,
+        QUOTES_SHEET,
+        ["ISIN", "Name", "Kurs", "TFS in %", f"Steuerfaktor ({kest_header})"],
+        {2},
+        {4},
+    )
+    for i, isin in enumerate(quote_cells.quote_by_isin):
+        metadata = metadata_by_isin[isin]
+        sheet_writer.write_row(
+            [
+                isin,
+                metadata.name,
+                metadata.last_quote_eur,
+                metadata.tfs_percentage,
+                final_tax_factor if i == 0 else None,
+            ]
+        )
+    sheet_writer.close()
+
+
+def add_lot_formulas(
+    rows: Iterable[dict], isin: str, quote_cells: QuoteCells, args
+) -> Iterator[dict]:
+    """
+    Replace the quote-dependent values of the lots of one queue by formulas on the
+    "Kurse" sheet. The running loss offset uses the cumulative gain column: the tax of
+    a lot is the increase of max(cumulative gain, 0), see fifo_taxable_gains_to_consider.
+    """
+    if isin not in quote_cells.quote_by_isin:
+        yield from rows
+        return
+    _, kest_header = determine_tax_factor_and_header(args)
+    quote = quote_cells.quote_by_isin[isin]
+    tfs = quote_cells.tfs_by_isin[isin]
+    factor = quote_cells.tax_factor
+    shares = "{Anzahl (noch unverkauft)}"
+
+    cumulative_gain = 0.0
+    for i, row in enumerate(rows):
+        gain_column = next(key for key in row if key.startswith(TAXABLE_GAIN_COLUMN))
+        gain = f"{{{gain_column}}}"
+        acquisition = (
+            "{Anschaffungspreis inkl. VAP pro Anteil}"
+            if "Anschaffungspreis inkl. VAP pro Anteil" in row
+            else "{Kosten pro Anteil}"
+        )
+        cumulative = f"{{{CUMULATIVE_GAIN_COLUMN}}}"
+        previous_cumulative = f"{{{CUMULATIVE_GAIN_COLUMN}@-1}}"
+        cumulative_gain += row[gain_column]
+        if args.gewinne_vorhanden:
+            taxes = f"={gain}*{factor}"
+        elif i == 0:
+            taxes = f"=MAX({cumulative},0)*{factor}"
+        else:
+            taxes = f"=(MAX({cumulative},0)-MAX({previous_cumulative},0))*{factor}"
+
+        formulas = {
+            "Brutto-Wert": Formula(f"={quote}*{shares}", row["Brutto-Wert"]),
+            gain_column: Formula(
+                f"=({quote}-{acquisition})*{shares}*(100-{tfs})/100", row[gain_column]
+            ),
+            CUMULATIVE_GAIN_COLUMN: Formula(
+                f"={gain}" if i == 0 else f"={previous_cumulative}+{gain}",
+                cumulative_gain,
+            ),
+            kest_header: Formula(taxes, row[kest_header]),
+            "Netto-Wert": Formula(
+                f"={{Brutto-Wert}}-{{{kest_header}}}", row["Netto-Wert"]
+            ),
+            "Steueranteil an Brutto-Auszahlung": Formula(
+                f"=IF({{Brutto-Wert}}=0,0,{{{kest_header}}}/{{Brutto-Wert}})",
+                row["Steueranteil an Brutto-Auszahlung"],
+            ),
+        }
+        formula_row = {}
+        for key, value in row.items():
+            formula_row[key] = formulas.get(key, value)
+            if key == gain_column:
+                formula_row[CUMULATIVE_GAIN_COLUMN] = formulas[CUMULATIVE_GAIN_COLUMN]
+        yield formula_row
+
+
+@dataclasses.dataclass
+class LotRange:
+    """Where the lots of one queue end up: sheet, first and last row (0-based)."""
+
+    sheet_name: str
+    first_row: int
+    last_row: int
+    column_index: dict[str, int]
+
+    def column_range(self, column: str) -> str:
+        from xlsxwriter.utility import quote_sheetname, xl_rowcol_to_cell
+
+        i = self.column_index[column]
+        first = xl_rowcol_to_cell(self.first_row, i)
+        last = xl_rowcol_to_cell(self.last_row, i)
+        return f"{quote_sheetname(self.sheet_name)}!{first}:{last}"
+
+    def last_cell(self, column: str) -> str:
+        from xlsxwriter.utility import quote_sheetname, xl_rowcol_to_cell
+
+        cell = xl_rowcol_to_cell(self.last_row, self.column_index[column])
+        return f"{quote_sheetname(self.sheet_name)}!{cell}"
+
+
+def iter_overview_formula_rows(
+    overview_df: pd.DataFrame, lot_ranges: dict[tuple[str, str], LotRange], args
+) -> Iterator[list]:
+    """
+    Rows of the overview with formulas: sums over the lot rows of each queue, then sums
+    of these rows per depot and over the depot sums.
+    """
+    from xlsxwriter.utility import xl_rowcol_to_cell
+
+    _, kest_header = determine_tax_factor_and_header(args)
+    columns = list(overview_df.columns)
+    value_columns = ["Brutto-Wert", kest_header, "Netto-Wert"]
+    gain_index = columns.index("KESt-pflichtiger Gewinn")
+    share_formula = f"=IF({{Brutto-Wert}}=0,0,{{{kest_header}}}/{{Brutto-Wert}})"
+
+    broker_rows, sum_rows = [], []
+    for row_number, row in enumerate(overview_df.itertuples(index=False), start=1):
+        values = list(row)
+        isin, broker = values[0], values[2]
+        if isin == "":
+            yield values
+            continue
+        if isin == "GESAMTSUMME":
+            source_rows = sum_rows
+        elif isin == "Summe":
+            source_rows, broker_rows = broker_rows, []
+            sum_rows.append(row_number)
+        else:
+            broker_rows.append(row_number)
+            lot_range = lot_ranges.get((broker, isin))
+            if lot_range is not None:
+                for column in value_columns:
+                    i = columns.index(column)
+                    values[i] = Formula(
+                        f"=SUM({lot_range.column_range(column)})", values[i]
+                    )
+                values[gain_index] = Formula(
+                    f"={lot_range.last_cell(CUMULATIVE_GAIN_COLUMN)}",
+                    values[gain_index],
+                )
+                values[-1] = Formula(share_formula, values[-1])
+            yield values
+            continue
+
+        contiguous = source_rows == list(range(source_rows[0], source_rows[-1] + 1))
+        for i in [columns.index(column) for column in value_columns] + [gain_index]:
+            if contiguous:
+                first = xl_rowcol_to_cell(source_rows[0], i)
+                cells = f"{first}:{xl_rowcol_to_cell(source_rows[-1], i)}"
+            else:
+                cells = ",".join(xl_rowcol_to_cell(r, i) for r in source_rows)
+            values[i] = Formula(f"=SUM({cells})", values[i])
+        values[-1] = Formula(share_formula, values[-1])
+        yield values
+
+
+@stage("xlsx_schreiben")
 def build_results_file(
     portfolio: defaultdict[str, defaultdict[str, SortedList]],
     metadata_by_isin: dict[str, ETFMetadata],
     vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
     excel_out_file: str,
     args,
+    summary_sheets: Optional[list[SummarySheet]] = None,
+    processes: int = 1,
+    layout: str = "tabs",
+    formulas: bool = False,
+    prepared_sheets: Optional[dict[tuple[str, str], PreparedSheet]] = None,
 ) -> None:
-    with pd.ExcelWriter(excel_out_file, engine="xlsxwriter") as excel_writer:
+    """
+    Write the results file. All sheets are streamed row by row into xlsxwriter in
+    constant-memory mode; the per-security sheets are written without a DataFrame.
+
+    With `processes` > 1 the per-security sheets are prepared in a process pool and
+    written by this process in the same order as in serial mode.
+
+    With `layout` "tabelle" all lots are written into the single autofiltered sheet
+    "Chargen" with the fixed columns of lot_table_columns instead of one tab per depot
+    and security.
+
+    With `formulas` the quotes, TFS and the tax factor are written to the sheet "Kurse"
+    and the quote-dependent values of the lots and the overview become formulas on it,
+    so a changed quote is recomputed by the spreadsheet. Formulas are always written by
+    this process, i.e. `processes` is ignored.
+
+    `prepared_sheets` caches the per-security sheets across calls (see
+    iter_prepared_lot_sheets); it is only used for the "tabs" layout without formulas.
+    """
+    # imported here so that e.g. --nur-uebersicht never loads an Excel engine
+    import xlsxwriter
+
+    quote_cells = quote_cells_for(portfolio, metadata_by_isin) if formulas else None
+
+    def queue_rows(broker: str, isin: str, name: str) -> Iterator[dict]:
+        lots = portfolio[broker][isin]
+        rows = iter_lot_rows(
+            isin, name, lots, metadata_by_isin, vap_by_isin_and_year, args
+        )
+        if quote_cells is None:
+            return rows
+        return add_lot_formulas(rows, isin, quote_cells, args)
+
+    def queue_records(columns: list[str]) -> Iterator[dict]:
+        records = iter_lot_records(
+            portfolio, metadata_by_isin, vap_by_isin_and_year, columns, args
+        )
+        if quote_cells is None:
+            yield from records
+            return
+        for (_, isin), queue in itertools.groupby(
+            records, key=lambda record: (record["Depot"], record["ISIN"])
+        ):
+            yield from add_lot_formulas(queue, isin, quote_cells, args)
+
+    # column schemas of the lot sheets; with formulas the overview refers to them
+    if layout == "tabelle":
+        table_columns = lot_table_columns(vap_by_isin_and_year, args)
+        if formulas:
+            gain_position = table_columns.index(TAXABLE_GAIN_COLUMN) + 1
+            table_columns.insert(gain_position, CUMULATIVE_GAIN_COLUMN)
+    lot_ranges = {}
+    if formulas:
+        first_row = 1
+        for broker in portfolio:
+            for isin in portfolio[broker]:
+                lots = portfolio[broker][isin]
+                if layout == "tabelle":
+                    sheet_name, columns = "Chargen", table_columns
+                else:
+                    name = lot_sheet_security_name(isin, lots, metadata_by_isin)
+                    sheet_name = lot_sheet_name(broker, isin, name)
+                    columns = lot_sheet_schema(
+                        isin,
+                        lots,
+                        metadata_by_isin,
+                        vap_by_isin_and_year,
+                        args,
+                        formulas,
+                    )
+                    first_row = 1
+                if lots and isin in quote_cells.quote_by_isin:
+                    lot_ranges[(broker, isin)] = LotRange(
+                        sheet_name,
+                        first_row,
+                        first_row + len(lots) - 1,
+                        {column: i for i, column in enumerate(columns)},
+                    )
+                first_row += len(lots)
+
+    with xlsxwriter.Workbook(excel_out_file, {"constant_memory": True}) as workbook:
+        formats = create_report_formats(workbook)
+
         overview_df = collect_overview_summary(
             portfolio, metadata_by_isin, vap_by_isin_and_year, args
         )
         if not overview_df.empty:
-            overview_df.to_excel(excel_writer, sheet_name="Übersicht", index=False)
             # columns 0-2 are ISIN/Name/Depot, the last column is the tax-share percent
             n_cols = len(overview_df.columns)
-            adjust_styling_in_sheet(
-                excel_writer,
-                "Übersicht",
-                overview_df,
-                set(range(3, n_cols - 1)),
-                {n_cols - 1},
-                set(),
-            )
+            if formulas:
+                sheet_writer = SheetWriter(
+                    workbook,
+                    formats,
+                    "Übersicht",
+                    list(overview_df.columns),
+                    set(range(3, n_cols - 1)),
+                    {n_cols - 1},
+                )
+                for values in iter_overview_formula_rows(overview_df, lot_ranges, args):
+                    sheet_writer.write_row(values)
+                sheet_writer.close()
+            else:
+                write_dataframe_sheet(
+                    workbook,
+                    formats,
+                    "Übersicht",
+                    overview_df,
+                    set(range(3, n_cols - 1)),
+                    {n_cols - 1},
+                )
+
+        if formulas:
+            write_quotes_sheet(workbook, formats, quote_cells, metadata_by_isin, args)
 
         vap_summary_df = collect_vap_summary(
             portfolio, metadata_by_isin, vap_by_isin_and_year
         )
         if not vap_summary_df.empty:
-            vap_summary_df.to_excel(excel_writer, sheet_name="VAP", index=False)
-            column_indices_money = set(range(3, len(vap_summary_df.columns)))
-            adjust_styling_in_sheet(
-                excel_writer, "VAP", vap_summary_df, column_indices_money, set(), set()
+            write_dataframe_sheet(
+                workbook,
+                formats,
+                "VAP",
+                vap_summary_df,
+                set(range(3, len(vap_summary_df.columns))),
+                set(),
             )
 
+        for summary_sheet in summary_sheets or []:
+            if summary_sheet.df.empty:
+                continue
+            write_dataframe_sheet(
+                workbook,
+                formats,
+                summary_sheet.sheet_name,
+                summary_sheet.df,
+                summary_sheet.column_indices_money,
+                summary_sheet.column_indices_percent,
+            )
+
+        if layout == "tabelle":
+            sheet_writer = SheetWriter(
+                workbook,
+                formats,
+                "Chargen",
+                table_columns,
+                *lot_sheet_column_kinds(table_columns),
+            )
+            for record in queue_records(table_columns):
+                sheet_writer.write_dict(record)
+            sheet_writer.close(autofilter=True)
+            return
+
+        if (processes > 1 or prepared_sheets is not None) and not formulas:
+            for prepared in iter_prepared_lot_sheets(
+                portfolio,
+                metadata_by_isin,
+                vap_by_isin_and_year,
+                args,
+                processes,
+                prepared_sheets,
+            ):
+                sheet_writer = SheetWriter(
+                    workbook,
+                    formats,
+                    prepared.sheet_name,
+                    prepared.columns,
+                    prepared.column_indices_money,
+                    prepared.column_indices_percent,
+                    prepared.column_indices_narrow,
+                    widths=prepared.widths,
+                )
+                for row in prepared.rows:
+                    sheet_writer.write_row(row)
+                sheet_writer.close()
+            return
+
         for broker in portfolio:
             for isin in portfolio[broker]:
                 lots = portfolio[broker][isin]
-                if isin in metadata_by_isin:
-                    name = metadata_by_isin[isin].name
-                else:
-                    name = lots[0].security_name if lots else ""
-
-                result = []
-                # remember how to style each column
-                column_indices_money = set()  # mark as amount of money
-                column_indices_percent = set()
-                column_indices_narrow = set()  # make narrower, but no special styling
-
-                first_lot = True
-                previous_taxable_gains = 0.0  # kann ggf. zur Verrechnung mit späteren Verlusten genutzt werden
-                lot: SecurityLot
-                for lot in lots:
-                    column_index = 0  # keep track of the next column index that will be added (for styling purposes)
-                    # VAP calculation
-                    vap_list_per_share_before_tfs = determine_vap_list(
-                        isin, vap_by_isin_and_year, lot
-                    )
+                name = lot_sheet_security_name(isin, lots, metadata_by_isin)
+                columns = lot_sheet_schema(
+                    isin, lots, metadata_by_isin, vap_by_isin_and_year, args, formulas
+                )
+                sheet_writer = SheetWriter(
+                    workbook,
+                    formats,
+                    lot_sheet_name(broker, isin, name),
+                    columns,
+                    *lot_sheet_column_kinds(columns),
+                )
+                for lot_dict in queue_rows(broker, isin, name):
+                    sheet_writer.write_dict(lot_dict)
+                sheet_writer.close()
 
-                    lot_dict = {
-                        "ISIN": isin,
-                        "Name": name,
-                        "Datum Kauf": lot.purchased_date.date(),
-                        "Anzahl (noch unverkauft)": lot.unsold_shares,
-                        "Anzahl (gekauft)": lot.purchased_shares,
-                        "Gesamtkosten": lot.purchased_value,
-                        "Kosten pro Anteil": lot.purchased_value / lot.purchased_shares,
-                    }
-                    if first_lot:
-                        column_indices_narrow.add(3)
-                        column_indices_narrow.add(4)
-                        column_indices_money.add(5)
-                        column_indices_money.add(6)
-                        column_index = 7
-                    total_vap_per_share_before_tfs = 0.0
-                    for year, vap_per_share_before_tfs in vap_list_per_share_before_tfs:
-                        lot_dict[f"VAP {year} vor TFS pro Anteil"] = (
-                            vap_per_share_before_tfs
-                        )
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-                        total_vap_per_share_before_tfs += vap_per_share_before_tfs
-                    if total_vap_per_share_before_tfs > 0:
-                        lot_dict["Summe VAP vor TFS pro Anteil"] = (
-                            total_vap_per_share_before_tfs
-                        )
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-                        acquisition_price_per_share = (
-                            total_vap_per_share_before_tfs
-                            + lot.purchased_value / lot.purchased_shares
-                        )
-                        lot_dict["Anschaffungspreis inkl. VAP pro Anteil"] = (
-                            acquisition_price_per_share
-                        )
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-                    else:
-                        acquisition_price_per_share = (
-                            lot.purchased_value / lot.purchased_shares
-                        )
-                    if (
-                        isin in metadata_by_isin
-                        and metadata_by_isin[isin].last_quote_eur
-                    ):
-                        metadata = metadata_by_isin[isin]
-                        # can determine taxable gain as there is a current price known
-                        lot_dict["Brutto-Wert"] = (
-                            metadata.last_quote_eur * lot.unsold_shares
-                        )
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-                        taxable_gain_header = "KESt-pflichtiger Gewinn"
-                        taxable_gain = (
-                            metadata.last_quote_eur - acquisition_price_per_share
-                        ) * lot.unsold_shares
-                        if total_vap_per_share_before_tfs > 0:
-                            taxable_gain_header += " nach VAP"
-                        if metadata.tfs_percentage > 0:
-                            taxable_gain_header += " nach TFS"
-                            taxable_gain = (
-                                taxable_gain * (100 - metadata.tfs_percentage) / 100
-                            )
-
-                        lot_dict[taxable_gain_header] = taxable_gain
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-
-                        taxable_gains_to_consider = determine_taxable_gains_to_consider(
-                            previous_taxable_gains, taxable_gain, args
-                        )
-                        previous_taxable_gains += taxable_gain
 
-                        final_tax_factor, kest_header = determine_tax_factor_and_header(
-                            args
-                        )
-                        taxes = taxable_gains_to_consider * final_tax_factor
-                        lot_dict[kest_header] = taxes
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
-
-                        lot_dict["Netto-Wert"] = (
-                            metadata.last_quote_eur * lot.unsold_shares - taxes
-                        )
-                        if first_lot:
-                            column_indices_money.add(column_index)
-                            column_index += 1
+def iter_summary_records(df: pd.DataFrame) -> Iterator[dict]:
+    """Records of a summary DataFrame without the blank separator rows of the tab."""
+    for record in df.to_dict("records"):
+        if record["ISIN"] == "":
+            continue
+        yield {key: None if value == "" else value for key, value in record.items()}
 
-                        lot_dict["Steueranteil an Brutto-Auszahlung"] = taxes / (
-                            metadata.last_quote_eur * lot.unsold_shares
-                        )
-                        if first_lot:
-                            column_indices_percent.add(column_index)
-                            column_index += 1
-                    result.append(lot_dict)
-                    first_lot = False
-
-                df = pd.DataFrame(result)
-                sheet_name = f"{broker} " + (isin if isin != "" else name)
-                sheet_name = sheet_name[:31]  # sheet names have a max length
-                df.to_excel(excel_writer, sheet_name=sheet_name, index=False)
-
-                adjust_styling_in_sheet(
-                    excel_writer,
-                    sheet_name,
-                    df,
-                    column_indices_money,
-                    column_indices_percent,
-                    column_indices_narrow,
-                )
+
+def format_summary_table(
+    df: pd.DataFrame, column_indices_money: set[int], column_indices_percent: set[int]
+) -> str:
+    """Summary DataFrame as an aligned text table (money with 2 decimals, percent in %)."""
+
+    def formatted(values: pd.Series, fmt: str) -> pd.Series:
+        return values.map(lambda x: fmt.format(x) if isinstance(x, float) else str(x))
+
+    table = df.copy()
+    for i, column in enumerate(df.columns):
+        if i in column_indices_percent:
+            table[column] = formatted(df[column], "{:.2%}")
+        elif i in column_indices_money:
+            table[column] = formatted(df[column], "{:.2f}")
+    return table.to_string(index=False)
+
+
+@stage("uebersicht_ausgeben")
+def print_overview_summaries(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    args,
+    output_format: str = "tabelle",
+) -> None:
+    """
+    Übersicht und VAP-Übersicht auf stdout ausgeben, als Tabellen oder als JSON-Objekt
+    {"Übersicht": [...], "VAP": [...]} (ohne Leerzeilen). Es wird keine XLSX-Datei erzeugt.
+    """
+    overview_df = collect_overview_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, args
+    )
+    vap_summary_df = collect_vap_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year
+    )
+    if output_format == "json":
+        print(
+            json.dumps(
+                {
+                    "Übersicht": list(iter_summary_records(overview_df)),
+                    "VAP": list(iter_summary_records(vap_summary_df)),
+                },
+                ensure_ascii=False,
+                indent=2,
+            )
+        )
+        return
+
+    if not overview_df.empty:
+        n_cols = len(overview_df.columns)
+        print("Übersicht")
+        print(
+            format_summary_table(overview_df, set(range(3, n_cols - 1)), {n_cols - 1})
+        )
+    if not vap_summary_df.empty:
+        print()
+        print("VAP")
+        print(
+            format_summary_table(
+                vap_summary_df, set(range(3, len(vap_summary_df.columns))), set()
+            )
+        )
 
 
 def print_portfolio_summary(
@@ -1140,8 +2439,7 @@ def determine_language_from_transactions_file(transactions_file: str) -> I18nHel
     elif "Date" in first_line:
         return I18nHelper(is_german=False)
     else:
-        logging.error(
+        raise UnsupportedFileFormatError(
             f"Buchungs-Datei {transactions_file} hat unerwartetes Format. Sie muss in Deutsch oder "
             f"Englisch sein."
         )
-        exit(1)
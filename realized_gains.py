@@ -0,0 +1,83 @@
+"""Realisierte Gewinne aller Verkäufe aus dem FIFO-Replay (--realisiert).
+
+Bei jedem Verkauf legt das Replay je verbrauchter Charge einen Eintrag an: Depot,
+Verkaufsbuchung, die Charge, die verkauften Anteile und der anteilige Erlös in EUR
+(Gesamtpreis des Verkaufs zuzüglich der einbehaltenen Steuern, d. h. nach Gebühren;
+Fremdwährung zum Kurs am Verkaufstag). Kosten, bis zum Verkauf erhobene Vorabpauschalen
+und der KESt-pflichtige Gewinn nach TFS ergeben sich daraus ohne erneutes Replay (siehe
+pyfifovap.collect_realized_gains_summary).
+
+Ohne aktives Journal prüft das Replay je Verkauf nur `current() is None`.
+"""
+
+import dataclasses
+import datetime
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from pyfifovap import SecurityLot
+
+_active: Optional["RealizedGainsLedger"] = None
+
+
+@dataclasses.dataclass
+class RealizedLot:
+    """The shares of one lot consumed by one sale."""
+
+    broker: str
+    isin: str
+    sale_date: datetime.datetime
+    sale_index: int  # row of the sale in the export
+    lot: "SecurityLot"  # purchase data only; its unsold shares change later
+    shares: float
+    proceeds_eur: float  # share of the sale's proceeds
+
+
+class RealizedGainsLedger:
+    """Consumed lot portions of all sales, in replay order."""
+
+    def __init__(self):
+        self.entries: list[RealizedLot] = []
+
+    def record_sale(
+        self,
+        broker: str,
+        isin: str,
+        sale_date: datetime.datetime,
+        sale_index: int,
+        consumed: list[tuple["SecurityLot", float]],
+        proceeds_eur: float,
+    ) -> None:
+        """Add the `consumed` (lot, shares) of a sale; the proceeds are split by shares."""
+        total_shares = sum(shares for _, shares in consumed)
+        for lot, shares in consumed:
+            self.entries.append(
+                RealizedLot(
+                    broker,
+                    isin,
+                    sale_date,
+                    sale_index,
+                    lot,
+                    shares,
+                    proceeds_eur * shares / total_shares if total_shares else 0.0,
+                )
+            )
+
+
+def current() -> Optional[RealizedGainsLedger]:
+    """The active ledger, or None if sales are not recorded."""
+    return _active
+
+
+def start() -> RealizedGainsLedger:
+    """Record the sales of all following replays."""
+    global _active
+    _active = RealizedGainsLedger()
+    return _active
+
+
+def stop() -> Optional[RealizedGainsLedger]:
+    """Stop recording; returns the finished ledger."""
+    global _active
+    ledger, _active = _active, None
+    return ledger
@@ -0,0 +1,124 @@
+"""Prüfprotokoll des FIFO-Replays (--protokoll).
+
+Für jede verarbeitete Buchung wird eine Zeile JSON geschrieben: Zeile im Export, Datum,
+Typ, Wertpapier, Depots und die betroffenen Chargen mit ihren Anteilen vor und nach der
+Buchung. Chargen werden durch Depot, Kaufdatum und Exportzeile des Kaufs benannt; Teile
+einer Charge, die nach einem Übertrag wieder im selben Depot liegen (z. B. hin und zurück
+übertragen), werden dabei zusammengefasst.
+
+    {"zeile": 12, "datum": "2024-03-01T00:00", "aktion": "verkauf", ...,
+     "chargen": [{"depot": "Hauptdepot", "kaufdatum": "2021-01-04T00:00:00",
+                  "kaufzeile": 48, "vorher": 10.0, "nachher": 0.0}, ...]}
+
+Ohne aktives Protokoll prüft das Replay je Buchung nur `current() is None`; es werden
+keine Werte formatiert. Mit Protokoll werden die betroffenen Reihen vor und nach jeder
+Buchung verglichen.
+"""
+
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+from sortedcontainers import SortedList
+
+# German action per transaction type, see ReplayTrace.record()
+ACTION_BUY = "kauf"
+ACTION_DELIVERY_INBOUND = "einlieferung"
+ACTION_TRANSFER_OUTBOUND = "uebertrag"
+ACTION_SELL = "verkauf"
+ACTION_DELIVERY_OUTBOUND = "auslieferung"
+ACTION_IGNORED = "ignoriert"
+
+_active: Optional["ReplayTrace"] = None
+
+# (depot, purchase date, purchase row) -> unsold shares, summed over split lots
+LotShares = dict[tuple, float]
+
+
+class ReplayTrace:
+    """Writes one JSON line per replayed transaction to `path`."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.file = open(self.path, "w", encoding="utf-8")  # noqa: SIM115 - see close()
+        self.records = 0
+
+    def snapshot(
+        self,
+        portfolio: defaultdict[str, defaultdict[str, SortedList]],
+        depots: tuple[str, ...],
+        isin: str,
+    ) -> LotShares:
+        """Unsold shares of the lots of `isin` in `depots` (without creating queues)."""
+        shares: LotShares = defaultdict(float)
+        for depot in depots:
+            if depot in portfolio:
+                for lot in portfolio[depot].get(isin, ()):
+                    key = (depot, lot.purchased_date, lot.purchased_index)
+                    shares[key] += lot.unsold_shares
+        return shares
+
+    def record(
+        self,
+        row,
+        pp_names,
+        isin: str,
+        action: str,
+        before: LotShares,
+        after: LotShares,
+    ) -> None:
+        """Write the transaction `row` and the lots whose shares it changed."""
+        lots = []
+        for key in sorted(before.keys() | after.keys()):
+            shares_before, shares_after = before.get(key, 0.0), after.get(key, 0.0)
+            if shares_before == shares_after:
+                continue
+            depot, purchased_date, purchased_index = key
+            lots.append(
+                {
+                    "depot": depot,
+                    "kaufdatum": purchased_date.isoformat(),
+                    "kaufzeile": int(purchased_index),
+                    "vorher": shares_before,
+                    "nachher": shares_after,
+                }
+            )
+        record = {
+            "zeile": int(row["Index"]),
+            "datum": row[pp_names.DATE],
+            "aktion": action,
+            "wertpapier": row[pp_names.SECURITY],
+            "isin": isin,
+            "stueck": row[pp_names.SHARES],
+            "depot": row[pp_names.CASH_ACCOUNT],
+            "gegenkonto": row[pp_names.OFFSET_ACCOUNT],
+            "chargen": lots,
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+        self.records += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def current() -> Optional[ReplayTrace]:
+    """The active trace, or None if the replay is not traced."""
+    return _active
+
+
+def start(path: str | Path) -> ReplayTrace:
+    """Trace all following replays into `path` (overwritten)."""
+    global _active
+    _active = ReplayTrace(path)
+    return _active
+
+
+def stop() -> Optional[ReplayTrace]:
+    """Stop tracing and close the file; returns the finished trace."""
+    global _active
+    trace, _active = _active, None
+    if trace is not None:
+        trace.close()
+    return trace
@@ -0,0 +1,185 @@
+"""Cache für eingelesene Portfolios und fertige Ergebnisdateien.
+
+Ein Eintrag wird über einen SHA-256-Digest gefunden: über den Inhalt der vier
+Eingabedateien und die Optionen, die das Ergebnis beeinflussen. Es gibt zwei Stufen:
+
+- "Eingaben": die nach FIFO verarbeiteten Chargen samt Metadaten und VAP. Ändern sich
+  nur Steuer- oder Ausgabeoptionen, entfällt das erneute Einlesen.
+- "Ergebnis": die geschriebenen Dateien. Sind Eingaben und alle Optionen unverändert,
+  werden sie nur an den Zielort kopiert.
+
+Überschreiten die Einträge zusammen die Maximalgröße, werden die am längsten nicht
+genutzten gelöscht.
+"""
+
+import dataclasses
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sortedcontainers import SortedList
+
+from pyfifovap import ETFMetadata
+
+# part of every digest; increase when the cached data or its meaning changes
+CACHE_VERSION = 1
+
+_MANIFEST = "manifest.json"
+
+
+def _canonical(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Nicht serialisierbarer Wert für den Cache-Schlüssel: {value!r}")
+
+
+def cache_digest(files: Iterable[str], options: dict) -> str:
+    """SHA-256 over the contents (not the paths) of `files` and the given options."""
+    digest = hashlib.sha256(f"pyfifovap-cache-{CACHE_VERSION}".encode())
+    for path in files:
+        file_digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                file_digest.update(chunk)
+        digest.update(file_digest.digest())
+    digest.update(
+        json.dumps(options, sort_keys=True, default=_canonical).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class ReportCache:
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _inputs_path(self, key: str) -> Path:
+        return self.directory / f"{key}.pickle"
+
+    def _report_path(self, key: str) -> Path:
+        return self.directory / key
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        # the modification time serves as "last used" for the eviction
+        os.utime(path)
+
+    def load_inputs(
+        self, key: str
+    ) -> Optional[
+        tuple[
+            defaultdict[str, defaultdict[str, SortedList]],
+            dict[str, ETFMetadata],
+            defaultdict[str, defaultdict[int, float]],
+        ]
+    ]:
+        """Return (portfolio, metadata_by_isin, vap_by_isin_and_year), if cached."""
+        path = self._inputs_path(key)
+        try:
+            with open(path, "rb") as f:
+                portfolio, metadata_by_isin, vap = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            logging.warning(
+                f"Cache-Eintrag {path} ist unlesbar und wird ignoriert: {e}"
+            )
+            return None
+        self._touch(path)
+
+        # the defaultdicts cannot be pickled with their lambda factories
+        restored_portfolio: defaultdict[str, defaultdict[str, SortedList]] = (
+            defaultdict(lambda: defaultdict(SortedList))
+        )
+        for broker, lots_by_isin in portfolio.items():
+            restored_portfolio[broker].update(lots_by_isin)
+        restored_vap: defaultdict[str, defaultdict[int, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        for isin, vap_by_year in vap.items():
+            restored_vap[isin].update(vap_by_year)
+        return restored_portfolio, metadata_by_isin, restored_vap
+
+    def store_inputs(
+        self,
+        key: str,
+        portfolio: defaultdict[str, defaultdict[str, SortedList]],
+        metadata_by_isin: dict[str, ETFMetadata],
+        vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    ) -> None:
+        data = (
+            {broker: dict(lots) for broker, lots in portfolio.items()},
+            metadata_by_isin,
+            {isin: dict(vap) for isin, vap in vap_by_isin_and_year.items()},
+        )
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=".tmp-", delete=False
+        ) as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, self._inputs_path(key))
+        self.evict()
+
+    def restore_report(self, key: str) -> Optional[list[Path]]:
+        """Copy the cached files of a report to their targets; returns the targets."""
+        entry = self._report_path(key)
+        try:
+            with open(entry / _MANIFEST, encoding="utf-8") as f:
+                targets = [Path(target) for target in json.load(f)]
+        except FileNotFoundError:
+            return None
+        for index, target in enumerate(targets):
+            shutil.copyfile(entry / str(index), target)
+        self._touch(entry)
+        return targets
+
+    def store_report(self, key: str, paths: list[Path]) -> None:
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.directory, prefix=".tmp-"))
+        for index, path in enumerate(paths):
+            shutil.copyfile(path, tmp_entry / str(index))
+        with open(tmp_entry / _MANIFEST, "w", encoding="utf-8") as f:
+            json.dump([str(path) for path in paths], f, ensure_ascii=False)
+        entry = self._report_path(key)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until all fit into `max_bytes`."""
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(".tmp"):
+                continue
+            if path.is_dir():
+                size = sum(f.stat().st_size for f in path.iterdir())
+            else:
+                size = path.stat().st_size
+            entries.append((path.stat().st_mtime, size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info(f"Entferne Cache-Eintrag {path}")
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,213 @@
+"""Kursszenarien: Auswertung aller Chargen für ein Raster von Kursänderungen.
+
+Die teuren Schritte (Einlesen, FIFO, VAP) laufen nur einmal; die Chargen werden
+mit build_lot_arrays einmalig in Arrays überführt und alle Szenarien anschließend
+in einer einzigen Broadcast-Berechnung (Chargen x Szenarien) ausgewertet.
+"""
+
+import dataclasses
+import logging
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sortedcontainers import SortedList
+
+from pyfifovap import (
+    ETFMetadata,
+    LotArrays,
+    build_lot_arrays,
+    determine_tax_factor_and_header,
+    evaluate_lot_arrays,
+    sum_per_queue,
+)
+
+
+def parse_shock_range(spec: str) -> np.ndarray:
+    """
+    Parse a shock range "VON:BIS:SCHRITT" in percent (e.g. "-30:30:1") into fractions.
+
+    The end value is included. A single number (e.g. "-10") yields a single scenario.
+    """
+    parts = spec.split(":")
+    try:
+        values = [float(part) for part in parts]
+    except ValueError:
+        raise ValueError(
+            f"Ungültiges Kursszenario '{spec}' (erwartet: VON:BIS:SCHRITT)"
+        )
+    if len(values) == 1:
+        return np.array(values) / 100
+    if len(values) != 3 or values[2] <= 0 or values[1] < values[0]:
+        raise ValueError(
+            f"Ungültiges Kursszenario '{spec}' (erwartet: VON:BIS:SCHRITT)"
+        )
+    start, stop, step = values
+    num_steps = round((stop - start) / step) + 1
+    return (start + step * np.arange(num_steps)) / 100
+
+
+@dataclasses.dataclass
+class ShockGrid:
+    """Kursänderungen (als Anteil, z. B. -0.3) je Szenario, global und je ISIN."""
+
+    default_shocks: np.ndarray  # used for every ISIN without its own grid
+    shocks_by_isin: dict[str, np.ndarray]
+
+    @property
+    def num_scenarios(self) -> int:
+        return len(self.default_shocks)
+
+
+def build_shock_grid(
+    global_spec: Optional[str], isin_specs: Optional[list[str]]
+) -> ShockGrid:
+    """
+    Build the scenario grid from the CLI options.
+
+    `global_spec` applies to all ISINs, each entry of `isin_specs` ("ISIN=VON:BIS:SCHRITT")
+    overrides it for one ISIN. All grids must have the same number of scenarios; ISINs
+    without a grid keep their current quote (0 %) when only per-ISIN grids are given.
+    """
+    shocks_by_isin = {}
+    for isin_spec in isin_specs or []:
+        isin, sep, spec = isin_spec.partition("=")
+        if not sep or not isin:
+            raise ValueError(
+                f"Ungültiges Kursszenario '{isin_spec}' (erwartet: ISIN=VON:BIS:SCHRITT)"
+            )
+        shocks_by_isin[isin] = parse_shock_range(spec)
+
+    if global_spec:
+        default_shocks = parse_shock_range(global_spec)
+    elif shocks_by_isin:
+        default_shocks = np.zeros(len(next(iter(shocks_by_isin.values()))))
+    else:
+        raise ValueError("Kein Kursszenario angegeben")
+
+    for isin, shocks in shocks_by_isin.items():
+        if len(shocks) != len(default_shocks):
+            raise ValueError(
+                f"Kursszenario für {isin} hat {len(shocks)} statt {len(default_shocks)} "
+                f"Szenarien - alle Raster müssen gleich viele Schritte haben."
+            )
+    return ShockGrid(default_shocks=default_shocks, shocks_by_isin=shocks_by_isin)
+
+
+@dataclasses.dataclass
+class ScenarioResult:
+    lot_arrays: LotArrays
+    shocks: np.ndarray  # (lots, scenarios)
+    per_lot: dict[str, np.ndarray]  # brutto/gewinn/steuer/netto, each (lots, scenarios)
+    per_queue: dict[str, np.ndarray]  # same keys, each (queues, scenarios)
+
+
+def evaluate_price_scenarios(
+    lot_arrays: LotArrays, shock_grid: ShockGrid, args
+) -> ScenarioResult:
+    """Evaluate all lots under all scenarios in a single broadcast computation."""
+    held_isins = {isin for _, isin, _ in lot_arrays.queues}
+    for isin in shock_grid.shocks_by_isin:
+        if isin not in held_isins:
+            logging.warning(
+                f"Kursszenario für {isin} wird ignoriert (kein Bestand mit bekanntem Kurs)."
+            )
+
+    # (queues, scenarios) shocks, expanded to (lots, scenarios) via the queue index
+    queue_shocks = np.array(
+        [
+            shock_grid.shocks_by_isin.get(isin, shock_grid.default_shocks)
+            for _, isin, _ in lot_arrays.queues
+        ],
+        dtype=float,
+    ).reshape(len(lot_arrays.queues), shock_grid.num_scenarios)
+    shocks = queue_shocks[lot_arrays.queue_index]
+    prices = lot_arrays.last_quote_eur[:, None] * (1 + shocks)
+
+    per_lot = evaluate_lot_arrays(lot_arrays, prices, args)
+    per_queue = {
+        component: sum_per_queue(lot_arrays, values)
+        for component, values in per_lot.items()
+    }
+    return ScenarioResult(
+        lot_arrays=lot_arrays, shocks=shocks, per_lot=per_lot, per_queue=per_queue
+    )
+
+
+def collect_scenario_summary(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+    metadata_by_isin: dict[str, ETFMetadata],
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    shock_grid: ShockGrid,
+    args,
+    lot_arrays: Optional[LotArrays] = None,
+) -> pd.DataFrame:
+    """
+    Übersicht je Depot, Wertpapier und Kursszenario als DataFrame (Langformat).
+
+    Spalten wie in der Übersicht, ergänzt um die Szenario-Nummer, die Kursänderung und den
+    Szenario-Kurs. Je Szenario folgt abschließend eine "GESAMTSUMME"-Zeile über alle Depots.
+    Bereits erzeugte `lot_arrays` derselben Eingaben können übergeben werden.
+    """
+    if lot_arrays is None:
+        lot_arrays = build_lot_arrays(portfolio, metadata_by_isin, vap_by_isin_and_year)
+    if len(lot_arrays) == 0:
+        return pd.DataFrame()
+    result = evaluate_price_scenarios(lot_arrays, shock_grid, args)
+    _, kest_header = determine_tax_factor_and_header(args)
+
+    quote_by_queue = lot_arrays.last_quote_eur[lot_arrays.queue_starts]
+    shocks_by_queue = result.shocks[lot_arrays.queue_starts]
+    order = sorted(
+        range(len(lot_arrays.queues)),
+        key=lambda i: (lot_arrays.queues[i][0], lot_arrays.queues[i][1]),
+    )
+
+    def make_row(scenario, isin, name, broker, shock, quote, fig):
+        brutto, steuer = fig["brutto"], fig["steuer"]
+        return {
+            "Szenario": scenario + 1,
+            "ISIN": isin,
+            "Name": name,
+            "Depot": broker,
+            "Kursänderung": shock,
+            "Kurs": quote,
+            "Brutto-Wert": brutto,
+            "KESt-pflichtiger Gewinn": fig["gewinn"],
+            kest_header: steuer,
+            "Netto-Wert": fig["netto"],
+            "Steueranteil an Brutto-Auszahlung": steuer / brutto if brutto else 0.0,
+        }
+
+    rows = []
+    for scenario in range(shock_grid.num_scenarios):
+        total = {component: 0.0 for component in result.per_queue}
+        for queue in order:
+            broker, isin, name = lot_arrays.queues[queue]
+            fig = {
+                component: float(values[queue, scenario])
+                for component, values in result.per_queue.items()
+            }
+            shock = float(shocks_by_queue[queue, scenario])
+            rows.append(
+                make_row(
+                    scenario,
+                    isin,
+                    name,
+                    broker,
+                    shock,
+                    float(quote_by_queue[queue]) * (1 + shock),
+                    fig,
+                )
+            )
+            for component in total:
+                total[component] += fig[component]
+        total_shock = (
+            float(shock_grid.default_shocks[scenario])
+            if not shock_grid.shocks_by_isin
+            else ""
+        )
+        rows.append(make_row(scenario, "GESAMTSUMME", "", "", total_shock, "", total))
+
+    return pd.DataFrame(rows)
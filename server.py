@@ -0,0 +1,256 @@
+"""Lokaler HTTP/JSON-Server, der das ausgewertete Portfolio im Speicher hält.
+
+Die Eingabedateien werden einmal eingelesen; Anfragen werden danach ohne erneutes
+Einlesen, FIFO und VAP beantwortet. Vor jeder Anfrage werden Änderungszeit und Größe
+der Dateien geprüft und nur das Betroffene neu geladen (siehe incremental.py).
+
+Der Server lauscht ausschließlich auf 127.0.0.1 und fragt keine Wechselkurse ab.
+
+Endpunkte (GET, Antworten als JSON):
+
+- /uebersicht: Übersicht und VAP-Übersicht wie mit --nur-uebersicht json
+- /chargen?depot=D&isin=I: alle Chargen eines Wertpapiers in einem Depot
+- /verkauf?isin=I&betrag=EUR (oder anteile=N, optional depot=D): Steuer eines Verkaufs
+  nach FIFO; ohne Depot wird ein Betrag steuerminimal auf die Depots verteilt
+- /szenarien?raster=VON:BIS:SCHRITT (und/oder isin_raster=ISIN=VON:BIS:SCHRITT):
+  Kursszenarien wie mit --kursszenarien
+"""
+
+import json
+import logging
+from collections.abc import Callable, Iterable
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from columnar import json_value
+from incremental import RELOAD_ERRORS, PortfolioState
+from planning import allocate_sale_across_depots, taxes_of_gains
+from pyfifovap import (
+    collect_overview_summary,
+    collect_vap_summary,
+    determine_tax_factor_and_header,
+    iter_lot_records,
+    iter_summary_records,
+    lot_table_columns,
+)
+from scenarios import build_shock_grid, collect_scenario_summary
+
+
+class QueryError(ValueError):
+    """Invalid request; answered with status 400 and the message."""
+
+
+def _records(records: Iterable[dict]) -> list[dict]:
+    return [{key: json_value(value) for key, value in r.items()} for r in records]
+
+
+def _param(params: dict[str, list[str]], name: str, required: bool = True):
+    values = params.get(name)
+    if not values:
+        if required:
+            raise QueryError(f"Parameter '{name}' fehlt")
+        return None
+    return values[-1]
+
+
+def _float_param(params: dict[str, list[str]], name: str) -> Optional[float]:
+    value = _param(params, name, required=False)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise QueryError(f"Parameter '{name}' ist keine Zahl: '{value}'")
+
+
+def query_overview(state: PortfolioState, params: dict[str, list[str]]) -> dict:
+    if "uebersicht" not in state.memo:
+        state.memo["uebersicht"] = {
+            "Übersicht": _records(
+                iter_summary_records(
+                    collect_overview_summary(
+                        state.portfolio,
+                        state.metadata_by_isin,
+                        state.vap_by_isin_and_year,
+                        state.args,
+                    )
+                )
+            ),
+            "VAP": _records(
+                iter_summary_records(
+                    collect_vap_summary(
+                        state.portfolio,
+                        state.metadata_by_isin,
+                        state.vap_by_isin_and_year,
+                    )
+                )
+            ),
+        }
+    return state.memo["uebersicht"]
+
+
+def query_lots(state: PortfolioState, params: dict[str, list[str]]) -> dict:
+    broker, isin = _param(params, "depot"), _param(params, "isin")
+    lots = state.portfolio.get(broker, {}).get(isin)
+    if lots is None:
+        raise QueryError(f"Kein Wertpapier {isin} im Depot '{broker}'")
+    columns = lot_table_columns(state.vap_by_isin_and_year, state.args)
+    records = iter_lot_records(
+        {broker: {isin: lots}},
+        state.metadata_by_isin,
+        state.vap_by_isin_and_year,
+        columns,
+        state.args,
+    )
+    return {"Spalten": columns, "Chargen": _records(records)}
+
+
+def query_sale(state: PortfolioState, params: dict[str, list[str]]) -> dict:
+    isin = _param(params, "isin")
+    broker = _param(params, "depot", required=False)
+    amount, shares = _float_param(params, "betrag"), _float_param(params, "anteile")
+    if (amount is None) == (shares is None):
+        raise QueryError("Genau einer der Parameter 'betrag' und 'anteile' ist nötig")
+    if (amount if amount is not None else shares) <= 0:
+        raise QueryError("Verkaufsbetrag bzw. Anteile müssen positiv sein")
+
+    views = [
+        view
+        for (view_broker, view_isin), view in sorted(state.queue_views.items())
+        if view_isin == isin
+        and (broker is None or view_broker == broker)
+        and view.total_shares > 0
+    ]
+    if not views:
+        raise QueryError(f"Kein Bestand mit bekanntem Kurs für {isin}")
+    if shares is not None:
+        if len(views) > 1:
+            raise QueryError(
+                f"{isin} liegt in mehreren Depots; für 'anteile' bitte 'depot' angeben"
+            )
+        shares_per_view = [shares]
+    else:
+        amounts = (
+            allocate_sale_across_depots(views, amount, state.args)
+            if len(views) > 1
+            else [amount]
+        )
+        shares_per_view = [a / view.last_quote_eur for a, view in zip(amounts, views)]
+
+    _, kest_header = determine_tax_factor_and_header(state.args)
+    sales = []
+    for view, view_shares in zip(views, shares_per_view):
+        if view_shares <= 0:
+            continue
+        gain = float(view.taxable_gain_of_sale(view_shares))
+        if np.isnan(gain):
+            raise QueryError(
+                f"Im Depot '{view.broker}' liegen nur {view.total_shares:.4f} Anteile "
+                f"von {isin}"
+            )
+        taxes = float(taxes_of_gains(np.array(gain), state.args))
+        proceeds = view_shares * view.last_quote_eur
+        sales.append(
+            {
+                "Depot": view.broker,
+                "Anteile": view_shares,
+                "Brutto-Erlös": proceeds,
+                "KESt-pflichtiger Gewinn": gain,
+                kest_header: taxes,
+                "Netto-Erlös": proceeds - taxes,
+            }
+        )
+    total = {
+        key: sum(sale[key] for sale in sales)
+        for key in (
+            "Brutto-Erlös",
+            "KESt-pflichtiger Gewinn",
+            kest_header,
+            "Netto-Erlös",
+        )
+    }
+    return {"ISIN": isin, "Verkäufe": sales, "Summe": total}
+
+
+def query_scenarios(state: PortfolioState, params: dict[str, list[str]]) -> dict:
+    try:
+        shock_grid = build_shock_grid(
+            _param(params, "raster", required=False), params.get("isin_raster")
+        )
+    except ValueError as e:
+        raise QueryError(str(e))
+    df = collect_scenario_summary(
+        state.portfolio,
+        state.metadata_by_isin,
+        state.vap_by_isin_and_year,
+        shock_grid,
+        state.args,
+        lot_arrays=state.lot_arrays,
+    )
+    return {"Szenarien": _records(iter_summary_records(df))}
+
+
+ROUTES: dict[str, Callable[[PortfolioState, dict[str, list[str]]], dict]] = {
+    "/uebersicht": query_overview,
+    "/chargen": query_lots,
+    "/verkauf": query_sale,
+    "/szenarien": query_scenarios,
+}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    state: PortfolioState
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        route = ROUTES.get(url.path.rstrip("/") or "/")
+        if route is None:
+            self._send(
+                404, {"Fehler": f"Unbekannter Pfad {url.path}", "Pfade": list(ROUTES)}
+            )
+            return
+        try:
+            self.state.reload()
+        except RELOAD_ERRORS as e:
+            # e.g. a file that is being written right now; keep serving the old state
+            logging.warning(f"Neu laden fehlgeschlagen, verwende bisherige Daten: {e}")
+        try:
+            body = route(self.state, parse_qs(url.query))
+        except QueryError as e:
+            self._send(400, {"Fehler": str(e)})
+            return
+        self._send(200, body)
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+
+def create_server(args, port: int) -> HTTPServer:
+    """Load the inputs and bind a server to 127.0.0.1:`port` (0: any free port)."""
+    handler = type(
+        "PortfolioQueryHandler",
+        (QueryHandler,),
+        {"state": PortfolioState(args, offline=True)},
+    )
+    return HTTPServer(("127.0.0.1", port), handler)
+
+
+def serve(args, port: int) -> None:
+    with create_server(args, port) as httpd:
+        host, port = httpd.server_address[:2]
+        print(f"Server läuft auf http://{host}:{port}/ (Beenden mit Strg+C)")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""Synthetische PortfolioPerformance-Exporte beliebiger Größe für Tests und Benchmarks.
+
+Erzeugt Buchungs- und Wertpapier-Datei (deutsch oder englisch) sowie passende Metadaten-
+und VAP-Dateien. Je Depot und Wertpapier gibt es einen monatlichen Sparplan über die
+angegebene Anzahl Jahre, dazu Verkäufe, Umbuchungen zwischen Depots, Ein- und
+Auslieferungen. Ein Teil der Wertpapiere notiert in USD; deren Beträge werden wie von
+PortfolioPerformance mit Währungs-Präfix exportiert ("USD 123,45").
+
+Die Daten sind bei gleichem Seed reproduzierbar und in sich stimmig: Es werden nie mehr
+Anteile verkauft oder übertragen als vorhanden. Die erwarteten Bestände je Depot und
+ISIN und die verwendeten Wechselkurse werden mit zurückgegeben, damit Tests und
+Benchmarks offline rechnen können (siehe seed_forex_cache).
+
+Beispiel:
+   python synthetic_exports.py Synthetisch --groesse mittel --sprache en
+"""
+
+import argparse
+import csv
+import dataclasses
+import datetime
+import itertools
+import random
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+from i18n_helper import I18nHelper
+
+END_DATE = datetime.date(2025, 12, 31)
+LATEST_QUOTE_DATE = datetime.date(2026, 1, 2)
+TFS_EQUITY_FUND = 30
+# Basiszins per year of the value increase (ETFs pay VAP on 70% of it)
+BASISZINS = {2018: 0.0087, 2019: 0.0052, 2023: 0.0255, 2024: 0.0229, 2025: 0.0253}
+
+
+@dataclasses.dataclass(frozen=True)
+class ExportSpec:
+    """Umfang der erzeugten Exporte."""
+
+    accounts: int = 2
+    securities: int = 8
+    years: int = 3
+    sells_per_year: int = 2  # per depot and security
+    transfers_per_year: int = 1  # per security, between two depots
+    deliveries_per_year: int = 1  # inbound and outbound per security
+    foreign_share: float = 0.25  # share of securities quoted in USD
+    german: bool = True
+    seed: int = 0
+
+
+SCALES = {
+    "klein": ExportSpec(accounts=2, securities=5, years=3),
+    "mittel": ExportSpec(accounts=3, securities=20, years=10),
+    "gross": ExportSpec(accounts=5, securities=50, years=20),
+}
+
+
+@dataclasses.dataclass
+class SyntheticExports:
+    transactions_file: Path
+    securities_file: Path
+    metadata_file: Path
+    vap_file: Path
+    num_transactions: int
+    # expected unsold shares per (depot, ISIN) after replaying all transactions
+    expected_shares: dict[tuple[str, str], float]
+    # USD per EUR per day (None: latest rate), as cached by ForexHelper
+    usd_per_eur: dict[Optional[datetime.date], float]
+
+
+@dataclasses.dataclass
+class _Security:
+    name: str
+    isin: str
+    is_fund: bool
+    is_foreign: bool
+    prices: dict[datetime.date, float]  # in the quote currency
+
+
+def _isin(country: str, number: int) -> str:
+    """An ISIN with a valid check digit."""
+    body = f"{country}{number:09d}"
+    digits = "".join(str(int(c, 36)) for c in body)
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if i % 2 == 0 else 1)
+        total += value // 10 + value % 10
+    return body + str((10 - total % 10) % 10)
+
+
+def _format_number(value: float, german: bool, decimals: int) -> str:
+    text = f"{value:,.{decimals}f}"
+    if decimals > 2:
+        text = text.rstrip("0").rstrip(".")
+    if german:
+        text = text.translate(str.maketrans(",.", ".,"))
+    return text
+
+
+def _days(start: datetime.date, end: datetime.date):
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def _price_path(
+    rng: random.Random, start: datetime.date, end: datetime.date
+) -> dict[datetime.date, float]:
+    """Daily prices of a geometric random walk (about 7% p.a., 18% volatility)."""
+    price = rng.uniform(20, 400)
+    prices = {}
+    for day in _days(start, end):
+        prices[day] = price
+        price *= 1 + rng.gauss(0.07 / 365, 0.18 / 365**0.5)
+    return prices
+
+
+def generate_exports(directory: Path, spec: ExportSpec) -> SyntheticExports:
+    """Write the four input files into `directory` (created if needed)."""
+    rng = random.Random(spec.seed)
+    i18n_helper = I18nHelper(is_german=spec.german)
+    names = i18n_helper.get_pp_names()
+    start = datetime.date(END_DATE.year - spec.years + 1, 1, 1)
+
+    usd_per_eur = {}
+    rate = 1.1
+    for day in _days(start, LATEST_QUOTE_DATE):
+        usd_per_eur[day] = round(rate, 4)
+        rate = min(max(rate * (1 + rng.gauss(0, 0.004)), 0.8), 1.5)
+    usd_per_eur[None] = usd_per_eur[LATEST_QUOTE_DATE]
+
+    num_foreign = round(spec.securities * spec.foreign_share)
+    securities = []
+    for i in range(spec.securities):
+        is_foreign = i < num_foreign
+        is_fund = not is_foreign and i % 2 == 0
+        if is_foreign:
+            name, country = f"Synthetic US Corp {i + 1}", "US"
+        elif is_fund:
+            name, country = f"Synthetischer Welt ETF {i + 1}", "IE"
+        else:
+            name, country = f"Synthetische Aktie {i + 1} AG", "DE"
+        securities.append(
+            _Security(
+                name=name,
+                isin=_isin(country, 900000 + i),
+                is_fund=is_fund,
+                is_foreign=is_foreign,
+                prices=_price_path(rng, start, LATEST_QUOTE_DATE),
+            )
+        )
+    accounts = [f"Depot {i + 1}" for i in range(spec.accounts)]
+    # the first depot holds every security with a savings plan, the others some
+    savings_plans = [
+        (account_index, account, security)
+        for security in securities
+        for account_index, account in enumerate(accounts)
+        if account_index == 0 or rng.random() < 0.6
+    ]
+
+    # events: (date, security, type, depot, offset account, shares)
+    events = []
+    holdings: defaultdict[tuple[str, str], float] = defaultdict(float)
+
+    def add_event(day, security, kind, account, offset_account, shares):
+        events.append((day, security, kind, account, offset_account, shares))
+
+    def move(account, security, fraction):
+        """Round down a fraction of the current holding to 4 decimals."""
+        held = holdings[(account, security.isin)]
+        return int(held * fraction * 10_000) / 10_000
+
+    def randomly(per_year: int) -> bool:
+        return rng.random() < per_year / 365
+
+    for day in _days(start, END_DATE):
+        for account_index, account, security in savings_plans:
+            if day.day == 1 + (account_index * 7) % 28:
+                amount = rng.choice((50, 100, 150, 200, 250, 500))
+                shares = round(amount / security.prices[day], 4)
+                holdings[(account, security.isin)] += shares
+                add_event(day, security, names.TYPE_BUY, account, "", shares)
+
+        for security in securities:
+            for account in accounts:
+                if randomly(spec.sells_per_year):
+                    shares = move(account, security, rng.uniform(0.05, 0.5))
+                    if shares > 0:
+                        holdings[(account, security.isin)] -= shares
+                        add_event(day, security, names.TYPE_SELL, account, "", shares)
+            if len(accounts) > 1 and randomly(spec.transfers_per_year):
+                source, target = rng.sample(accounts, 2)
+                shares = move(source, security, rng.uniform(0.1, 1.0))
+                if shares > 0:
+                    holdings[(source, security.isin)] -= shares
+                    holdings[(target, security.isin)] += shares
+                    add_event(
+                        day,
+                        security,
+                        names.TYPE_TRANSFER_OUTBOUND,
+                        source,
+                        target,
+                        shares,
+                    )
+            if randomly(spec.deliveries_per_year):
+                account = rng.choice(accounts)
+                shares = round(rng.uniform(1, 20), 4)
+                holdings[(account, security.isin)] += shares
+                add_event(
+                    day, security, names.TYPE_DELIVERY_INBOUND, account, "", shares
+                )
+            if randomly(spec.deliveries_per_year):
+                account = rng.choice(accounts)
+                shares = move(account, security, rng.uniform(0.05, 0.3))
+                if shares > 0:
+                    holdings[(account, security.isin)] -= shares
+                    add_event(
+                        day, security, names.TYPE_DELIVERY_OUTBOUND, account, "", shares
+                    )
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    separator = i18n_helper.get_pp_csv_separator()
+
+    def money(security: _Security, value: float) -> str:
+        text = _format_number(value, spec.german, 2)
+        return f"USD {text}" if security.is_foreign else text
+
+    transactions_file = directory / (
+        "Alle_Buchungen.csv" if spec.german else "All_transactions.csv"
+    )
+    with open(transactions_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=separator, lineterminator="\n")
+        writer.writerow(
+            [
+                names.DATE,
+                names.TYPE,
+                names.SECURITY,
+                names.SHARES,
+                "Kurs" if spec.german else "Quote",
+                "Betrag" if spec.german else "Amount",
+                "Gebühren" if spec.german else "Fees",
+                "Steuern" if spec.german else "Taxes",
+                names.NET_TRANSACTION_VALUE,
+                names.CASH_ACCOUNT,
+                names.OFFSET_ACCOUNT,
+                "Notiz" if spec.german else "Note",
+                "Quelle" if spec.german else "Source",
+            ]
+        )
+        # every event of a day gets its own second so that their order is unambiguous
+        timestamps = []
+        for day, group in itertools.groupby(events, key=lambda event: event[0]):
+            midnight = datetime.datetime.combine(day, datetime.time())
+            timestamps += [
+                midnight + datetime.timedelta(seconds=second)
+                for second, _ in enumerate(group)
+            ]
+        # newest first like PortfolioPerformance
+        for timestamp, (day, security, kind, account, offset_account, shares) in zip(
+            reversed(timestamps), reversed(events)
+        ):
+            price = security.prices[day]
+            value = price * shares
+            fees = 1.0 if kind in (names.TYPE_BUY, names.TYPE_SELL) else 0.0
+            net_value = value + fees if kind == names.TYPE_BUY else value - fees
+            if kind in (names.TYPE_BUY, names.TYPE_SELL):
+                offset_account = f"{account} Cash"
+            writer.writerow(
+                [
+                    timestamp.isoformat(sep=" "),
+                    kind,
+                    security.name,
+                    _format_number(shares, spec.german, 4),
+                    money(security, price),
+                    money(security, value),
+                    money(security, fees) if fees else "",
+                    "",
+                    money(security, net_value),
+                    account,
+                    offset_account,
+                    "",
+                    "",
+                ]
+            )
+
+    securities_file = directory / (
+        "Wertpapiere_(Standard).csv" if spec.german else "Securities_(Standard).csv"
+    )
+    with open(securities_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=separator, lineterminator="\n")
+        writer.writerow(
+            [
+                names.NAME,
+                "Notiz" if spec.german else "Note",
+                names.ISIN,
+                "Symbol",
+                "WKN",
+                names.LATEST_QUOTE,
+                f"{names.LATEST_QUOTE} (Datum)" if spec.german else "Latest (Date)",
+            ]
+        )
+        for security in securities:
+            writer.writerow(
+                [
+                    security.name,
+                    "",
+                    security.isin,
+                    f"SYN{securities.index(security) + 1}",
+                    "",
+                    money(security, security.prices[LATEST_QUOTE_DATE]),
+                    LATEST_QUOTE_DATE.isoformat(),
+                ]
+            )
+
+    custom_names = i18n_helper.get_custom_csv_names()
+    metadata_file = directory / "etf_metadaten.csv"
+    with open(metadata_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(
+            [
+                custom_names.ISIN,
+                custom_names.NAME,
+                custom_names.PROZENT_TEILFREISTELLUNG,
+            ]
+        )
+        for security in securities:
+            if security.is_fund:
+                writer.writerow([security.isin, security.name, TFS_EQUITY_FUND])
+
+    vap_file = directory / "etf_vorabpauschalen.csv"
+    with open(vap_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(
+            [
+                custom_names.ISIN,
+                custom_names.NAME,
+                custom_names.JAHR_DES_WERTZUWACHES,
+                custom_names.VAP_VOR_TFS_PRO_ANTEIL,
+            ]
+        )
+        for security in securities:
+            if not security.is_fund:
+                continue
+            for year in range(start.year, END_DATE.year + 1):
+                first = security.prices[datetime.date(year, 1, 1)]
+                last = security.prices[datetime.date(year, 12, 31)]
+                base_yield = first * BASISZINS.get(year, 0.0) * 0.7
+                vap = max(0.0, min(base_yield, last - first))
+                writer.writerow([security.isin, security.name, year, f"{vap:.6f}"])
+
+    return SyntheticExports(
+        transactions_file=transactions_file,
+        securities_file=securities_file,
+        metadata_file=metadata_file,
+        vap_file=vap_file,
+        num_transactions=len(events),
+        expected_shares={
+            key: shares for key, shares in holdings.items() if shares > 1e-9
+        },
+        usd_per_eur=usd_per_eur,
+    )
+
+
+def seed_forex_cache(forex_helper, exports: SyntheticExports) -> None:
+    """Make the synthetic USD rates available to a (usually offline) ForexHelper."""
+    for day, rate in exports.usd_per_eur.items():
+        forex_helper.eur_to_forex_cache[("USD", day)] = rate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Synthetische PortfolioPerformance-Exporte samt Metadaten- und "
+        "VAP-Datei erzeugen"
+    )
+    parser.add_argument("verzeichnis", help="Zielverzeichnis der vier CSV-Dateien")
+    parser.add_argument(
+        "--groesse",
+        choices=list(SCALES),
+        default="klein",
+        help="Vordefinierter Umfang (Standard: klein)",
+    )
+    parser.add_argument("--depots", type=int, help="Anzahl Depots")
+    parser.add_argument("--wertpapiere", type=int, help="Anzahl Wertpapiere")
+    parser.add_argument("--jahre", type=int, help="Jahre mit Sparplänen")
+    parser.add_argument(
+        "--sprache",
+        choices=["de", "en"],
+        default="de",
+        help="Export-Sprache von PortfolioPerformance (Standard: de)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Zufalls-Seed (Standard: 0)"
+    )
+    args = parser.parse_args()
+
+    spec = dataclasses.replace(
+        SCALES[args.groesse], german=args.sprache == "de", seed=args.seed
+    )
+    for field, value in (
+        ("accounts", args.depots),
+        ("securities", args.wertpapiere),
+        ("years", args.jahre),
+    ):
+        if value is not None:
+            if value < 1:
+                parser.error("Depots, Wertpapiere und Jahre müssen mindestens 1 sein")
+            spec = dataclasses.replace(spec, **{field: value})
+    exports = generate_exports(Path(args.verzeichnis), spec)
+    print(
+        f"{exports.num_transactions} Buchungen in {exports.transactions_file} geschrieben"
+    )
+
+
+if __name__ == "__main__":
+    main()
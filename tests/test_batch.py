@@ -0,0 +1,109 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from batch import read_clients
+
+DATA_DIR = Path(__file__).parent / "data"
+REPO_DIR = Path(__file__).parent.parent
+
+
+def _client_dir(directory: Path, extra_transaction: str = "") -> Path:
+    directory.mkdir(parents=True)
+    shutil.copyfile(
+        DATA_DIR / "Wertpapiere_(Standard).csv",
+        directory / "Wertpapiere_(Standard).csv",
+    )
+    lines = (DATA_DIR / "Alle_Buchungen.csv").read_text(encoding="utf-8").splitlines()
+    if extra_transaction:
+        lines.insert(1, extra_transaction)
+    (directory / "Alle_Buchungen.csv").write_text(
+        "\n".join(lines) + "\n", encoding="utf-8"
+    )
+    return directory
+
+
+def test_read_clients(tmp_path):
+    _client_dir(tmp_path / "clients" / "Meier")
+    _client_dir(tmp_path / "clients" / "Schulz")
+    assert [client.name for client in read_clients(tmp_path / "clients")] == [
+        "Meier",
+        "Schulz",
+    ]
+
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "Mandant,Buchungen,Wertpapiere\n"
+        "Meier,clients/Meier/Alle_Buchungen.csv,clients/Meier/Wertpapiere_(Standard).csv\n",
+        encoding="utf-8",
+    )
+    (client,) = read_clients(manifest)
+    assert Path(client.transactions_file) == (
+        tmp_path / "clients" / "Meier" / "Alle_Buchungen.csv"
+    )
+
+    manifest.write_text("Mandant,Buchungen\nMeier,x.csv\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="Wertpapiere"):
+        read_clients(manifest)
+
+
+def test_batch_run(tmp_path):
+    clients = tmp_path / "clients"
+    _client_dir(clients / "Meier")
+    _client_dir(clients / "Schulz")
+    # without exports
+    (clients / "Leer").mkdir()
+    # sells more shares than were bought
+    _client_dir(
+        clients / "Kaputt",
+        "2026-07-01 00:00:00;Verkauf;Vanguard FTSE All-World Acc ETF;1000;170,00;"
+        "170.000,00;;;170.000,00;Hauptdepot;Hauptdepot Cash;;",
+    )
+    out_dir = tmp_path / "out"
+    result = subprocess.run(
+        [
+            sys.executable,
+            "main.py",
+            "--stapel",
+            str(clients),
+            "--stapel-ausgabe",
+            str(out_dir),
+            "--metadaten",
+            str(DATA_DIR / "etf_metadaten.csv"),
+            "--vap",
+            str(DATA_DIR / "etf_vorabpauschalen.csv"),
+            "--offline",
+            "--format",
+            "csv",
+            "--prozesse",
+            "2",
+        ],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    # one failed client fails the run, but the others are still evaluated
+    assert result.returncode == 1
+    assert "2 von 4 Mandanten" in result.stdout
+
+    report = pd.read_csv(out_dir / "Laufbericht.csv", keep_default_na=False)
+    assert list(report["Mandant"]) == ["Kaputt", "Leer", "Meier", "Schulz"]
+    assert list(report["Status"]) == ["Fehler", "Fehler", "OK", "OK"]
+    assert report["Fehler"][0].startswith("InsufficientSharesError")
+    assert report["Fehler"][1].startswith("FileNotFoundError")
+    assert (report["Sekunden"] > 0).all()
+
+    meier = pd.read_csv(out_dir / "Meier" / "Ergebnisse_uebersicht.csv")
+    schulz = pd.read_csv(out_dir / "Schulz" / "Ergebnisse_uebersicht.csv")
+    pd.testing.assert_frame_equal(meier, schulz)
+    assert meier["KESt + Soli"].iloc[-1] == pytest.approx(4414.985538536341)
+    assert report["Chargen"][2] == len(
+        pd.read_csv(out_dir / "Meier" / "Ergebnisse_chargen.csv")
+    )
@@ -0,0 +1,100 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from columnar import TABLE_WRITERS, TableWriter, write_columnar_results
+from pyfifovap import (
+    ForexHelper,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+    read_vap,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+TRANSACTIONS_CSV = str(DATA_DIR / "Alle_Buchungen.csv")
+
+
+def _write(tmp_path, output_format):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(
+        str(DATA_DIR / "etf_vorabpauschalen.csv"), i18n_helper
+    )
+    return write_columnar_results(
+        portfolio,
+        metadata_by_isin,
+        vap_by_isin_and_year,
+        tmp_path / "Ergebnisse",
+        output_format,
+        args,
+    )
+
+
+def test_csv_and_json_lines(tmp_path):
+    csv_paths = _write(tmp_path, "csv")
+    jsonl_paths = _write(tmp_path, "jsonl")
+    assert [path.name for path in csv_paths] == [
+        "Ergebnisse_chargen.csv",
+        "Ergebnisse_uebersicht.csv",
+        "Ergebnisse_vap.csv",
+    ]
+
+    lots = pd.read_csv(csv_paths[0])
+    with open(jsonl_paths[0], encoding="utf-8") as f:
+        lot_records = [json.loads(line) for line in f]
+    assert len(lot_records) == len(lots)
+    assert list(lot_records[0]) == list(lots.columns)
+
+    # Infineon: single lot, no VAP -> VAP columns 0, acquisition price = cost per share
+    infineon = lots[(lots["Depot"] == "Hauptdepot") & (lots["ISIN"] == "DE0006231004")]
+    assert len(infineon) == 1
+    row = infineon.iloc[0]
+    assert row["Datum Kauf"] == "2021-03-17"  # kept on the transfer from Nebendepot
+    assert row["VAP 2024 vor TFS pro Anteil"] == 0.0
+    assert row["Anschaffungspreis inkl. VAP pro Anteil"] == pytest.approx(35.24)
+    assert row["KESt-pflichtiger Gewinn"] == pytest.approx(507.7)
+    assert row["KESt + Soli"] == pytest.approx(507.7 * 0.26375)
+
+    # Berkshire (USD, offline): no quote -> no gain/tax
+    berkshire = lots[lots["ISIN"] == "US0846707026"]
+    assert berkshire["KESt-pflichtiger Gewinn"].isna().all()
+
+    # the overview has no blank separator rows and the same total as the tab
+    overview = pd.read_csv(csv_paths[1])
+    assert overview["ISIN"].notna().all()
+    total = overview[overview["ISIN"] == "GESAMTSUMME"].iloc[0]
+    assert total["KESt + Soli"] == pytest.approx(4414.985538536341)
+
+
+def test_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    paths = _write(tmp_path, "parquet")
+    csv_paths = _write(tmp_path, "csv")
+    lots = pd.read_parquet(paths[0])
+    assert len(lots) == len(pd.read_csv(csv_paths[0]))
+
+
+@pytest.mark.parametrize("output_format", ["csv", "jsonl"])
+def test_writer_closes_file_on_error(tmp_path, output_format):
+    with pytest.raises(TypeError):
+        TableWriter(tmp_path / "x", ["A"])
+    with (
+        pytest.raises(KeyError),
+        TABLE_WRITERS[output_format](tmp_path / "x", ["A"]) as writer,
+    ):
+        writer.write({"B": 1.0})
+    assert writer.file.closed
@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from engine import EmptySelectionError, PortfolioEngine
+from pyfifovap import (
+    InsufficientSharesError,
+    TaxSettings,
+    UnsupportedFileFormatError,
+)
+from scenarios import build_shock_grid
+
+DATA_DIR = Path(__file__).parent / "data"
+ACC_ETF = "IE00BK5BQT80"
+
+
+def _engine(transactions_file=DATA_DIR / "Alle_Buchungen.csv", **options):
+    return PortfolioEngine.from_files(
+        str(transactions_file),
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+        metadata_file=str(DATA_DIR / "etf_metadaten.csv"),
+        vap_file=str(DATA_DIR / "etf_vorabpauschalen.csv"),
+        offline=True,
+        **options,
+    )
+
+
+def test_many_tax_settings_on_one_state():
+    engine = _engine()
+    plain = engine.overview(TaxSettings())
+    church = engine.overview(TaxSettings(kirche_9=True))
+    assert "KESt + Soli + 9% Kirche" in church.columns
+    total = plain.iloc[-1]
+    assert total["ISIN"] == "GESAMTSUMME"
+    assert church.iloc[-1]["KESt + Soli + 9% Kirche"] == pytest.approx(
+        total["KESt + Soli"] * 0.25 * 1.145 / (0.25 * 1.055)
+    )
+
+    # results are memoized per settings, but callers get their own copy
+    plain.loc[:, "Brutto-Wert"] = 0
+    pd.testing.assert_frame_equal(
+        engine.overview(TaxSettings()), _engine().overview(TaxSettings())
+    )
+
+    # the vectorized values per queue match the overview
+    values = engine.queue_values(TaxSettings())
+    assert values["Brutto-Wert"].sum() == pytest.approx(total["Brutto-Wert"])
+    assert values["KESt + Soli"].sum() == pytest.approx(total["KESt + Soli"])
+
+    scenarios = engine.scenarios(build_shock_grid("0", None), TaxSettings())
+    assert scenarios.iloc[-1]["Netto-Wert"] == pytest.approx(total["Netto-Wert"])
+
+    with pytest.raises(ValueError):
+        TaxSettings(kirche_8=True, kirche_9=True)
+
+
+def test_quotes_override():
+    engine = _engine()
+    values = engine.queue_values()
+    higher = engine.queue_values(quotes={ACC_ETF: 1000.0})
+    is_acc = values["ISIN"] == ACC_ETF
+    assert (higher.loc[is_acc, "Kurs"] == 1000.0).all()
+    assert (higher.loc[is_acc, "Brutto-Wert"] > values.loc[is_acc, "Brutto-Wert"]).all()
+    pd.testing.assert_frame_equal(higher[~is_acc], values[~is_acc])
+    # a one-off quote does not replace the memoized result
+    pd.testing.assert_frame_equal(engine.queue_values(), values)
+
+
+def test_structured_errors(tmp_path):
+    with pytest.raises(EmptySelectionError):
+        _engine(isins={"XX0000000000"})
+
+    unknown_format = tmp_path / "Buchungen.csv"
+    unknown_format.write_text("Tag;Art\n", encoding="utf-8")
+    with pytest.raises(UnsupportedFileFormatError):
+        _engine(unknown_format)
+
+    # selling more shares than were bought
+    transactions = tmp_path / "Alle_Buchungen.csv"
+    lines = (DATA_DIR / "Alle_Buchungen.csv").read_text(encoding="utf-8").splitlines()
+    lines.insert(
+        1,
+        "2026-07-01 00:00:00;Verkauf;Vanguard FTSE All-World Acc ETF;1000;170,00;"
+        "170.000,00;;;170.000,00;Hauptdepot;Hauptdepot Cash;;",
+    )
+    transactions.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    with pytest.raises(InsufficientSharesError, match="Verkauf") as excinfo:
+        _engine(transactions)
+    assert excinfo.value.row["Stück"] == "1000"
@@ -0,0 +1,204 @@
+"""The formula-driven results file must recompute to the same figures as a static run.
+
+No spreadsheet engine is needed: the few constructs written by build_results_file
+(cell and range references, SUM, MAX, IF and arithmetic) are evaluated by a small
+translator to Python expressions.
+"""
+
+import dataclasses
+import datetime
+import re
+from pathlib import Path
+from types import SimpleNamespace
+
+import openpyxl
+import pandas as pd
+import pytest
+from openpyxl.utils.cell import range_boundaries
+from sortedcontainers import SortedList
+
+from pyfifovap import (
+    ETFMetadata,
+    ForexHelper,
+    QuoteCells,
+    SecurityLot,
+    add_lot_formulas,
+    build_results_file,
+    determine_language_from_transactions_file,
+    iter_lot_rows,
+    lot_sheet_columns,
+    lot_sheet_schema,
+    quote_cells_for,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+    read_vap,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+TRANSACTIONS_CSV = str(DATA_DIR / "Alle_Buchungen.csv")
+
+_REFERENCE = re.compile(
+    r"(?:'((?:[^']|'')+)'|([A-Za-zÄÖÜäöü_][\w]*))?!?(\$?[A-Z]+\$?\d+(?::\$?[A-Z]+\$?\d+)?)"
+)
+
+
+class Evaluator:
+    def __init__(self, workbook: openpyxl.Workbook):
+        self.workbook = workbook
+        self.cache = {}
+
+    def cell(self, sheet: str, ref: str):
+        key = (sheet, ref.replace("$", ""))
+        if key not in self.cache:
+            value = self.workbook[sheet][key[1]].value
+            if isinstance(value, str) and value.startswith("="):
+                value = self.evaluate(sheet, value[1:])
+            self.cache[key] = value or 0.0
+        return self.cache[key]
+
+    def range(self, sheet: str, ref: str) -> list:
+        min_col, min_row, max_col, max_row = range_boundaries(ref.replace("$", ""))
+        return [
+            self.cell(sheet, self.workbook[sheet].cell(row, col).coordinate)
+            for row in range(min_row, max_row + 1)
+            for col in range(min_col, max_col + 1)
+        ]
+
+    def evaluate(self, sheet: str, formula: str):
+        def reference(match):
+            quoted, plain, ref = match.groups()
+            target = (quoted or "").replace("''", "'") or plain or sheet
+            method = "range" if ":" in ref else "cell"
+            return f"_.{method}({target!r}, {ref!r})"
+
+        expression = _REFERENCE.sub(reference, formula)
+        expression = re.sub(r"(?<![<>=!])=(?!=)", "==", expression)
+        return eval(
+            expression,
+            {
+                "_": self,
+                "SUM": lambda *args: sum(
+                    sum(a) if isinstance(a, list) else a for a in args
+                ),
+                "MAX": lambda *args: max(args),
+                "IF": lambda condition, a, b: a if condition else b,
+            },
+        )
+
+
+def _inputs():
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(
+        str(DATA_DIR / "etf_vorabpauschalen.csv"), i18n_helper
+    )
+    return portfolio, metadata_by_isin, vap_by_isin_and_year
+
+
+@pytest.mark.parametrize("layout", ["tabs", "tabelle"])
+def test_formulas_recompute_changed_quote(tmp_path, layout):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    portfolio, metadata_by_isin, vap_by_isin_and_year = _inputs()
+    formula_file = tmp_path / "Formeln.xlsx"
+    build_results_file(
+        portfolio,
+        metadata_by_isin,
+        vap_by_isin_and_year,
+        str(formula_file),
+        args,
+        layout=layout,
+        formulas=True,
+    )
+
+    # the Vanguard Acc ETF has lots with gains in both depots; a price drop of 40 %
+    # turns some of them into losses that are offset against the gains
+    isin = "IE00BK5BQT80"
+    new_quote = metadata_by_isin[isin].last_quote_eur * 0.6
+    workbook = openpyxl.load_workbook(formula_file)
+    quotes = workbook["Kurse"]
+    row = next(
+        r for r in range(2, quotes.max_row + 1) if quotes.cell(r, 1).value == isin
+    )
+    quotes.cell(row, 3).value = new_quote
+    evaluator = Evaluator(workbook)
+
+    static_file = tmp_path / "Statisch.xlsx"
+    metadata_by_isin[isin] = dataclasses.replace(
+        metadata_by_isin[isin], last_quote_eur=new_quote
+    )
+    build_results_file(
+        portfolio,
+        metadata_by_isin,
+        vap_by_isin_and_year,
+        str(static_file),
+        args,
+        layout=layout,
+    )
+    static = pd.read_excel(static_file, sheet_name=None)
+
+    overview = workbook["Übersicht"]
+    for r, expected in enumerate(static["Übersicht"].itertuples(index=False), start=2):
+        for c, value in enumerate(expected[3:], start=4):
+            if not pd.isna(value):
+                assert evaluator.cell("Übersicht", overview.cell(r, c).coordinate) == (
+                    pytest.approx(value)
+                ), (r, c)
+
+    lot_sheets = ["Chargen"] if layout == "tabelle" else ["Hauptdepot IE00BK5BQT80"]
+    for sheet_name in lot_sheets:
+        sheet = workbook[sheet_name]
+        headers = [cell.value for cell in sheet[1]]
+        for column in ("Brutto-Wert", "KESt + Soli", "Netto-Wert"):
+            c = headers.index(column) + 1
+            computed = [
+                evaluator.cell(sheet_name, sheet.cell(r, c).coordinate)
+                for r in range(2, sheet.max_row + 1)
+            ]
+            expected = static[sheet_name][column].fillna(0.0).tolist()
+            assert computed == pytest.approx(expected)
+
+
+def _schema_and_columns(isin, lots, metadata_by_isin, vap, args, quote_cells):
+    rows = iter_lot_rows(isin, "Name", lots, metadata_by_isin, vap, args)
+    if quote_cells is not None:
+        rows = add_lot_formulas(rows, isin, quote_cells, args)
+    return (
+        lot_sheet_schema(
+            isin, lots, metadata_by_isin, vap, args, quote_cells is not None
+        ),
+        lot_sheet_columns(rows),
+    )
+
+
+@pytest.mark.parametrize("formulas", [False, True])
+def test_lot_sheet_schema_matches_rows(formulas):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    portfolio, metadata_by_isin, vap_by_isin_and_year = _inputs()
+    quote_cells = quote_cells_for(portfolio, metadata_by_isin) if formulas else None
+    for broker in portfolio:
+        for isin, lots in portfolio[broker].items():
+            schema, columns = _schema_and_columns(
+                isin, lots, metadata_by_isin, vap_by_isin_and_year, args, quote_cells
+            )
+            assert schema == columns, (broker, isin)
+
+    # the lot bought after the last VAP year has the gain column without "nach VAP"
+    lots = SortedList(
+        SecurityLot("X", "Name", datetime.datetime(year, 3, 1), year, 1.0, 10.0, 1.0)
+        for year in (2023, 2025)
+    )
+    vap = {"X": {2023: 0.5, 2024: 0.2}}
+    metadata = {"X": ETFMetadata("Name", "X", 30, 12.0)}
+    quote_cells = QuoteCells({"X": "$C$2"}, {"X": "$D$2"}, "$E$2") if formulas else None
+    schema, columns = _schema_and_columns("X", lots, metadata, vap, args, quote_cells)
+    assert schema == columns
+    assert "KESt-pflichtiger Gewinn nach TFS" in schema
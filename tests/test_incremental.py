@@ -0,0 +1,159 @@
+import os
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import incremental
+from pyfifovap import (
+    ForexHelper,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+ACC_ETF = "IE00BK5BQT80"
+
+
+@pytest.fixture
+def state_and_files(tmp_path, monkeypatch):
+    files = {}
+    for name, file_name in (
+        ("buchungen", "Alle_Buchungen.csv"),
+        ("wertpapiere", "Wertpapiere_(Standard).csv"),
+        ("metadaten", "etf_metadaten.csv"),
+        ("vap", "etf_vorabpauschalen.csv"),
+    ):
+        files[name] = str(shutil.copyfile(DATA_DIR / file_name, tmp_path / file_name))
+    args = SimpleNamespace(**files, isin=None, depot=None, gekauft_ab=None)
+
+    replayed_rows = []
+    replay_transactions = incremental.replay_transactions
+
+    def counting_replay_transactions(*a, **kw):
+        replayed_rows.append(len(a[1]))
+        return replay_transactions(*a, **kw)
+
+    monkeypatch.setattr(
+        incremental, "replay_transactions", counting_replay_transactions
+    )
+    state = incremental.PortfolioState(args, offline=True)
+    replayed_rows.clear()
+    return state, files, replayed_rows
+
+
+def _rewrite(path: str, transform) -> None:
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    stat = os.stat(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(transform(lines))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+
+def _fresh_portfolio(files):
+    i18n_helper = determine_language_from_transactions_file(files["buchungen"])
+    forex_helper = ForexHelper(offline=True)
+    _, name_to_isin = read_etf_metadata(
+        files["metadaten"], i18n_helper, forex_helper, files["wertpapiere"]
+    )
+    return read_transactions_into_portfolio(
+        files["buchungen"], i18n_helper, forex_helper, name_to_isin
+    )
+
+
+def _assert_same_lots(portfolio, expected):
+    def non_empty(p):
+        return {
+            (broker, isin): list(lots)
+            for broker in p
+            for isin, lots in p[broker].items()
+            if lots
+        }
+
+    assert non_empty(portfolio) == non_empty(expected)
+
+
+def test_new_transactions_are_applied_on_top(state_and_files):
+    state, files, replayed_rows = state_and_files
+    # a new export lists the latest transactions on top
+    new_rows = [
+        (
+            "2026-07-02 00:00:00;Verkauf;Vanguard FTSE All-World Acc ETF;7;170,00;"
+            "1.190,00;;;1.190,00;Hauptdepot;Hauptdepot Cash;;\n"
+        ),
+        (
+            "2026-07-01 00:00:00;Kauf;Vanguard FTSE All-World Acc ETF;2;168,00;336,00;"
+            ";;336,00;Nebendepot;Nebendepot Cash;;\n"
+        ),
+    ]
+    _rewrite(files["buchungen"], lambda lines: lines[:1] + new_rows + lines[1:])
+
+    assert state.reload() == ["buchungen"]
+    assert state.changed_isins == {ACC_ETF}
+    assert replayed_rows == [2]
+    _assert_same_lots(state.replayed, _fresh_portfolio(files))
+
+
+def test_changed_transaction_replays_one_security(state_and_files):
+    state, files, replayed_rows = state_and_files
+    _rewrite(
+        files["buchungen"],
+        lambda lines: [
+            line.replace(";5;91,65;458,25;;;458,25;", ";5;81,65;408,25;;;408,25;")
+            for line in lines
+        ],
+    )
+
+    state.reload()
+    assert state.changed_isins == {ACC_ETF}
+    assert len(replayed_rows) == 1
+    with open(files["buchungen"], encoding="utf-8") as f:
+        assert replayed_rows[0] == len([row for row in f if "All-World Acc ETF" in row])
+    _assert_same_lots(state.replayed, _fresh_portfolio(files))
+
+
+def test_new_quote_needs_no_replay(state_and_files):
+    state, files, replayed_rows = state_and_files
+    _rewrite(
+        files["wertpapiere"],
+        lambda lines: [line.replace(";164,80;", ";150,00;") for line in lines],
+    )
+
+    assert state.reload() == ["wertpapiere"]
+    assert replayed_rows == []
+    assert state.changed_isins == {ACC_ETF}
+    assert state.metadata_by_isin[ACC_ETF].last_quote_eur == pytest.approx(150.0)
+
+    prepared_sheets = {("Hauptdepot", ACC_ETF): None, ("Hauptdepot", "X"): None}
+    incremental.drop_changed_sheets(prepared_sheets, state.changed_isins)
+    assert list(prepared_sheets) == [("Hauptdepot", "X")]
+
+
+def test_watch_keeps_running_after_failed_render(monkeypatch):
+    class FakeState:
+        def __init__(self, args, offline):
+            pass
+
+        def reload(self):
+            return ["Alle_Buchungen.csv"]
+
+    errors = iter([None, ValueError("Kein Kurs"), SystemExit(1), None])
+    rendered = []
+
+    def render(state):
+        error = next(errors)
+        if error is not None:
+            raise error
+        rendered.append(state)
+
+    def sleep(interval):
+        if len(rendered) == 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(incremental, "PortfolioState", FakeState)
+    monkeypatch.setattr(incremental.time, "sleep", sleep)
+    incremental.watch(SimpleNamespace(offline=True), render, 1)
+    assert len(rendered) == 2
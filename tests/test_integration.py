@@ -5,16 +5,24 @@ PortfolioPerformance (plus the default ``etf_metadaten.csv``) and are read
 through the same code path as the CLI.
 """
 
+import datetime
+import json
+import os
+import subprocess
+import sys
 from pathlib import Path
 from types import SimpleNamespace
 
+import pandas as pd
 import pytest
 
 from pyfifovap import (
     ForexHelper,
+    build_results_file,
     collect_overview_summary,
     collect_vap_summary,
     determine_language_from_transactions_file,
+    filter_portfolio,
     read_etf_metadata,
     read_transactions_into_portfolio,
     read_vap,
@@ -77,6 +85,46 @@ def test_portfolio_shares_per_account():
     assert normalized == pytest.approx(expected_normalized)
 
 
+def test_portfolio_filters():
+    # replaying only one ISIN yields the same lots as the full replay; the depot and
+    # purchase date filters are applied afterwards
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        METADATA_CSV, i18n_helper, forex_helper, SECURITIES_CSV, {"IE00BK5BQT80"}
+    )
+    assert metadata_by_isin["IE00BK5BQT80"].last_quote_eur == pytest.approx(164.8)
+    assert metadata_by_isin["IE00B3RBWM25"].last_quote_eur is None
+    full = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    selected = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin, {"IE00BK5BQT80"}
+    )
+    assert {(broker, isin) for broker in selected for isin in selected[broker]} == {
+        ("Hauptdepot", "IE00BK5BQT80"),
+        ("Nebendepot", "IE00BK5BQT80"),
+    }
+    for broker in selected:
+        assert list(selected[broker]["IE00BK5BQT80"]) == list(
+            full[broker]["IE00BK5BQT80"]
+        )
+
+    bought_from = datetime.date(2023, 1, 1)
+    filtered = filter_portfolio(full, {"Nebendepot"}, bought_from)
+    assert set(filtered) == {"Nebendepot"}
+    assert all(
+        lot.purchased_date.date() >= bought_from
+        for lots in filtered["Nebendepot"].values()
+        for lot in lots
+    )
+    assert sum(len(lots) for lots in filtered["Nebendepot"].values()) == sum(
+        lot.purchased_date.date() >= bought_from
+        for lots in full["Nebendepot"].values()
+        for lot in lots
+    )
+
+
 def test_vap_summary():
     # Runs the full VAP pipeline on the example CSVs and checks collect_vap_summary.
     i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
@@ -188,3 +236,162 @@ def test_overview_summary():
     assert total["KESt-pflichtiger Gewinn"] == pytest.approx(16739.28166269703)
     assert total["KESt + Soli"] == pytest.approx(4414.985538536341)
     assert total["Netto-Wert"] == pytest.approx(47370.16446146367)
+
+
+def test_results_file(tmp_path):
+    # The results file is streamed row by row (constant memory); read it back and
+    # compare the Infineon sheet and the overview total with the in-memory summaries.
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        METADATA_CSV, i18n_helper, forex_helper, SECURITIES_CSV
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(VAP_CSV, i18n_helper)
+    out_file = tmp_path / "Ergebnisse.xlsx"
+    build_results_file(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, str(out_file), args
+    )
+
+    sheets = pd.read_excel(out_file, sheet_name=None)
+    assert list(sheets)[:2] == ["Übersicht", "VAP"]
+    overview = collect_overview_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, args
+    )
+    assert list(sheets["Übersicht"].columns) == list(overview.columns)
+    total = sheets["Übersicht"][sheets["Übersicht"]["ISIN"] == "GESAMTSUMME"]
+    expected_total = overview[overview["ISIN"] == "GESAMTSUMME"]
+    assert total.iloc[0, 3:].tolist() == pytest.approx(
+        expected_total.iloc[0, 3:].tolist()
+    )
+
+    infineon = sheets["Hauptdepot DE0006231004"]
+    assert list(infineon.columns) == [
+        "ISIN",
+        "Name",
+        "Datum Kauf",
+        "Anzahl (noch unverkauft)",
+        "Anzahl (gekauft)",
+        "Gesamtkosten",
+        "Kosten pro Anteil",
+        "Brutto-Wert",
+        "KESt-pflichtiger Gewinn",
+        "KESt + Soli",
+        "Netto-Wert",
+        "Steueranteil an Brutto-Auszahlung",
+    ]
+    assert infineon["Brutto-Wert"].tolist() == pytest.approx([860.1])
+    assert infineon["KESt + Soli"].tolist() == pytest.approx(
+        [(86.01 - 35.24) * 10 * 0.26375]
+    )
+
+
+def test_results_file_parallel_matches_serial(tmp_path):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        METADATA_CSV, i18n_helper, forex_helper, SECURITIES_CSV
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(VAP_CSV, i18n_helper)
+
+    # serial, parallel and twice with the sheet cache of --watch (filled, then reused)
+    prepared_sheets = {}
+    variants = {
+        "serial": {"processes": 1},
+        "parallel": {"processes": 3},
+        "cache_filled": {"prepared_sheets": prepared_sheets},
+        "cache_reused": {"prepared_sheets": prepared_sheets},
+    }
+    sheets = {}
+    for variant, kwargs in variants.items():
+        out_file = tmp_path / f"Ergebnisse_{variant}.xlsx"
+        build_results_file(
+            portfolio,
+            metadata_by_isin,
+            vap_by_isin_and_year,
+            str(out_file),
+            args,
+            **kwargs,
+        )
+        sheets[variant] = pd.read_excel(out_file, sheet_name=None)
+    assert len(prepared_sheets) == sum(len(lots) for lots in portfolio.values())
+
+    for variant in variants:
+        assert list(sheets[variant]) == list(sheets["serial"])
+        for sheet_name, df in sheets["serial"].items():
+            pd.testing.assert_frame_equal(sheets[variant][sheet_name], df)
+
+
+def test_results_file_single_lots_table(tmp_path):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        METADATA_CSV, i18n_helper, forex_helper, SECURITIES_CSV
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(VAP_CSV, i18n_helper)
+    out_file = tmp_path / "Ergebnisse.xlsx"
+    build_results_file(
+        portfolio,
+        metadata_by_isin,
+        vap_by_isin_and_year,
+        str(out_file),
+        args,
+        layout="tabelle",
+    )
+
+    sheets = pd.read_excel(out_file, sheet_name=None)
+    assert list(sheets) == ["Übersicht", "VAP", "Chargen"]
+    lots = sheets["Chargen"]
+    assert len(lots) == sum(
+        len(portfolio[broker][isin])
+        for broker in portfolio
+        for isin in portfolio[broker]
+    )
+    # fixed year columns for every VAP year, one gain column for all securities
+    assert [column for column in lots.columns if column.startswith("VAP ")] == [
+        "VAP 2023 vor TFS pro Anteil",
+        "VAP 2024 vor TFS pro Anteil",
+        "VAP 2025 vor TFS pro Anteil",
+    ]
+    gains = lots.groupby("Depot")["KESt-pflichtiger Gewinn"].sum()
+    assert gains.sum() == pytest.approx(16739.28166269703)
+
+
+def test_overview_only_json_without_excel_engines():
+    # --nur-uebersicht prints the summaries and never imports an Excel engine
+    repo_dir = Path(__file__).parent.parent
+    code = (
+        "import runpy, sys\n"
+        f"sys.argv = ['main.py', '-b', {TRANSACTIONS_CSV!r}, '-w', {SECURITIES_CSV!r}, "
+        f"'--metadaten', {METADATA_CSV!r}, '--vap', {VAP_CSV!r}, '--offline', "
+        "'--nur-uebersicht', 'json']\n"
+        "runpy.run_path('main.py', run_name='__main__')\n"
+        "loaded = [m for m in ('xlsxwriter', 'openpyxl') if m in sys.modules]\n"
+        "print('EXCEL-ENGINES:', loaded, file=sys.stderr)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=repo_dir,
+        env=os.environ | {"PYTHONPATH": str(repo_dir)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "EXCEL-ENGINES: []" in result.stderr
+    summaries = json.loads(result.stdout)
+    assert all(row["ISIN"] for row in summaries["Übersicht"])
+    total = summaries["Übersicht"][-1]
+    assert total["ISIN"] == "GESAMTSUMME"
+    assert total["KESt + Soli"] == pytest.approx(4414.985538536341)
+    assert summaries["VAP"][-1]["Summe vor TFS"] == pytest.approx(470.84999652500005)
@@ -0,0 +1,176 @@
+import datetime
+from collections import defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sortedcontainers import SortedList
+
+from planning import (
+    SellScheduleSettings,
+    build_queue_views,
+    plan_depot_transfers,
+    plan_rebalancing,
+    simulate_sell_schedule,
+    taxable_gain_of_sale_after_transfer,
+)
+from pyfifovap import ETFMetadata, SecurityLot, build_lot_arrays
+
+TAX_FACTOR = 0.26375
+
+
+def _lot(year, shares, cost_per_share, index):
+    return SecurityLot(
+        security_isin="AAA",
+        security_name="ETF A",
+        purchased_date=datetime.datetime(year, 1, 1),
+        purchased_index=index,
+        purchased_shares=shares,
+        purchased_value=shares * cost_per_share,
+        unsold_shares=shares,
+    )
+
+
+def _queue_views():
+    # Depot A: an old lot with a large gain ahead of a recent lot with a small gain.
+    # Depot B: one lot in between. Quote 100 EUR, no VAP, no TFS.
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["A"]["AAA"].add(_lot(2020, 10, 10.0, 0))
+    portfolio["A"]["AAA"].add(_lot(2024, 10, 90.0, 2))
+    portfolio["B"]["AAA"].add(_lot(2022, 10, 50.0, 1))
+    metadata = {
+        "AAA": ETFMetadata(
+            name="ETF A", isin="AAA", tfs_percentage=0, last_quote_eur=100.0
+        )
+    }
+    lot_arrays = build_lot_arrays(portfolio, metadata, defaultdict(dict))
+    return build_queue_views(lot_arrays)
+
+
+def test_queue_view_sale_after_transfer():
+    views = _queue_views()
+    a, b = views[("A", "AAA")], views[("B", "AAA")]
+
+    # selling 10 from A: the old lot (gain 90/share); after moving 10 shares away: new lot
+    assert a.taxable_gain_of_sale(10.0) == pytest.approx(900.0)
+    assert a.taxable_gain_of_sale(10.0, np.array([0.0, 5.0, 10.0])) == pytest.approx(
+        [900.0, 450.0 + 50.0, 100.0]
+    )
+    assert np.isnan(a.taxable_gain_of_sale(10.0, 15.0))
+
+    # B after receiving 5 old shares from A: those come first (older purchase date)
+    gains = taxable_gain_of_sale_after_transfer(b, a, np.array([0.0, 5.0, 20.0]), 10.0)
+    assert gains == pytest.approx([500.0, 450.0 + 250.0, 900.0])
+
+
+def test_plan_depot_transfers():
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    candidates = plan_depot_transfers(
+        _queue_views(), "AAA", 1000.0, args, num_candidates=20
+    )
+
+    baseline = next(c for c in candidates if c.source_broker == "")
+    assert baseline.sell_broker == "B"
+    assert baseline.taxes == pytest.approx(500.0 * TAX_FACTOR)
+
+    # moving the old lot from A to B leaves the low-gain lot at the head of A
+    best = candidates[0]
+    assert (best.source_broker, best.target_broker) == ("A", "B")
+    assert best.transferred_shares == pytest.approx(10.0)
+    assert best.sell_broker == "A"
+    assert best.taxes == pytest.approx(100.0 * TAX_FACTOR)
+
+
+def _single_queue_views():
+    # one depot, same lots as depot A above: 10 @ 10 EUR (2020), 10 @ 90 EUR (2024)
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["A"]["AAA"].add(_lot(2020, 10, 10.0, 0))
+    portfolio["A"]["AAA"].add(_lot(2024, 10, 90.0, 1))
+    metadata = {
+        "AAA": ETFMetadata(
+            name="ETF A", isin="AAA", tfs_percentage=0, last_quote_eur=100.0
+        )
+    }
+    return build_queue_views(build_lot_arrays(portfolio, metadata, {})), metadata
+
+
+def test_max_shares_within_gain():
+    views, _ = _single_queue_views()
+    view = views[("A", "AAA")]
+    assert view.max_shares_within_gain(950.0) == pytest.approx(15.0)
+    assert view.max_shares_within_gain(450.0) == pytest.approx(5.0)
+    assert view.max_shares_within_gain(50.0, already_removed=10.0) == pytest.approx(5.0)
+    assert view.max_shares_within_gain(1e9) == pytest.approx(20.0)
+
+
+def test_sell_schedule_gain_limit():
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    views, metadata = _single_queue_views()
+    settings = SellScheduleSettings(
+        years=2, max_gain_per_year=950.0, pauschbetrag=1000.0, start_year=2026
+    )
+    schedule = simulate_sell_schedule(views, metadata, {}, settings, args)
+
+    assert schedule[0].sold_shares[("A", "AAA")] == pytest.approx(15.0)
+    assert schedule[0].realized_gains[("A", "AAA")] == pytest.approx(950.0)
+    assert schedule[0].taxes == 0.0
+    # the FIFO state carries over: the remaining 5 shares of the second lot
+    assert schedule[1].sold_shares[("A", "AAA")] == pytest.approx(5.0)
+    assert schedule[1].realized_gains[("A", "AAA")] == pytest.approx(50.0)
+    assert schedule[1].remaining_value == pytest.approx(0.0)
+
+
+def test_sell_schedule_percent_with_vap():
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    views, metadata = _single_queue_views()
+    settings = SellScheduleSettings(
+        years=2,
+        sell_percent_per_year=0.5,
+        pauschbetrag=500.0,
+        expected_return=0.1,
+        basiszins=[0.02],
+        start_year=2026,
+    )
+    # an (empty) VAP entry marks the security as a fund, so VAP is projected
+    schedule = simulate_sell_schedule(views, metadata, {"AAA": {}}, settings, args)
+
+    first, second = schedule
+    assert first.sold_shares[("A", "AAA")] == pytest.approx(10.0)
+    assert first.taxes == pytest.approx((900.0 - 500.0) * TAX_FACTOR)
+    # VAP 2026 (100 * 2 % * 0.7 = 1.4 per share) is credited for the 10 remaining shares
+    assert second.vap_income == pytest.approx(14.0)
+    # sale of 5 shares at 110 EUR, acquisition price 90 + 1.4 VAP
+    assert second.realized_gains[("A", "AAA")] == pytest.approx(5 * (110 - 91.4))
+    assert second.taxes == pytest.approx(0.0)
+
+
+def test_plan_rebalancing_prefers_depot_with_lower_tax():
+    # AAA: depot A holds 10 @ 10 EUR then 10 @ 90 EUR (average gain 50/share, but FIFO
+    # sells the 90/share gain first), depot B holds 10 @ 40 EUR (gain 60/share).
+    # BBB: 10 @ 100 EUR in depot A. Quotes 100 EUR -> AAA 3000 EUR, BBB 1000 EUR.
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["A"]["AAA"].add(_lot(2020, 10, 10.0, 0))
+    portfolio["A"]["AAA"].add(_lot(2024, 10, 90.0, 3))
+    portfolio["B"]["AAA"].add(_lot(2022, 10, 40.0, 1))
+    bbb = _lot(2023, 10, 100.0, 2)
+    bbb.security_isin, bbb.security_name = "BBB", "ETF B"
+    portfolio["A"]["BBB"].add(bbb)
+    metadata = {
+        isin: ETFMetadata(
+            name=f"ETF {isin[0]}", isin=isin, tfs_percentage=0, last_quote_eur=100.0
+        )
+        for isin in ("AAA", "BBB")
+    }
+    views = build_queue_views(build_lot_arrays(portfolio, metadata, defaultdict(dict)))
+    args = SimpleNamespace(kirche_8=False, kirche_9=False, gewinne_vorhanden=False)
+
+    plan = plan_rebalancing(views, {"AAA": 0.5, "BBB": 0.5}, args)
+    assert [(trade.broker, trade.isin) for trade in plan.trades] == [("B", "AAA")]
+    assert plan.trades[0].sold_shares == pytest.approx(10.0)
+    assert plan.trades[0].taxes == pytest.approx(600.0 * TAX_FACTOR)
+    assert plan.purchases == pytest.approx({"AAA": 0.0, "BBB": 1000.0})
+    assert plan.values_after() == pytest.approx({"AAA": 2000.0, "BBB": 2000.0})
+
+    # within a tolerance of 10 percentage points only 600 EUR (up to 60 %) are sold
+    plan = plan_rebalancing(views, {"AAA": 0.5, "BBB": 0.5}, args, tolerance=0.1)
+    assert sum(trade.proceeds for trade in plan.trades) == pytest.approx(600.0)
@@ -0,0 +1,123 @@
+import datetime
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from price_history import PriceHistory, read_price_history
+
+DATA_DIR = Path(__file__).parent / "data"
+REPO_DIR = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def history_csv(tmp_path) -> Path:
+    path = tmp_path / "kurse.csv"
+    path.write_text(
+        "ISIN,Datum,Kurs\n"
+        "IE00BK5BQT80,2019-12-31,80.5\n"
+        "IE00BK5BQT80,2019-01-02,60.0\n"
+        "IE00BK5BQT80,2019-06-28,70.25\n"
+        "US0378331005,2019-12-31,260.0\n"
+        "IE00BK5BQT80,2019-06-28,71.0\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+def test_as_of_lookup(history_csv, tmp_path):
+    history = read_price_history(history_csv)
+    assert history.isins == ["IE00BK5BQT80", "US0378331005"]
+    assert history.price_at("IE00BK5BQT80", datetime.date(2019, 1, 1)) is None
+    assert history.price_at("IE00BK5BQT80", datetime.date(2019, 1, 2)) == 60.0
+    # the last price of a day wins
+    assert history.price_at("IE00BK5BQT80", datetime.date(2019, 9, 30)) == 71.0
+    assert history.price_at("IE00BK5BQT80", datetime.date(2030, 1, 1)) == 80.5
+    assert history.price_at("DE0000000000", datetime.date(2019, 9, 30)) is None
+    np.testing.assert_array_equal(
+        history.prices_at(
+            "IE00BK5BQT80", [datetime.date(2018, 1, 1), datetime.date(2019, 7, 1)]
+        ),
+        [np.nan, 71.0],
+    )
+    assert history.quotes_at(datetime.date(2019, 6, 30)) == {"IE00BK5BQT80": 71.0}
+
+    history.save(tmp_path / "index")
+    loaded = read_price_history(tmp_path / "index")
+    assert isinstance(loaded.days, np.memmap)
+    assert loaded.ranges == history.ranges
+    assert loaded.price_at("US0378331005", datetime.date(2020, 1, 1)) == 260.0
+
+
+def test_quote_exports(tmp_path):
+    exports = tmp_path / "Kurse"
+    exports.mkdir()
+    (exports / "IE00BK5BQT80.csv").write_text(
+        "Datum;Kurs\n2019-12-30;1.080,50\n2019-12-31;1.081,00\n", encoding="utf-8"
+    )
+    (exports / "US0378331005.csv").write_text(
+        'Date,Quote\n2019-12-31,"1,293.65"\n', encoding="utf-8"
+    )
+    history = read_price_history(exports)
+    assert history.price_at("IE00BK5BQT80", datetime.date(2019, 12, 30)) == 1080.5
+    assert history.price_at("US0378331005", datetime.date(2020, 1, 1)) == 1293.65
+
+    (tmp_path / "leer").mkdir()
+    with pytest.raises(ValueError):
+        read_price_history(tmp_path / "leer")
+
+
+def test_empty_history():
+    history = PriceHistory.from_frame(pd.DataFrame(columns=["ISIN", "Datum", "Kurs"]))
+    assert history.isins == []
+
+
+def test_stichtag_with_price_history(history_csv, tmp_path):
+    def overview(*extra: str) -> pd.DataFrame:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "main.py",
+                "-b",
+                str(DATA_DIR / "Alle_Buchungen.csv"),
+                "-w",
+                str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+                "--metadaten",
+                str(DATA_DIR / "etf_metadaten.csv"),
+                "--vap",
+                str(DATA_DIR / "etf_vorabpauschalen.csv"),
+                "--offline",
+                "--format",
+                "csv",
+                "-o",
+                str(tmp_path / "Ergebnisse.xlsx"),
+                "--stichtag",
+                "2019-12-31",
+                *extra,
+            ],
+            cwd=REPO_DIR,
+            env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        assert result.returncode == 0, result.stderr
+        df = pd.read_csv(tmp_path / "Ergebnisse_2019-12-31_chargen.csv")
+        return df.set_index(["Depot", "ISIN", "Datum Kauf"])
+
+    current = overview()
+    historical = overview("--kurshistorie", str(history_csv))
+    quotes = historical["Brutto-Wert"] / historical["Anzahl (noch unverkauft)"]
+    assert quotes.xs("IE00BK5BQT80", level="ISIN").to_numpy() == pytest.approx(80.5)
+    assert quotes.xs("US0378331005", level="ISIN").to_numpy() == pytest.approx(260.0)
+    # securities without a historical price keep the current quote
+    other = ~current.index.get_level_values("ISIN").isin(
+        ["IE00BK5BQT80", "US0378331005"]
+    )
+    pd.testing.assert_series_equal(
+        historical["Brutto-Wert"][other], current["Brutto-Wert"][other]
+    )
@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import profiling
+
+DATA_DIR = Path(__file__).parent / "data"
+REPO_DIR = Path(__file__).parent.parent
+
+
+def test_nested_stages_and_counters():
+    profiling.counters["vor_dem_start"] += 1
+
+    @profiling.stage("innen")
+    def inner():
+        profiling.counters["ereignis"] += 1
+        return bytearray(4 * 2**20)
+
+    profile = profiling.start()
+    try:
+        with profiling.stage("aussen"):
+            inner()
+            inner()
+            time.sleep(0.01)
+        inner()
+    finally:
+        assert profiling.stop() is profile
+
+    assert list(profile.stages) == ["aussen", "aussen/innen", "innen"]
+    assert profile.stages["aussen/innen"].calls == 2
+    assert profile.stages["aussen"].seconds >= 0.01
+    assert profile.stages["aussen"].seconds > profile.stages["aussen/innen"].seconds
+    # the peak of the nested stage is also the peak of the enclosing one
+    assert profile.stages["aussen/innen"].peak_bytes >= 4 * 2**20
+    assert profile.stages["aussen"].peak_bytes >= 4 * 2**20
+    assert profile.counters == {"ereignis": 3}
+
+    report = profile.report()
+    assert report["schritte"]["aussen/innen"]["aufrufe"] == 2
+    assert "  innen" in profile.format_report()
+
+    # without an active profile, stages are not recorded
+    with profiling.stage("aussen"):
+        pass
+    assert profile.stages["aussen"].calls == 1
+
+
+def test_profile_option(tmp_path):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "main.py",
+            "-b",
+            str(DATA_DIR / "Alle_Buchungen.csv"),
+            "-w",
+            str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+            "--metadaten",
+            str(DATA_DIR / "etf_metadaten.csv"),
+            "--vap",
+            str(DATA_DIR / "etf_vorabpauschalen.csv"),
+            "--offline",
+            "-o",
+            str(tmp_path / "Ergebnisse.xlsx"),
+            "--profile",
+            str(tmp_path / "profil.json"),
+        ],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "fifo_replay" in result.stderr
+
+    report = json.loads((tmp_path / "profil.json").read_text(encoding="utf-8"))
+    stages = report["schritte"]
+    for stage in ("buchungen_einlesen", "fifo_replay", "xlsx_schreiben"):
+        assert stages[stage]["aufrufe"] == 1
+    assert stages["xlsx_schreiben/uebersicht_berechnen"]["aufrufe"] == 1
+    assert report["gesamt"]["sekunden"] >= stages["xlsx_schreiben"]["sekunden"]
+
+    counters = report["zaehler"]
+    transactions = (DATA_DIR / "Alle_Buchungen.csv").read_text(encoding="utf-8")
+    assert counters["buchungszeilen"] == len(transactions.splitlines()) - 1
+    assert counters["chargen_angelegt"] > 0
+    assert counters["tabs_geschrieben"] > 1
+    assert counters["zellen_geschrieben"] > counters["chargen_angelegt"]
+    # offline: no Forex rate is requested from the network
+    assert "netzwerk_abfragen" not in counters
+
+
+@pytest.mark.parametrize("option", ["--server", "--watch"])
+def test_profile_needs_a_finite_run(option):
+    result = subprocess.run(
+        [sys.executable, "main.py", "-b", "x.csv", "-w", "y.csv", option, "--profile"],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 2
+    assert "--profile" in result.stderr
@@ -0,0 +1,86 @@
+import datetime
+from collections import defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sortedcontainers import SortedList
+
+from projection import (
+    ProjectionSettings,
+    collect_projection_summary,
+    project_lots,
+    vap_per_share_before_tfs,
+)
+from pyfifovap import ETFMetadata, SecurityLot, build_lot_arrays
+
+ARGS = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+TAX_FACTOR = 0.26375
+
+
+def _lot_arrays():
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["Depot"]["FUND"].add(
+        SecurityLot(
+            security_isin="FUND",
+            security_name="Fonds",
+            purchased_date=datetime.datetime(2020, 1, 1),
+            purchased_index=0,
+            purchased_shares=10,
+            purchased_value=500.0,
+            unsold_shares=10,
+        )
+    )
+    metadata = {
+        "FUND": ETFMetadata(
+            name="Fonds", isin="FUND", tfs_percentage=30, last_quote_eur=100.0
+        )
+    }
+    return build_lot_arrays(portfolio, metadata, defaultdict(dict)), metadata
+
+
+def test_vap_per_share_before_tfs():
+    prices = np.array([[100.0, 110.0, 109.0], [100.0, 101.0, 120.0]])
+    vap = vap_per_share_before_tfs(prices, np.array([0.02, 0.02]))
+    # Basisertrag 100 * 2 % * 0.7 = 1.4; capped by the value gain, never negative
+    assert vap[0] == pytest.approx([1.4, 0.0])
+    assert vap[1] == pytest.approx([1.0, 101 * 0.02 * 0.7])
+
+
+def test_project_lots_deterministic_path():
+    lot_arrays, metadata = _lot_arrays()
+    # no volatility: every path grows by the same log return of 0.1 per year
+    settings = ProjectionSettings(
+        years=2,
+        num_paths=3,
+        seed=0,
+        expected_return=0.1,
+        volatility=0.0,
+        basiszins=[0.02],
+        start_year=2026,
+    )
+    result = project_lots(lot_arrays, metadata, defaultdict(dict), settings, ARGS)
+
+    vap_per_share = 100 * 0.02 * 0.7 + 100 * np.exp(0.1) * 0.02 * 0.7
+    exit_price = 100 * np.exp(0.1) ** 2
+    gain = (exit_price - 50 - vap_per_share) * 10 * 0.7
+    vap_taxes = vap_per_share * 10 * 0.7 * TAX_FACTOR
+    assert result.per_queue["vap"][0] == pytest.approx([vap_per_share * 7] * 3)
+    assert result.per_queue["steuer"][0] == pytest.approx([gain * TAX_FACTOR] * 3)
+    assert result.per_queue["netto"][0] == pytest.approx(
+        [exit_price * 10 - gain * TAX_FACTOR - vap_taxes] * 3
+    )
+
+
+def test_projection_seed_is_reproducible():
+    lot_arrays, metadata = _lot_arrays()
+    settings = ProjectionSettings(years=5, num_paths=200, seed=42, start_year=2026)
+    first = project_lots(lot_arrays, metadata, defaultdict(dict), settings, ARGS)
+    second = project_lots(lot_arrays, metadata, defaultdict(dict), settings, ARGS)
+    assert np.array_equal(first.per_queue["netto"], second.per_queue["netto"])
+
+    df = collect_projection_summary(first, ARGS)
+    total = df[
+        (df["ISIN"] == "GESAMTSUMME") & (df["Kennzahl"] == "Brutto-Wert bei Ausstieg")
+    ]
+    assert total.iloc[0]["P5"] <= total.iloc[0]["P50"] <= total.iloc[0]["P95"]
@@ -4,6 +4,7 @@ import logging
 import math
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 import pytest
 import yfinance
@@ -13,10 +14,12 @@ from i18n_helper import I18nHelper
 from pyfifovap import (
     ETFMetadata,
     ForexHelper,
+    IsinConflictError,
     SecurityLot,
     collect_vap_summary,
     determine_tax_factor_and_header,
     determine_taxable_gains_to_consider,
+    fifo_taxable_gains_to_consider,
     parse_money_to_eur,
     resolve_isin_for_transaction,
     warn_about_isin_name_collisions,
@@ -59,6 +62,34 @@ def test_gewinnverrechnung():
     )
 
 
+def test_fifo_taxable_gains_to_consider_matches_scalar():
+    @dataclasses.dataclass
+    class ArgsMock:
+        gewinne_vorhanden: bool = False
+
+    # two queues back to back: the loss offset must restart at the second queue
+    queues = [[-100.0, 300.0, -500.0, 50.0, 400.0], [200.0, -700.0, 100.0]]
+    expected = []
+    for gains in queues:
+        previous = 0.0
+        for gain in gains:
+            expected.append(
+                determine_taxable_gains_to_consider(previous, gain, ArgsMock())
+            )
+            previous += gain
+
+    all_gains = np.array([gain for gains in queues for gain in gains])
+    result = fifo_taxable_gains_to_consider(all_gains, False, np.array([0, 5]))
+    assert result == pytest.approx(expected)
+
+    # extra axes (e.g. price scenarios) are carried along
+    stacked = np.stack([all_gains, 2 * all_gains], axis=1)
+    result = fifo_taxable_gains_to_consider(stacked, False, np.array([0, 5]))
+    assert result[:, 1] == pytest.approx([2 * value for value in expected])
+
+    assert fifo_taxable_gains_to_consider(all_gains, True) == pytest.approx(all_gains)
+
+
 def test_parse_money_to_eur_foreign_currency(monkeypatch):
     # flip to True to run without network: stub the Yahoo Finance lookup instead of
     # hitting the live historical EURUSD rate. May be an issue with rate-limiting by Yahoo.
@@ -228,7 +259,7 @@ def test_resolve_isin_for_transaction():
     # name not in the securities file -> dropped (None)
     assert resolve_isin_for_transaction("Unbekannt", "", name_to_isin) is None
     # transaction-row ISIN conflicts with the securities file -> abort
-    with pytest.raises(SystemExit):
+    with pytest.raises(IsinConflictError, match="ZZZ"):
         resolve_isin_for_transaction("ETF A", "ZZZ", name_to_isin)
 
 
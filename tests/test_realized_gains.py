@@ -0,0 +1,138 @@
+import datetime
+from collections import defaultdict
+from pathlib import Path
+
+import pytest
+from sortedcontainers import SortedList
+
+import realized_gains
+from i18n_helper import I18nHelper
+from pyfifovap import (
+    ETFMetadata,
+    ForexHelper,
+    SecurityLot,
+    collect_realized_gains_summary,
+    determine_language_from_transactions_file,
+    handle_portfolio_sale,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+ISIN = "IE00BK5BQT80"
+
+
+def _lot(date: str, index: int, shares: float, value: float) -> SecurityLot:
+    return SecurityLot(
+        security_isin=ISIN,
+        security_name="Vanguard FTSE All-World Acc ETF",
+        purchased_date=datetime.datetime.fromisoformat(date),
+        purchased_index=index,
+        purchased_shares=shares,
+        purchased_value=value,
+        unsold_shares=shares,
+    )
+
+
+def test_sale_records_consumed_lots_with_vap_and_tfs():
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["Depot"][ISIN].update(
+        [_lot("2022-10-05", 1, 10, 800.0), _lot("2023-01-10", 2, 10, 900.0)]
+    )
+    ledger = realized_gains.RealizedGainsLedger()
+    row = {
+        "Typ": "Verkauf",
+        "Datum": "2024-05-02 00:00:00",
+        "Stück": "15",
+        "Wertpapier": "Vanguard FTSE All-World Acc ETF",
+        "Konto": "Depot",
+        "Gesamtpreis": "1.650,00",
+        "Index": 7,
+    }
+    handle_portfolio_sale(
+        portfolio, row, ISIN, I18nHelper(is_german=True), ForexHelper(True), ledger
+    )
+    assert [(entry.lot.purchased_index, entry.shares) for entry in ledger.entries] == [
+        (1, 10),
+        (2, 5),
+    ]
+    assert portfolio["Depot"][ISIN][0].unsold_shares == 5
+
+    vap = defaultdict(
+        lambda: defaultdict(float), {ISIN: {2022: 1.2, 2023: 2.0, 2024: 3.0}}
+    )
+    metadata = {ISIN: ETFMetadata("Vanguard FTSE All-World Acc ETF", ISIN, 30)}
+    df = collect_realized_gains_summary(ledger, metadata, vap)
+    assert df["Erlös"].to_numpy() == pytest.approx([1100.0, 550.0])
+    assert df["Kosten"].to_numpy() == pytest.approx([800.0, 450.0])
+    # VAP 2024 is not levied before the sale; 2022 for 3/12 of the year (bought in October)
+    assert df["VAP vor TFS"].to_numpy() == pytest.approx(
+        [10 * (1.2 * 3 / 12 + 2.0), 5 * 2.0]
+    )
+    assert df["Gewinn vor TFS"].to_numpy() == pytest.approx([277.0, 90.0])
+    assert df["KESt-pflichtiger Gewinn"].to_numpy() == pytest.approx([193.9, 63.0])
+    assert list(df["Datum Verkauf"]) == [datetime.date(2024, 5, 2)] * 2
+
+    assert collect_realized_gains_summary(ledger, metadata, vap, {"Andere"}).empty
+    assert (
+        len(
+            collect_realized_gains_summary(
+                ledger, metadata, vap, bought_from=datetime.date(2023, 1, 1)
+            )
+        )
+        == 1
+    )
+
+
+def test_proceeds_include_withheld_taxes():
+    portfolio = defaultdict(lambda: defaultdict(SortedList))
+    portfolio["Depot"][ISIN].add(_lot("2022-10-05", 1, 10, 800.0))
+    ledger = realized_gains.RealizedGainsLedger()
+    # Betrag 1.010,00 - Gebühren 10,00 - Steuern 52,75 = Gesamtpreis 947,25
+    row = {
+        "Typ": "Verkauf",
+        "Datum": "2024-05-02 00:00:00",
+        "Stück": "10",
+        "Wertpapier": "Vanguard FTSE All-World Acc ETF",
+        "Konto": "Depot",
+        "Gebühren": "10,00",
+        "Steuern": "52,75",
+        "Gesamtpreis": "947,25",
+        "Index": 7,
+    }
+    handle_portfolio_sale(
+        portfolio, row, ISIN, I18nHelper(is_german=True), ForexHelper(True), ledger
+    )
+    df = collect_realized_gains_summary(ledger, {}, defaultdict(dict))
+    assert df["Erlös"].to_numpy() == pytest.approx([1000.0])
+    assert df["Gewinn vor TFS"].to_numpy() == pytest.approx([200.0])
+
+
+def test_ledger_from_replay():
+    i18n_helper = determine_language_from_transactions_file(
+        str(DATA_DIR / "Alle_Buchungen.csv")
+    )
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    ledger = realized_gains.start()
+    try:
+        read_transactions_into_portfolio(
+            str(DATA_DIR / "Alle_Buchungen.csv"),
+            i18n_helper,
+            forex_helper,
+            name_to_isin,
+        )
+    finally:
+        assert realized_gains.stop() is ledger
+    assert realized_gains.current() is None
+
+    df = collect_realized_gains_summary(ledger, metadata_by_isin, defaultdict(dict))
+    sale = df[(df["Depot"] == "Nebendepot") & (df["ISIN"] == ISIN)]
+    assert sale["Anzahl verkauft"].sum() == pytest.approx(5)
+    assert sale["Erlös"].sum() == pytest.approx(533.90)
+    assert (df["Datum Verkauf"] >= df["Datum Kauf"]).all()
@@ -0,0 +1,130 @@
+import json
+import logging
+from collections import defaultdict
+from pathlib import Path
+
+import pytest
+
+import pyfifovap
+import replay_trace
+from pyfifovap import (
+    ForexHelper,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _replay():
+    i18n_helper = determine_language_from_transactions_file(
+        str(DATA_DIR / "Alle_Buchungen.csv")
+    )
+    forex_helper = ForexHelper(offline=True)
+    _, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    return read_transactions_into_portfolio(
+        str(DATA_DIR / "Alle_Buchungen.csv"), i18n_helper, forex_helper, name_to_isin
+    )
+
+
+def test_trace_reproduces_the_portfolio(tmp_path):
+    trace = replay_trace.start(tmp_path / "protokoll.jsonl")
+    try:
+        portfolio = _replay()
+    finally:
+        assert replay_trace.stop() is trace
+    records = [
+        json.loads(line)
+        for line in (tmp_path / "protokoll.jsonl").read_text("utf-8").splitlines()
+    ]
+    assert len(records) == trace.records > 0
+
+    # applying the before/after shares of all records yields the final lots
+    shares = defaultdict(float)
+    for record in records:
+        for lot in record["chargen"]:
+            key = (lot["depot"], record["isin"], lot["kaufzeile"])
+            assert shares[key] == pytest.approx(lot["vorher"])
+            shares[key] = lot["nachher"]
+    expected = {
+        (depot, isin, lot.purchased_index): lot.unsold_shares
+        for depot in portfolio
+        for isin, lots in portfolio[depot].items()
+        for lot in lots
+    }
+    assert {key: value for key, value in shares.items() if value > 1e-9} == (
+        pytest.approx(expected)
+    )
+
+    actions = {record["aktion"] for record in records}
+    assert {"kauf", "verkauf", "uebertrag"} <= actions
+    for record in records:
+        moved = sum(lot["vorher"] - lot["nachher"] for lot in record["chargen"])
+        if record["aktion"] == "verkauf":
+            assert moved == pytest.approx(float(record["stueck"].replace(",", ".")))
+        elif record["aktion"] == "uebertrag":
+            # transferred lots change the depot, the shares are kept
+            assert moved == pytest.approx(0.0, abs=1e-9)
+
+
+def test_no_row_formatting_without_trace_and_debug(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Zeile formatiert")
+
+    monkeypatch.setattr(pyfifovap, "pformat", fail)
+    assert logging.getLogger().getEffectiveLevel() > logging.DEBUG
+    assert replay_trace.current() is None
+    _replay()
+
+
+def test_lot_transferred_back_is_traced_once(tmp_path):
+    transactions = tmp_path / "Alle_Buchungen.csv"
+    transactions.write_text(
+        "Datum;Typ;Wertpapier;Stück;Kurs;Betrag;Gebühren;Steuern;Gesamtpreis;Konto;"
+        "Gegenkonto;Notiz;Quelle\n"
+        "2024-04-02 00:00:00;Verkauf;Apple Inc.;6;170,00;1.020,00;;;1.020,00;"
+        "Hauptdepot;Hauptdepot Cash;;\n"
+        "2024-03-01 00:00:00;Umbuchung (Ausgang);Apple Inc.;4;160,00;640,00;;;640,00;"
+        "Nebendepot;Hauptdepot;;\n"
+        "2024-02-01 00:00:00;Umbuchung (Ausgang);Apple Inc.;4;160,00;640,00;;;640,00;"
+        "Hauptdepot;Nebendepot;;\n"
+        "2024-01-02 00:00:00;Kauf;Apple Inc.;10;150,00;1.500,00;;;1.500,00;"
+        "Hauptdepot;Hauptdepot Cash;;\n",
+        encoding="utf-8",
+    )
+    i18n_helper = determine_language_from_transactions_file(str(transactions))
+    forex_helper = ForexHelper(offline=True)
+    _, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    replay_trace.start(tmp_path / "protokoll.jsonl")
+    try:
+        read_transactions_into_portfolio(
+            str(transactions), i18n_helper, forex_helper, name_to_isin
+        )
+    finally:
+        replay_trace.stop()
+    records = [
+        json.loads(line)
+        for line in (tmp_path / "protokoll.jsonl").read_text("utf-8").splitlines()
+    ]
+    shares = [
+        [(lot["depot"], lot["vorher"], lot["nachher"]) for lot in record["chargen"]]
+        for record in records
+    ]
+    assert shares == [
+        [("Hauptdepot", 0.0, 10.0)],
+        [("Hauptdepot", 10.0, 6.0), ("Nebendepot", 0.0, 4.0)],
+        # the transferred part joins the rest of the lot again
+        [("Hauptdepot", 6.0, 10.0), ("Nebendepot", 4.0, 0.0)],
+        [("Hauptdepot", 10.0, 4.0)],
+    ]
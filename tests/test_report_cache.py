@@ -0,0 +1,104 @@
+import datetime
+import os
+import shutil
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+
+import main
+from pyfifovap import (
+    ForexHelper,
+    collect_overview_summary,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+    read_vap,
+)
+from report_cache import ReportCache, cache_digest
+
+DATA_DIR = Path(__file__).parent / "data"
+TRANSACTIONS_CSV = str(DATA_DIR / "Alle_Buchungen.csv")
+
+
+def _inputs():
+    i18n_helper = determine_language_from_transactions_file(TRANSACTIONS_CSV)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    portfolio = read_transactions_into_portfolio(
+        TRANSACTIONS_CSV, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(
+        str(DATA_DIR / "etf_vorabpauschalen.csv"), i18n_helper
+    )
+    return portfolio, metadata_by_isin, vap_by_isin_and_year
+
+
+def test_cache_digest_depends_on_contents_and_options(tmp_path):
+    copy = tmp_path / "Kopie.csv"
+    shutil.copyfile(TRANSACTIONS_CSV, copy)
+    key = cache_digest([TRANSACTIONS_CSV], {"kirche_9": False})
+    assert cache_digest([str(copy)], {"kirche_9": False}) == key
+    assert cache_digest([str(copy)], {"kirche_9": True}) != key
+    copy.write_text(copy.read_text(encoding="utf-8") + "\n", encoding="utf-8")
+    assert cache_digest([str(copy)], {"kirche_9": False}) != key
+
+
+def test_cached_inputs_give_same_results(tmp_path):
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=True)
+    portfolio, metadata_by_isin, vap_by_isin_and_year = _inputs()
+    cache = ReportCache(tmp_path / "cache", max_bytes=10**7)
+    assert cache.load_inputs("abc") is None
+    cache.store_inputs("abc", portfolio, metadata_by_isin, vap_by_isin_and_year)
+
+    cached = cache.load_inputs("abc")
+    pd.testing.assert_frame_equal(
+        collect_overview_summary(*cached, args),
+        collect_overview_summary(
+            portfolio, metadata_by_isin, vap_by_isin_and_year, args
+        ),
+    )
+    # the restored structures behave like freshly read ones
+    cached_portfolio, _, cached_vap = cached
+    assert len(cached_portfolio["Neues Depot"]["IE00BK5BQT80"]) == 0
+    assert cached_vap["IE00BK5BQT80"][1999] == 0.0
+
+
+def test_report_restore_and_eviction(tmp_path):
+    cache = ReportCache(tmp_path / "cache", max_bytes=2500)
+    report = tmp_path / "Ergebnisse.xlsx"
+    report.write_bytes(b"x" * 1000)
+    cache.store_report("alt", [report])
+    os.utime(cache.directory / "alt", (1, 1))
+    cache.store_report("neu", [report])
+    report.unlink()
+
+    assert cache.restore_report("alt") == [report]
+    assert report.read_bytes() == b"x" * 1000
+    os.utime(cache.directory / "neu", (1, 1))
+
+    # the third entry exceeds the size cap: the least recently used one is removed
+    cache.store_report("neuer", [report])
+    assert cache.restore_report("neu") is None
+    assert cache.restore_report("alt") == [report]
+    assert cache.restore_report("neuer") == [report]
+
+
+def test_report_options_include_year_of_sell_schedule(monkeypatch):
+    def options(*argv):
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["main.py", "--buchungen", "b.csv", "--wertpapiere", "w.csv", *argv],
+        )
+        return main.report_options(main.parse_args())
+
+    assert "auswertungsjahr" not in options()
+    for argv in (["--verkaufsplan", "3"], ["--projektion", "3"]):
+        assert options(*argv)["auswertungsjahr"] == datetime.date.today().year
@@ -0,0 +1,91 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pyfifovap import (
+    ForexHelper,
+    collect_overview_summary,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+    read_vap,
+)
+from scenarios import build_shock_grid, collect_scenario_summary, parse_shock_range
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _load_example_data():
+    transactions_csv = str(DATA_DIR / "Alle_Buchungen.csv")
+    i18n_helper = determine_language_from_transactions_file(transactions_csv)
+    forex_helper = ForexHelper(offline=True)
+    metadata_by_isin, name_to_isin = read_etf_metadata(
+        str(DATA_DIR / "etf_metadaten.csv"),
+        i18n_helper,
+        forex_helper,
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+    )
+    portfolio = read_transactions_into_portfolio(
+        transactions_csv, i18n_helper, forex_helper, name_to_isin
+    )
+    vap_by_isin_and_year = read_vap(
+        str(DATA_DIR / "etf_vorabpauschalen.csv"), i18n_helper
+    )
+    return portfolio, metadata_by_isin, vap_by_isin_and_year
+
+
+def test_parse_shock_range():
+    assert parse_shock_range("-30:30:10") == pytest.approx(
+        [-0.3, -0.2, -0.1, 0.0, 0.1, 0.2, 0.3]
+    )
+    assert parse_shock_range("-5") == pytest.approx([-0.05])
+    with pytest.raises(ValueError):
+        parse_shock_range("10:-10:1")
+    with pytest.raises(ValueError):
+        build_shock_grid("-10:10:10", ["AAA=-10:0:10"])  # 3 vs. 2 scenarios
+
+
+def test_scenarios_match_overview():
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    portfolio, metadata_by_isin, vap_by_isin_and_year = _load_example_data()
+    overview = collect_overview_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, args
+    )
+    shock_grid = build_shock_grid("-20:20:20", None)
+    df = collect_scenario_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, shock_grid, args
+    )
+
+    # the 0 % scenario reproduces the overview, per security and in total
+    unchanged = df[df["Szenario"] == 2]
+    for column in ("Brutto-Wert", "KESt-pflichtiger Gewinn", "KESt + Soli"):
+        expected = overview[overview["ISIN"] == "GESAMTSUMME"].iloc[0][column]
+        total = unchanged[unchanged["ISIN"] == "GESAMTSUMME"].iloc[0][column]
+        assert total == pytest.approx(expected)
+    infineon = unchanged[
+        (unchanged["ISIN"] == "DE0006231004") & (unchanged["Depot"] == "Hauptdepot")
+    ].iloc[0]
+    assert infineon["KESt + Soli"] == pytest.approx((86.01 - 35.24) * 10 * 0.26375)
+
+    # gross value scales linearly with the shock
+    totals = df[df["ISIN"] == "GESAMTSUMME"]["Brutto-Wert"].to_numpy()
+    assert totals == pytest.approx(51785.15 * np.array([0.8, 1.0, 1.2]))
+
+
+def test_scenario_per_isin_grid():
+    args = SimpleNamespace(gewinne_vorhanden=False, kirche_8=False, kirche_9=False)
+    portfolio, metadata_by_isin, vap_by_isin_and_year = _load_example_data()
+    # only Infineon is shocked; it drops below its cost in the second scenario
+    shock_grid = build_shock_grid(None, ["DE0006231004=-60:0:60"])
+    df = collect_scenario_summary(
+        portfolio, metadata_by_isin, vap_by_isin_and_year, shock_grid, args
+    )
+    infineon = df[df["ISIN"] == "DE0006231004"]
+    assert list(infineon["Kursänderung"]) == pytest.approx([-0.6, 0.0])
+    # 86.01 * 0.4 = 34.40 < 35.24 cost per share -> loss, no tax refund without prior gains
+    assert infineon.iloc[0]["KESt-pflichtiger Gewinn"] < 0
+    assert infineon.iloc[0]["KESt + Soli"] == 0
+    apple = df[(df["ISIN"] == "US0378331005") & (df["Depot"] == "Hauptdepot")]
+    assert apple.iloc[0]["Brutto-Wert"] == pytest.approx(apple.iloc[1]["Brutto-Wert"])
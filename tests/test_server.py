@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import incremental
+import server
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def running_server(tmp_path, monkeypatch):
+    files = {}
+    for name, file_name in (
+        ("buchungen", "Alle_Buchungen.csv"),
+        ("wertpapiere", "Wertpapiere_(Standard).csv"),
+        ("metadaten", "etf_metadaten.csv"),
+        ("vap", "etf_vorabpauschalen.csv"),
+    ):
+        files[name] = str(shutil.copyfile(DATA_DIR / file_name, tmp_path / file_name))
+    args = SimpleNamespace(
+        **files,
+        gewinne_vorhanden=False,
+        kirche_8=False,
+        kirche_9=False,
+        isin=None,
+        depot=None,
+        gekauft_ab=None,
+    )
+
+    replays = []
+    replay_transactions = incremental.replay_transactions
+
+    def counting_replay_transactions(*a, **kw):
+        replays.append(len(a[1]))
+        return replay_transactions(*a, **kw)
+
+    monkeypatch.setattr(
+        incremental, "replay_transactions", counting_replay_transactions
+    )
+    httpd = server.create_server(args, 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    yield f"http://{host}:{port}", files, replays
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_queries(running_server):
+    base_url, _, _ = running_server
+    assert base_url.startswith("http://127.0.0.1:")
+
+    status, overview = _get(f"{base_url}/uebersicht")
+    assert status == 200
+    assert overview["Übersicht"][-1]["ISIN"] == "GESAMTSUMME"
+
+    status, lots = _get(f"{base_url}/chargen?depot=Nebendepot&isin=IE00BK5BQT80")
+    assert status == 200
+    assert sum(lot["Anzahl (noch unverkauft)"] for lot in lots["Chargen"]) == (
+        pytest.approx(5.0)
+    )
+
+    # selling the whole queue costs the taxes shown in the overview
+    status, sale = _get(
+        f"{base_url}/verkauf?isin=IE00BK5BQT80&depot=Nebendepot&anteile=5"
+    )
+    assert status == 200
+    queue_row = next(
+        row
+        for row in overview["Übersicht"]
+        if row["ISIN"] == "IE00BK5BQT80" and row["Depot"] == "Nebendepot"
+    )
+    assert sale["Summe"]["KESt + Soli"] == pytest.approx(queue_row["KESt + Soli"])
+
+    status, sale = _get(f"{base_url}/verkauf?isin=IE00BK5BQT80&betrag=1000")
+    assert status == 200
+    assert sale["Summe"]["Brutto-Erlös"] == pytest.approx(1000.0)
+
+    status, scenarios = _get(f"{base_url}/szenarien?raster=-10:10:10")
+    assert status == 200
+    totals = [row for row in scenarios["Szenarien"] if row["ISIN"] == "GESAMTSUMME"]
+    assert [row["Kursänderung"] for row in totals] == pytest.approx([-0.1, 0.0, 0.1])
+
+    assert _get(f"{base_url}/verkauf?isin=IE00BK5BQT80&anteile=1")[0] == 400
+    assert _get(f"{base_url}/verkauf?isin=IE00BK5BQT80")[0] == 400
+    assert _get(f"{base_url}/chargen?depot=X&isin=IE00BK5BQT80")[0] == 400
+    assert _get(f"{base_url}/unbekannt")[0] == 404
+
+
+def test_reload_only_changed_inputs(running_server):
+    base_url, files, replays = running_server
+    _, before = _get(f"{base_url}/uebersicht")
+    assert len(replays) == 1
+
+    with open(files["vap"], "a", encoding="utf-8") as f:
+        f.write("IE00BK5BQT80,Vanguard FTSE All-World Acc ETF,2026,1.0\n")
+    stat = os.stat(files["vap"])
+    os.utime(files["vap"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    _, after = _get(f"{base_url}/uebersicht")
+    # a changed VAP file needs no new FIFO replay of the transactions
+    assert len(replays) == 1
+    assert after["VAP"][-1]["Summe vor TFS"] > before["VAP"][-1]["Summe vor TFS"]
+
+    # an export without changed transactions replays nothing
+    os.utime(files["buchungen"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 2))
+    _get(f"{base_url}/uebersicht")
+    assert len(replays) == 1
@@ -0,0 +1,79 @@
+"""Startup cost: heavy dependencies are only imported by the features that use them."""
+
+import ast
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import columnar
+import main
+
+REPO_DIR = Path(__file__).parent.parent
+DATA_DIR = Path(__file__).parent / "data"
+HEAVY_MODULES = ("numpy", "pandas", "yfinance", "xlsxwriter", "openpyxl")
+
+# self import times of the modules imported by main.py for --help, without interpreter
+# startup (site etc.); generous, as the heavy modules alone take several hundred ms
+HELP_IMPORT_BUDGET_MS = 100
+
+
+def _run_main(*argv: str) -> subprocess.CompletedProcess:
+    code = (
+        "import runpy, sys\n"
+        f"sys.argv = ['main.py', *{list(argv)!r}]\n"
+        "try:\n"
+        "    runpy.run_path('main.py', run_name='__main__')\n"
+        "finally:\n"
+        f"    loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "    print('GELADEN:', loaded, file=sys.stderr)\n"
+    )
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+def _loaded_modules(result: subprocess.CompletedProcess) -> list[str]:
+    return ast.literal_eval(re.search(r"GELADEN: (\[.*\])", result.stderr).group(1))
+
+
+def test_help_imports_no_heavy_modules():
+    result = _run_main("--help")
+    assert "--stapel" in result.stdout
+    assert _loaded_modules(result) == []
+
+    # self import times (µs) of all modules imported after interpreter startup
+    lines = re.findall(r"import time:\s+(\d+) \|\s+\d+ \| *(\S.*)", result.stderr)
+    startup_end = max(i for i, (_, name) in enumerate(lines) if name == "site")
+    import_ms = sum(int(us) for us, _ in lines[startup_end + 1 :]) / 1000
+    assert import_ms < HELP_IMPORT_BUDGET_MS, (
+        f"--help importiert Module für {import_ms:.1f} ms "
+        f"(Budget: {HELP_IMPORT_BUDGET_MS} ms)"
+    )
+
+
+def test_offline_overview_without_forex_and_excel_modules():
+    result = _run_main(
+        "-b",
+        str(DATA_DIR / "Alle_Buchungen.csv"),
+        "-w",
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+        "--metadaten",
+        str(DATA_DIR / "etf_metadaten.csv"),
+        "--vap",
+        str(DATA_DIR / "etf_vorabpauschalen.csv"),
+        "--offline",
+        "--nur-uebersicht",
+    )
+    assert result.returncode == 0, result.stderr
+    assert _loaded_modules(result) == ["numpy", "pandas"]
+
+
+def test_table_formats_match_writers():
+    assert set(main.TABLE_FORMATS) == set(columnar.TABLE_WRITERS)
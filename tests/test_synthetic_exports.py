@@ -0,0 +1,65 @@
+import dataclasses
+
+import pytest
+
+from benchmark import STAGES, compare_results, run_benchmarks
+from pyfifovap import (
+    ForexHelper,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions_into_portfolio,
+)
+from synthetic_exports import ExportSpec, generate_exports, seed_forex_cache
+
+SPEC = ExportSpec(accounts=2, securities=4, years=2, seed=7)
+
+
+@pytest.mark.parametrize("german", [True, False])
+def test_replay_matches_generated_holdings(tmp_path, german):
+    exports = generate_exports(tmp_path, dataclasses.replace(SPEC, german=german))
+    i18n_helper = determine_language_from_transactions_file(
+        str(exports.transactions_file)
+    )
+    assert i18n_helper.is_german == german
+    forex_helper = ForexHelper(offline=True)
+    seed_forex_cache(forex_helper, exports)
+
+    _, name_to_isin = read_etf_metadata(
+        str(exports.metadata_file),
+        i18n_helper,
+        forex_helper,
+        str(exports.securities_file),
+    )
+    portfolio = read_transactions_into_portfolio(
+        str(exports.transactions_file), i18n_helper, forex_helper, name_to_isin
+    )
+    holdings = {
+        (depot, isin): sum(lot.unsold_shares for lot in lots)
+        for depot, lots_by_isin in portfolio.items()
+        for isin, lots in lots_by_isin.items()
+        if lots
+    }
+    assert holdings.keys() == exports.expected_shares.keys()
+    for key, shares in exports.expected_shares.items():
+        assert holdings[key] == pytest.approx(shares)
+
+
+def test_generation_is_reproducible(tmp_path):
+    first = generate_exports(tmp_path / "a", SPEC)
+    second = generate_exports(tmp_path / "b", SPEC)
+    assert first.transactions_file.read_bytes() == second.transactions_file.read_bytes()
+    assert first.vap_file.read_bytes() == second.vap_file.read_bytes()
+
+
+def test_benchmark_results():
+    results = run_benchmarks({"winzig": SPEC}, ["de"], repetitions=1)
+    (run,) = results["ergebnisse"]
+    assert run["groesse"] == "winzig"
+    assert run["buchungen"] > 0
+    assert tuple(run["stufen"]) == STAGES
+    for figures in run["stufen"].values():
+        assert figures["min_sekunden"] > 0
+        assert figures["speicher_spitze_mb"] > 0
+
+    (line, *_) = compare_results(results, results)
+    assert line.endswith("(1.00x)")
@@ -0,0 +1,135 @@
+import datetime
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from sortedcontainers import SortedList
+
+from engine import load_timeline
+from pyfifovap import (
+    ForexHelper,
+    determine_language_from_transactions_file,
+    read_etf_metadata,
+    read_transactions,
+    replay_transactions,
+)
+from synthetic_exports import ExportSpec, generate_exports, seed_forex_cache
+from timeline import PortfolioTimeline, vap_as_of
+
+DATA_DIR = Path(__file__).parent / "data"
+REPO_DIR = Path(__file__).parent.parent
+
+
+def _lots(portfolio) -> dict:
+    return {
+        (broker, isin): [(lot.purchased_index, lot.unsold_shares) for lot in lots]
+        for broker, lots_by_isin in portfolio.items()
+        for isin, lots in lots_by_isin.items()
+        if lots
+    }
+
+
+def test_state_at_matches_replay_up_to_the_date(tmp_path):
+    exports = generate_exports(tmp_path, ExportSpec(accounts=3, securities=4, years=2))
+    i18n_helper = determine_language_from_transactions_file(
+        str(exports.transactions_file)
+    )
+    forex_helper = ForexHelper(offline=True)
+    seed_forex_cache(forex_helper, exports)
+    _, name_to_isin = read_etf_metadata(
+        str(exports.metadata_file),
+        i18n_helper,
+        forex_helper,
+        str(exports.securities_file),
+    )
+    transactions = read_transactions(
+        str(exports.transactions_file), i18n_helper, name_to_isin
+    )
+    timeline = PortfolioTimeline(
+        transactions, i18n_helper, forex_helper, name_to_isin, snapshot_interval=7
+    )
+    assert len(timeline.snapshots) > 3
+
+    dates = sorted(set(timeline.dates))
+    for date in [dates[0] - datetime.timedelta(days=1), *dates[::5], dates[-1]]:
+        expected = defaultdict(lambda: defaultdict(SortedList))
+        replay_transactions(
+            expected,
+            transactions.iloc[: timeline.rows_until(date)],
+            i18n_helper,
+            forex_helper,
+            name_to_isin,
+        )
+        assert _lots(timeline.state_at(date)) == _lots(expected), date
+
+    # states are copies: evaluating one date leaves the snapshots untouched
+    first = timeline.state_at(dates[10])
+    for lots_by_isin in first.values():
+        for lots in lots_by_isin.values():
+            for lot in lots:
+                lot.unsold_shares = 0.0
+    assert _lots(timeline.state_at(dates[10])) != _lots(first)
+    assert {
+        key: sum(shares for _, shares in lots)
+        for key, lots in _lots(timeline.final).items()
+    } == pytest.approx(exports.expected_shares)
+
+
+def test_vap_as_of():
+    vap = {"IE00BK5BQT80": {2022: 1.0, 2023: 2.0, 2024: 3.0}}
+    assert vap_as_of(vap, datetime.date(2024, 6, 30)) == {
+        "IE00BK5BQT80": {2022: 1.0, 2023: 2.0}
+    }
+
+
+def test_stichtag_option(tmp_path):
+    timeline, _, _ = load_timeline(
+        str(DATA_DIR / "Alle_Buchungen.csv"),
+        str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+        str(DATA_DIR / "etf_metadaten.csv"),
+        str(DATA_DIR / "etf_vorabpauschalen.csv"),
+        offline=True,
+    )
+    last_day = max(timeline.dates)
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "main.py",
+            "-b",
+            str(DATA_DIR / "Alle_Buchungen.csv"),
+            "-w",
+            str(DATA_DIR / "Wertpapiere_(Standard).csv"),
+            "--metadaten",
+            str(DATA_DIR / "etf_metadaten.csv"),
+            "--vap",
+            str(DATA_DIR / "etf_vorabpauschalen.csv"),
+            "--offline",
+            "--format",
+            "csv",
+            "-o",
+            str(tmp_path / "Ergebnisse.xlsx"),
+            "--stichtag",
+            "2019-12-31",
+            "--stichtag",
+            last_day.isoformat(),
+        ],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "Stichtag 2019-12-31:" in result.stdout
+
+    early = pd.read_csv(tmp_path / "Ergebnisse_2019-12-31_chargen.csv")
+    late = pd.read_csv(tmp_path / f"Ergebnisse_{last_day.isoformat()}_chargen.csv")
+    assert (pd.to_datetime(early["Datum Kauf"]) <= "2019-12-31").all()
+    assert len(early) < len(late)
+    # the VAP of a year is only levied in the next one
+    assert not any(column.startswith("VAP 20") for column in early.columns)
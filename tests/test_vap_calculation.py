@@ -0,0 +1,136 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from i18n_helper import I18nHelper
+from price_history import PriceHistory
+from pyfifovap import read_vap
+from vap_calculation import (
+    compute_vap,
+    merge_vap,
+    read_basiszins,
+    read_distributions,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+REPO_DIR = Path(__file__).parent.parent
+
+BASISZINS = {2021: -0.0045, 2022: -0.0005, 2023: 0.0255, 2024: 0.0229}
+
+
+def history(rows: list[tuple[str, str, float]]) -> PriceHistory:
+    return PriceHistory.from_frame(
+        pd.DataFrame(rows, columns=["ISIN", "Datum", "Kurs"])
+    )
+
+
+def test_formula_for_all_funds_and_years():
+    prices = history(
+        [
+            # capped by the Basisertrag in 2023, by the value gain in 2024
+            ("ACC", "2022-12-30", 100.0),
+            ("ACC", "2023-12-29", 110.0),
+            ("ACC", "2024-12-30", 111.0),
+            # loss: no VAP
+            ("LOSS", "2022-12-30", 100.0),
+            ("LOSS", "2023-12-29", 90.0),
+            # launched in 2023: no price at the year start
+            ("NEW", "2023-06-01", 50.0),
+            ("NEW", "2023-12-29", 55.0),
+            ("NEW", "2024-12-30", 60.0),
+        ]
+    )
+    vap = compute_vap(prices, BASISZINS, until_year=2024)
+    assert vap["ACC"] == pytest.approx({2023: 100 * 0.0255 * 0.7, 2024: 1.0})
+    assert vap["LOSS"] == {2023: 0.0}
+    assert vap["NEW"] == pytest.approx({2024: 55 * 0.0229 * 0.7})
+    # the first year of a history is not complete
+    assert 2022 not in vap["ACC"]
+
+
+def test_distributions_negative_basiszins_and_limits():
+    prices = history(
+        [
+            ("DIST", "2020-12-31", 100.0),
+            ("DIST", "2021-12-31", 120.0),
+            ("DIST", "2022-12-30", 100.0),
+            ("DIST", "2023-12-29", 105.0),
+            ("DIST", "2024-12-30", 103.0),
+            ("DIST", "2025-12-30", 110.0),
+        ]
+    )
+    distributions = {"DIST": {2023: 0.5, 2024: 3.0}}
+    vap = compute_vap(prices, BASISZINS, distributions, ["DIST", "OTHER"], 2025)
+    assert vap["DIST"] == pytest.approx(
+        {
+            # negative Basiszins: no Basisertrag
+            2021: 0.0,
+            2022: 0.0,
+            2023: 100 * 0.0255 * 0.7 - 0.5,
+            # distribution exceeds the capped Basisertrag
+            2024: 0.0,
+        }
+    )
+    # no Basiszins for 2025, no prices for OTHER
+    assert "OTHER" not in vap
+    assert compute_vap(prices, BASISZINS, until_year=2019) == {}
+
+
+def test_merge_prefers_vap_file():
+    computed = {"A": {2023: 1.0, 2024: 2.0}, "B": {2024: 3.0}}
+    from_file = {"A": {2024: 2.5}}
+    merged = merge_vap(computed, from_file)
+    assert merged == {"A": {2023: 1.0, 2024: 2.5}, "B": {2024: 3.0}}
+    assert merged["C"][2024] == 0.0
+
+
+def test_read_tables(tmp_path):
+    assert read_basiszins(REPO_DIR / "basiszins.csv")[2024] == pytest.approx(0.0229)
+    path = tmp_path / "ausschuettungen.csv"
+    path.write_text(
+        "ISIN,Datum,Ausschüttung pro Anteil\n"
+        "IE00B3RBWM25,2024-03-27,0.25\n"
+        "IE00B3RBWM25,2024-06-26,0.5\n"
+        "IE00B3RBWM25,2025-03-26,0.3\n",
+        encoding="utf-8",
+    )
+    assert read_distributions(path) == {
+        "IE00B3RBWM25": pytest.approx({2024: 0.75, 2025: 0.3})
+    }
+
+
+def test_cli_writes_vap_file(tmp_path):
+    (tmp_path / "kurse.csv").write_text(
+        "ISIN,Datum,Kurs\n"
+        "IE00BK5BQT80,2022-12-30,100\n"
+        "IE00BK5BQT80,2023-12-29,110\n"
+        "US0378331005,2022-12-30,130\n"
+        "US0378331005,2023-12-29,190\n",
+        encoding="utf-8",
+    )
+    result = subprocess.run(
+        [
+            sys.executable,
+            "vap_calculation.py",
+            str(tmp_path / "kurse.csv"),
+            "--metadaten",
+            str(DATA_DIR / "etf_metadaten.csv"),
+            "--bis-jahr",
+            "2023",
+            "--ausgabe",
+            str(tmp_path / "vap.csv"),
+        ],
+        cwd=REPO_DIR,
+        env=os.environ | {"PYTHONPATH": str(REPO_DIR)},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    # only funds of the metadata file, readable as VAP file
+    vap = read_vap(str(tmp_path / "vap.csv"), I18nHelper())
+    assert dict(vap) == {"IE00BK5BQT80": pytest.approx({2023: 1.785})}
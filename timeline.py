@@ -0,0 +1,114 @@
+"""Chargen zu einem beliebigen Stichtag (--stichtag).
+
+Die Buchungen werden einmal in Replay-Reihenfolge verarbeitet; dabei wird alle
+`snapshot_interval` Buchungszeilen eine Kopie der Chargen-Reihen abgelegt. Der Stand zu
+einem Stichtag entsteht aus dem letzten Snapshot vor dem Stichtag und dem Replay der
+wenigen Buchungen danach, d. h. viele Stichtage kosten je höchstens `snapshot_interval`
+Buchungen statt der ganzen Historie.
+
+Ein Stichtag umfasst alle Buchungen bis einschließlich dieses Tages.
+"""
+
+import bisect
+import dataclasses
+import datetime
+from collections import defaultdict
+
+import pandas as pd
+from sortedcontainers import SortedList
+
+from i18n_helper import I18nHelper
+from pyfifovap import ForexHelper, replay_transactions, warn_about_isin_name_collisions
+
+SNAPSHOT_INTERVAL = 1000
+
+
+def copy_portfolio(
+    portfolio: defaultdict[str, defaultdict[str, SortedList]],
+) -> defaultdict[str, defaultdict[str, SortedList]]:
+    """Copy the queues and their lots, so that replaying on the copy leaves `portfolio` as is."""
+    copied: defaultdict[str, defaultdict[str, SortedList]] = defaultdict(
+        lambda: defaultdict(SortedList)
+    )
+    for broker, lots_by_isin in portfolio.items():
+        for isin, lots in lots_by_isin.items():
+            copied[broker][isin] = SortedList(dataclasses.replace(lot) for lot in lots)
+    return copied
+
+
+def vap_as_of(
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    date: datetime.date,
+) -> defaultdict[str, defaultdict[int, float]]:
+    """The VAP already levied at `date`: the VAP of a year is levied early in the next year."""
+    levied: defaultdict[str, defaultdict[int, float]] = defaultdict(
+        lambda: defaultdict(float)
+    )
+    for isin, vap_by_year in vap_by_isin_and_year.items():
+        for year, vap in vap_by_year.items():
+            if year < date.year:
+                levied[isin][year] = vap
+    return levied
+
+
+class PortfolioTimeline:
+    """Lot queues after any prefix of the sorted transactions, restored from snapshots."""
+
+    def __init__(
+        self,
+        transactions: pd.DataFrame,
+        i18n_helper: I18nHelper,
+        forex_helper: ForexHelper,
+        name_to_isin: dict[str, str],
+        snapshot_interval: int = SNAPSHOT_INTERVAL,
+    ):
+        """`transactions` as returned by read_transactions (sorted for the replay)."""
+        if snapshot_interval < 1:
+            raise ValueError("snapshot_interval muss mindestens 1 sein")
+        self.transactions = transactions
+        self.i18n_helper = i18n_helper
+        self.forex_helper = forex_helper
+        self.name_to_isin = name_to_isin
+        # replay order is date order, so the number of rows up to a day is a bisection
+        self.dates = [
+            datetime.datetime.fromisoformat(value).date()
+            for value in transactions[i18n_helper.get_pp_names().DATE]
+        ]
+
+        portfolio = defaultdict(lambda: defaultdict(SortedList))
+        # copies of the queues after the first snapshot_rows[i] rows
+        self.snapshot_rows: list[int] = [0]
+        self.snapshots: list[defaultdict] = [copy_portfolio(portfolio)]
+        for start in range(0, len(transactions), snapshot_interval):
+            end = min(start + snapshot_interval, len(transactions))
+            self._replay(portfolio, start, end)
+            if end < len(transactions):
+                self.snapshot_rows.append(end)
+                self.snapshots.append(copy_portfolio(portfolio))
+        warn_about_isin_name_collisions(portfolio)
+        self.final = portfolio
+
+    def _replay(self, portfolio, start: int, end: int) -> None:
+        replay_transactions(
+            portfolio,
+            self.transactions.iloc[start:end],
+            self.i18n_helper,
+            self.forex_helper,
+            self.name_to_isin,
+        )
+
+    def rows_until(self, date: datetime.date) -> int:
+        """Number of transaction rows on or before `date`."""
+        return bisect.bisect_right(self.dates, date)
+
+    def state_at(
+        self, date: datetime.date
+    ) -> defaultdict[str, defaultdict[str, SortedList]]:
+        """The lot queues after all transactions on or before `date` (a new copy)."""
+        rows = self.rows_until(date)
+        if rows == len(self.transactions):
+            return copy_portfolio(self.final)
+        position = bisect.bisect_right(self.snapshot_rows, rows) - 1
+        portfolio = copy_portfolio(self.snapshots[position])
+        self._replay(portfolio, self.snapshot_rows[position], rows)
+        return portfolio
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Vorabpauschale vor TFS pro Anteil aus Kurshistorie, Basiszins und Ausschüttungen.
+
+Je Fonds und Jahr des Wertzuwachses:
+    Basisertrag = Kurs am Jahresanfang * Basiszins * 0,7
+    VAP = max(min(Basisertrag, Kurs am Jahresende - Kurs am Jahresanfang + Ausschüttungen)
+              - Ausschüttungen, 0)
+
+Kurs am Jahresanfang ist der letzte Kurs vor dem 1. Januar, Kurs am Jahresende der letzte
+Kurs bis zum 31. Dezember; Jahre ohne Kurs vor dem 1. Januar (z. B. das Jahr der Auflage
+eines Fonds) werden nicht berechnet und bleiben der VAP-Datei überlassen. Die Kurse werden
+als EUR angenommen. Die Anteile an der VAP für im Jahr gekaufte Chargen
+ergeben sich wie bei Werten aus etf_vorabpauschalen.csv erst in der Auswertung.
+
+Alle Fonds und Jahre werden auf einmal als Matrix (Fonds x Jahre) berechnet. Das Ergebnis
+hat dieselbe Form wie read_vap(); Werte aus etf_vorabpauschalen.csv haben Vorrang
+(merge_vap).
+
+Beispiel (berechnete Werte als CSV im Format von etf_vorabpauschalen.csv):
+   python vap_calculation.py Kursindex/ --ausschuettungen ausschuettungen.csv
+"""
+
+import argparse
+import datetime
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from i18n_helper import I18nHelper
+from price_history import EPOCH, PriceHistory, read_price_history
+from profiling import stage
+from projection import vap_per_share_before_tfs
+
+BASISZINS_FILE = "basiszins.csv"
+
+
+def read_basiszins(path: str | Path = BASISZINS_FILE) -> dict[int, float]:
+    """Basiszins per year as fraction (the file holds percent: 2.29 -> 0.0229)."""
+    custom_names = I18nHelper().get_custom_csv_names()
+    data = pd.read_csv(path)
+    return {
+        int(year): float(percent) / 100
+        for year, percent in zip(
+            data[custom_names.JAHR], data[custom_names.BASISZINS_PROZENT]
+        )
+    }
+
+
+def read_distributions(path: str | Path) -> dict[str, dict[int, float]]:
+    """Distributions per share from a CSV (ISIN, Datum, Ausschüttung pro Anteil), summed per year."""
+    custom_names = I18nHelper().get_custom_csv_names()
+    data = pd.read_csv(path, dtype={custom_names.ISIN: str})
+    years = pd.to_datetime(data[custom_names.DATUM]).dt.year
+    sums = (
+        data[custom_names.AUSSCHUETTUNG_PRO_ANTEIL]
+        .astype(float)
+        .groupby([data[custom_names.ISIN], years])
+        .sum()
+    )
+    distributions: dict[str, dict[int, float]] = defaultdict(dict)
+    for (isin, year), amount in sums.items():
+        distributions[isin][int(year)] = float(amount)
+    return dict(distributions)
+
+
+@stage("vap_berechnen")
+def compute_vap(
+    price_history: PriceHistory,
+    basiszins_by_year: dict[int, float],
+    distributions: Optional[dict[str, dict[int, float]]] = None,
+    isins: Optional[Iterable[str]] = None,
+    until_year: Optional[int] = None,
+) -> defaultdict[str, defaultdict[int, float]]:
+    """
+    VAP vor TFS pro Anteil for all `isins` (default: all of the history) and years.
+
+    Only complete years up to `until_year` (default: last year) with a Basiszins and
+    prices at year start and end are returned.
+    """
+    distributions = distributions or {}
+    isins = [
+        isin
+        for isin in (price_history.isins if isins is None else isins)
+        if isin in price_history
+    ]
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]] = defaultdict(
+        lambda: defaultdict(float)
+    )
+    if until_year is None:
+        until_year = datetime.date.today().year - 1
+    if not isins:
+        return vap_by_isin_and_year
+    first_day = min(
+        int(price_history.days[price_history.ranges[isin][0]]) for isin in isins
+    )
+    years = list(
+        range((EPOCH + datetime.timedelta(days=first_day)).year, until_year + 1)
+    )
+    if not years:
+        return vap_by_isin_and_year
+
+    # prices[i, j] is the price of isins[i] at the end of year years[0] - 1 + j
+    year_ends = [datetime.date(year, 12, 31) for year in [years[0] - 1, *years]]
+    prices = np.stack([price_history.prices_at(isin, year_ends) for isin in isins])
+    # a year ends with its own price only if the history has prices within the year
+    end_days = np.array([(date - EPOCH).days for date in year_ends])
+    prices_until = np.stack(
+        [
+            np.searchsorted(
+                price_history.days[slice(*price_history.ranges[isin])],
+                end_days,
+                side="right",
+            )
+            for isin in isins
+        ]
+    )
+    prices[:, 1:][np.diff(prices_until, axis=1) == 0] = np.nan
+    basiszins = np.array([basiszins_by_year.get(year, np.nan) for year in years])
+    paid = np.array(
+        [
+            [distributions.get(isin, {}).get(year, 0.0) for year in years]
+            for isin in isins
+        ]
+    )
+
+    # NaN (no price or no Basiszins) propagates to the VAP of the year
+    vap = vap_per_share_before_tfs(prices, np.maximum(basiszins, 0.0), paid)
+    for i, j in zip(*np.nonzero(~np.isnan(vap))):
+        vap_by_isin_and_year[isins[i]][years[j]] = float(vap[i, j])
+    return vap_by_isin_and_year
+
+
+def merge_vap(
+    computed: defaultdict[str, defaultdict[int, float]],
+    from_file: defaultdict[str, defaultdict[int, float]],
+) -> defaultdict[str, defaultdict[int, float]]:
+    """The computed VAP, overridden by all entries of the VAP file."""
+    merged: defaultdict[str, defaultdict[int, float]] = defaultdict(
+        lambda: defaultdict(float)
+    )
+    for vap_by_isin_and_year in (computed, from_file):
+        for isin, vap_by_year in vap_by_isin_and_year.items():
+            merged[isin].update(vap_by_year)
+    return merged
+
+
+def vap_frame(
+    vap_by_isin_and_year: defaultdict[str, defaultdict[int, float]],
+    names: dict[str, str],
+) -> pd.DataFrame:
+    """The VAP in the format of etf_vorabpauschalen.csv."""
+    custom_names = I18nHelper().get_custom_csv_names()
+    return pd.DataFrame(
+        [
+            {
+                custom_names.ISIN: isin,
+                custom_names.NAME: names.get(isin, ""),
+                custom_names.JAHR_DES_WERTZUWACHES: year,
+                custom_names.VAP_VOR_TFS_PRO_ANTEIL: round(vap, 9),
+            }
+            for isin, vap_by_year in vap_by_isin_and_year.items()
+            for year, vap in sorted(vap_by_year.items())
+        ],
+        columns=[
+            custom_names.ISIN,
+            custom_names.NAME,
+            custom_names.JAHR_DES_WERTZUWACHES,
+            custom_names.VAP_VOR_TFS_PRO_ANTEIL,
+        ],
+    )
+
+
+def main():
+    from pyfifovap import read_tfs_metadata
+
+    parser = argparse.ArgumentParser(
+        description="Vorabpauschalen vor TFS pro Anteil aller Fonds der Metadaten aus einer "
+        "Kurshistorie berechnen und im Format von etf_vorabpauschalen.csv schreiben"
+    )
+    parser.add_argument(
+        "kurshistorie",
+        help="Kurshistorie wie bei --kurshistorie (Datei oder Verzeichnis)",
+    )
+    parser.add_argument(
+        "--basiszins",
+        metavar="FILE",
+        default=BASISZINS_FILE,
+        help=f"CSV mit den Spalten Jahr, Basiszins in Prozent (Standard: {BASISZINS_FILE})",
+    )
+    parser.add_argument(
+        "--ausschuettungen",
+        metavar="FILE",
+        help="CSV mit den Spalten ISIN, Datum, Ausschüttung pro Anteil (EUR)",
+    )
+    parser.add_argument(
+        "--metadaten",
+        metavar="FILE",
+        default="etf_metadaten.csv",
+        help="Fonds, für die gerechnet wird (Standard: etf_metadaten.csv)",
+    )
+    parser.add_argument(
+        "--bis-jahr",
+        metavar="JAHR",
+        type=int,
+        help="Letztes Jahr des Wertzuwachses (Standard: Vorjahr)",
+    )
+    parser.add_argument(
+        "--ausgabe",
+        metavar="FILE",
+        default="etf_vorabpauschalen_berechnet.csv",
+        help="Ergebnis-CSV (Standard: etf_vorabpauschalen_berechnet.csv)",
+    )
+    args = parser.parse_args()
+
+    metadata_by_isin = read_tfs_metadata(args.metadaten, I18nHelper())
+    vap_by_isin_and_year = compute_vap(
+        read_price_history(args.kurshistorie),
+        read_basiszins(args.basiszins),
+        read_distributions(args.ausschuettungen) if args.ausschuettungen else None,
+        [
+            isin
+            for isin, metadata in metadata_by_isin.items()
+            if metadata.tfs_percentage
+        ],
+        args.bis_jahr,
+    )
+    names = {isin: metadata.name for isin, metadata in metadata_by_isin.items()}
+    vap_frame(vap_by_isin_and_year, names).to_csv(args.ausgabe, index=False)
+    print(
+        f"Vorabpauschalen für {len(vap_by_isin_and_year)} Fonds nach {args.ausgabe} "
+        "geschrieben"
+    )
+
+
+if __name__ == "__main__":
+    main()